@@ -0,0 +1,472 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageDraw
+import fake_replicate
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+BENCH_DIR = "bench"                      # Рабочая папка: корпус, результаты шагов, логи
+BASELINE_PATH = "bench_baseline.json"    # Сохраненный эталон, с которым сравниваются новые прогоны
+
+# Синтетический корпус (одинаковый seed — одинаковые фото)
+CORPUS_COUNT = 24
+CORPUS_SEED = 1
+CORPUS_SIZES = ((832, 1248), (1664, 2496), (600, 900), (1200, 1200))
+CORPUS_MODES = ("RGB", "RGBA", "L", "P")  # Для JPG берутся только RGB / L
+CORPUS_FORMATS = ("png", "jpg")           # Те, что умеет шаг удаления вотермарок
+CORPUS_CORNERS = ("bottom-right", "bottom-right", "none", "bottom-left")  # Где вотермарка (none — чистое фото)
+
+# Настройки WB для бенчмарка (как в скриптах)
+TARGET_W, TARGET_H = 900, 1200
+QUALITY = 95
+
+BENCH_CONCURRENT = 8           # Стартовый лимит апскейла в бенчмарке
+REGRESSION_THRESHOLD = 0.10    # Хуже эталона больше чем на 10% — регрессия
+
+STAGES = ("detect", "inpaint", "upscale", "wb", "upscale_wb", "pipeline")
+
+# ==========================================
+
+
+# ---------- Синтетический корпус ----------
+
+def textured_background(rng, width, height):
+    """Фон с крупными пятнами и шумом: у JPEG / PNG / LANCZOS есть над чем поработать"""
+    import cv2
+
+    base = rng.integers(0, 256, (height // 48 + 2, width // 48 + 2, 3), dtype=np.uint8)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    img += rng.integers(-18, 18, (height, width, 3), dtype=np.int16)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def draw_watermark(img, corner):
+    """Полупрозрачный белый ромбик (как на исходных фото), размер пропорционален фото"""
+    if corner == "none":
+        return img
+    scale = min(img.width / 832, img.height / 1248)
+    r = 28 * scale
+    cx = img.width - 50 * scale if corner.endswith("right") else 50 * scale
+    cy = img.height - 50 * scale if corner.startswith("bottom") else 50 * scale
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    ImageDraw.Draw(overlay).polygon([(cx, cy - r), (cx + r * 0.6, cy), (cx, cy + r), (cx - r * 0.6, cy)], fill=(255, 255, 255, 150))
+    return Image.alpha_composite(img.convert("RGBA"), overlay).convert("RGB")
+
+
+def make_corpus(folder, count=CORPUS_COUNT, seed=CORPUS_SEED):
+    """
+    Воспроизводимый корпус: размеры, режимы, форматы и углы вотермарки идут по кругу,
+    пиксели — из генератора с seed. Рядом кладется manifest.json с описанием каждого фото.
+    """
+    folder = Path(folder)
+    manifest_path = folder / "manifest.json"
+    spec = {"count": count, "seed": seed, "sizes": CORPUS_SIZES, "modes": CORPUS_MODES, "formats": CORPUS_FORMATS, "corners": CORPUS_CORNERS}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["spec"] == json.loads(json.dumps(spec)):
+            return manifest  # Уже сгенерирован с теми же настройками
+    if folder.exists():
+        shutil.rmtree(folder)
+    folder.mkdir(parents=True)
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        width, height = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        fmt = CORPUS_FORMATS[i % len(CORPUS_FORMATS)]
+        mode = CORPUS_MODES[i % len(CORPUS_MODES)]
+        if fmt == "jpg" and mode not in ("RGB", "L"):
+            mode = "RGB"
+        corner = CORPUS_CORNERS[i % len(CORPUS_CORNERS)]
+
+        img = draw_watermark(textured_background(rng, width, height), corner)
+        if mode == "RGBA":
+            img.putalpha(255)
+        elif mode != "RGB":
+            img = img.convert(mode)
+        name = f"bench_{i:03d}.{fmt}"
+        img.save(folder / name, quality=92) if fmt == "jpg" else img.save(folder / name)
+        images.append({"name": name, "size": [width, height], "mode": mode, "format": fmt, "corner": corner})
+
+    manifest = {"spec": spec, "images": images}
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+# ---------- Измерения ----------
+
+def peak_rss_mb():
+    """Пиковая память процесса и его дочерних процессов (МБ); None там, где нет resource (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024  # На macOS ru_maxrss в байтах, на Linux — в КБ
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 / 1024
+    return round(own, 1), round(children, 1)
+
+
+def summarize(latencies, seconds, ok=None, images=None):
+    """Готовые фото в секунду и p50/p95/p99 задержки одного фото (мс)"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    ok = len(latencies) if ok is None else ok
+    result = {
+        "images": int(len(latencies) if images is None else images),
+        "ok": int(ok),
+        "seconds": round(seconds, 3),
+        "images_per_s": round(ok / seconds, 3) if seconds else 0.0,
+    }
+    for p in (50, 95, 99):
+        result[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 1) if len(latencies) else None
+    return result
+
+
+def corpus_images(corpus_dir):
+    manifest = json.loads((Path(corpus_dir) / "manifest.json").read_text())
+    return [Path(corpus_dir) / item["name"] for item in manifest["images"]], manifest
+
+
+def finish_times(folder, started, names):
+    """Когда появился каждый результат (по mtime) — задержка фото от старта прогона"""
+    latencies = []
+    for name in names:
+        path = Path(folder) / name
+        if path.exists():
+            latencies.append(path.stat().st_mtime - started)
+    return latencies
+
+
+# ---------- Шаги ----------
+
+def bench_detect(corpus_dir, work_dir, server_url):
+    """Поиск вотермарки: шаблон снимается с помеченных фото корпуса, потом ищется на всех"""
+    from photo_pipeline import watermark_detect
+
+    images, manifest = corpus_images(corpus_dir)
+    marked = [p for p, item in zip(images, manifest["images"]) if item["corner"] == "bottom-right"]
+    template = watermark_detect.learn_profile(marked)
+    detector = watermark_detect.WatermarkDetector([watermark_detect.WatermarkProfile("bench", np.asarray(template.getchannel("A")).copy())])
+
+    latencies, hits, correct = [], 0, 0
+    started = time.perf_counter()
+    for img_path, item in zip(images, manifest["images"]):
+        t = time.perf_counter()
+        with Image.open(img_path) as img:
+            img = img.convert("RGB")
+            found = detector.mask_for(img) is not None
+        latencies.append(time.perf_counter() - t)
+        hits += found
+        correct += found == (item["corner"] == "bottom-right")
+    result = summarize(latencies, time.perf_counter() - started)
+    result.update(found=hits, accuracy=round(correct / len(images), 3))
+    return result
+
+
+def bench_inpaint(corpus_dir, work_dir, server_url):
+    """LaMa на каждом фото с фиксированной маской (как без автопоиска)"""
+    from photo_pipeline import inpaint_engine
+
+    images, _ = corpus_images(corpus_dir)
+    try:
+        engine = inpaint_engine.get_engine()
+    except ImportError as e:
+        return {"skipped": f"нет iopaint/torch: {e}"}
+
+    mask = Image.new("L", (832, 1248), 0)
+    ImageDraw.Draw(mask).rectangle([732, 1148, 832, 1248], fill=255)
+    out_dir = Path(work_dir) / "clean"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    latencies = []
+    started = time.perf_counter()
+    for img_path in images:
+        t = time.perf_counter()
+        engine.inpaint_file(img_path, mask, out_dir)
+        latencies.append(time.perf_counter() - t)
+    result = summarize(latencies, time.perf_counter() - started)
+    result["load_seconds"] = round(engine.load_seconds, 2)
+    return result
+
+
+def configure_pipeline(corpus_dir, work_dir):
+    """Настройки pipeline под рабочую папку бенчмарка (процесс шага отдельный, так что можно)"""
+    from photo_pipeline import pipeline
+
+    work_dir = Path(work_dir)
+    pipeline.configure(
+        input_dir=str(corpus_dir),
+        clean_dir=str(work_dir / "clean"),
+        final_dir=str(work_dir / "upscaled"),
+        wb_dir=str(work_dir / "wb"),
+        mask_path=str(work_dir / "mask.png"),
+        cache_dir=str(work_dir / "cache"),
+        ledger_path=str(work_dir / "ledger.sqlite3"),
+        target_w=TARGET_W, target_h=TARGET_H, quality=QUALITY,
+        upscale_min_factor=0,            # Все фото — через апскейл (иначе корпус уйдет в ресайз без сервера)
+        upscale_backend="replicate",
+        start_concurrent=BENCH_CONCURRENT,
+        auto_detect=False,
+    )
+    for folder in (pipeline.CLEAN_DIR, pipeline.FINAL_DIR, pipeline.WB_DIR):
+        os.makedirs(folder, exist_ok=True)
+    return pipeline
+
+
+def bench_upscale(corpus_dir, work_dir, server_url):
+    """Апскейл через фейковый Replicate тем же кодом, что в photo_pipeline.pipeline (лимит, загрузка, повторы)"""
+    from photo_pipeline import job_ledger
+    from photo_pipeline import upscale_cache
+    from photo_pipeline import payload_upload
+
+    pipeline = configure_pipeline(corpus_dir, work_dir)
+    images, _ = corpus_images(corpus_dir)
+    ledger = job_ledger.JobLedger(pipeline.LEDGER_PATH)
+
+    async def run():
+        limiter = pipeline.create_limiter()
+        planner = pipeline.create_planner()
+        cache = upscale_cache.UpscaleCache(pipeline.CACHE_DIR, pipeline.CACHE_MAX_GB)
+        client, transport = pipeline.create_async_client()
+        uploader = payload_upload.PayloadUploader(client, pipeline.UPLOAD_FORMATS)
+        remote = pipeline.create_remote(client, limiter, uploader)
+
+        async def one(i, img_path):
+            t = time.perf_counter()
+            ok = await pipeline.upscale_single_image(img_path, limiter, len(images), i + 1, cache, remote, ledger, planner)
+            return ok, time.perf_counter() - t
+
+        try:
+            return await asyncio.gather(*(one(i, p) for i, p in enumerate(images))), limiter
+        finally:
+            await transport.aclose()
+
+    started = time.perf_counter()
+    results, limiter = asyncio.run(run())
+    ledger.close()
+    result = summarize([seconds for _, seconds in results], time.perf_counter() - started, sum(ok for ok, _ in results))
+    result.update(final_limit=limiter.current, throttled=limiter.throttled)
+    return result
+
+
+def bench_wb(corpus_dir, work_dir, server_url):
+    """Ресайз + кроп + JPG(optimize) в одном процессе, фото за фото"""
+    from photo_pipeline import wb_prepare
+
+    images, _ = corpus_images(corpus_dir)
+    out_dir = Path(work_dir) / "wb"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    latencies = []
+    started = time.perf_counter()
+    for img_path in images:
+        t = time.perf_counter()
+        wb_prepare.prepare_image(img_path, out_dir, TARGET_W, TARGET_H, QUALITY)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_upscale_wb(corpus_dir, work_dir, server_url):
+    """Режим "шаг за шагом" без LaMa: корпус считается уже очищенным, апскейл → WB"""
+    from photo_pipeline import job_ledger
+
+    pipeline = configure_pipeline(corpus_dir, work_dir)
+    pipeline.configure(clean_dir=str(corpus_dir))
+    images, _ = corpus_images(corpus_dir)
+    ledger = job_ledger.JobLedger(pipeline.LEDGER_PATH)
+
+    started_wall, started = time.time(), time.perf_counter()
+    asyncio.run(pipeline.step_2_upscale_async(ledger))
+    pipeline.step_3_prepare_for_wb(ledger)
+    seconds = time.perf_counter() - started
+    ledger.close()
+
+    latencies = finish_times(pipeline.WB_DIR, started_wall, [f"upscaled_{p.stem}.jpg" for p in images])
+    return summarize(latencies, seconds, images=len(images))
+
+
+def bench_pipeline(corpus_dir, work_dir, server_url):
+    """Весь потоковый конвейер photo_pipeline.pipeline: LaMa → апскейл → WB"""
+    from photo_pipeline import job_ledger
+
+    try:
+        import torch  # noqa: F401
+        import iopaint  # noqa: F401
+    except ImportError as e:
+        return {"skipped": f"нет iopaint/torch: {e}"}
+
+    pipeline = configure_pipeline(corpus_dir, work_dir)
+    pipeline.generate_mask()
+    images, _ = corpus_images(corpus_dir)
+    ledger = job_ledger.JobLedger(pipeline.LEDGER_PATH)
+
+    started_wall, started = time.time(), time.perf_counter()
+    asyncio.run(pipeline.run_streaming_pipeline(ledger))
+    seconds = time.perf_counter() - started
+    ledger.close()
+
+    latencies = finish_times(pipeline.WB_DIR, started_wall, [f"upscaled_{p.stem}.jpg" for p in images])
+    return summarize(latencies, seconds, images=len(images))
+
+
+BENCHMARKS = {
+    "detect": bench_detect,
+    "inpaint": bench_inpaint,
+    "upscale": bench_upscale,
+    "wb": bench_wb,
+    "upscale_wb": bench_upscale_wb,
+    "pipeline": bench_pipeline,
+}
+
+
+def run_stage(stage, corpus_dir, work_dir, server_url, log_path):
+    """
+    Один шаг в своем процессе: пиковая память не смешивается между шагами,
+    а настройки скриптов можно менять, не трогая остальные шаги. Вывод шага — в лог.
+    """
+    os.environ["REPLICATE_BASE_URL"] = server_url
+    os.environ["REPLICATE_API_TOKEN"] = "bench"
+    if Path(work_dir).exists():
+        shutil.rmtree(work_dir)
+    Path(work_dir).mkdir(parents=True)
+
+    with open(log_path, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        result = BENCHMARKS[stage](corpus_dir, work_dir, server_url)
+    own, children = peak_rss_mb()
+    if "skipped" not in result:
+        result.update(peak_rss_mb=own, children_peak_rss_mb=children)
+    return result
+
+
+def server_stats(server_url):
+    import httpx
+
+    return httpx.get(f"{server_url}/stats").json()
+
+
+# ---------- Эталон ----------
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Сравнение с эталоном: печатает изменения и возвращает список регрессий"""
+    regressions = []
+    print(f"\n📏 Сравнение с эталоном от {baseline.get('created', '?')}:")
+    for stage, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or "skipped" in before or "skipped" in current:
+            continue
+        parts = []
+        # (метрика, больше = лучше)
+        for metric, higher_is_better in (("images_per_s", True), ("p95_ms", False), ("peak_rss_mb", False)):
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            mark = "🔴" if worse > threshold else ("🟢" if worse < -threshold else "⚪")
+            parts.append(f"{mark} {metric} {old} → {new} ({change:+.0%})")
+            if worse > threshold:
+                regressions.append(f"{stage}.{metric}")
+        print(f"   {stage}: " + ", ".join(parts))
+    return regressions
+
+
+def print_results(results):
+    print("\n📊 Результаты:")
+    for stage, result in results["stages"].items():
+        if "skipped" in result:
+            print(f"   {stage}: ⏭️  пропущен ({result['skipped']})")
+            continue
+        print(f"   {stage}: {result['ok']}/{result['images']} фото за {result['seconds']} сек → {result['images_per_s']} фото/сек, "
+              f"p50 {result['p50_ms']} / p95 {result['p95_ms']} / p99 {result['p99_ms']} мс, "
+              f"пик памяти {result.get('peak_rss_mb')} МБ (+ дочерние {result.get('children_peak_rss_mb')} МБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк шагов и всего конвейера на синтетическом корпусе и фейковом Replicate")
+    parser.add_argument("stages", nargs="*", default=list(STAGES), metavar="stage",
+                        help=f"Какие шаги мерить: {', '.join(STAGES)} (по умолчанию все)")
+    parser.add_argument("--count", type=int, default=CORPUS_COUNT, help="Сколько фото в корпусе")
+    parser.add_argument("--seed", type=int, default=CORPUS_SEED)
+    parser.add_argument("--latency", type=float, default=fake_replicate.FAKE_LATENCY, help="Задержка фейкового API (сек)")
+    parser.add_argument("--rate-429", type=float, default=fake_replicate.FAKE_429_RATE)
+    parser.add_argument("--error-rate", type=float, default=fake_replicate.FAKE_ERROR_RATE)
+    parser.add_argument("--max-concurrent", type=int, default=fake_replicate.FAKE_MAX_CONCURRENT)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Файл эталона")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить этот прогон как эталон")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Код выхода 1, если есть регрессии")
+    args = parser.parse_args()
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"неизвестные шаги: {', '.join(sorted(unknown))}")
+
+    bench_dir = Path(BENCH_DIR)
+    corpus_dir = bench_dir / "corpus"
+    (bench_dir / "logs").mkdir(parents=True, exist_ok=True)
+    print(f"🧪 Корпус: {args.count} фото (seed {args.seed}) в {corpus_dir}")
+    make_corpus(corpus_dir, args.count, args.seed)
+
+    # spawn: шаги и сервер стартуют с чистой памятью и своими настройками модулей
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    server = context.Process(target=fake_replicate.serve, args=(ready,), kwargs={
+        "port": 0, "latency": args.latency, "rate_429": args.rate_429,
+        "error_rate": args.error_rate, "max_concurrent": args.max_concurrent,
+    }, daemon=True)
+    server.start()
+    server_url = ready.get(timeout=30)
+    print(f"🛰️  Фейковый Replicate: {server_url} (задержка {args.latency} сек, 429 {args.rate_429:.0%}, ошибки {args.error_rate:.0%})")
+
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "corpus": {"count": args.count, "seed": args.seed},
+        "fake": {"latency": args.latency, "rate_429": args.rate_429, "error_rate": args.error_rate, "max_concurrent": args.max_concurrent},
+        "stages": {},
+    }
+    try:
+        for stage in args.stages:
+            print(f"⏱️  {stage}...")
+            before = server_stats(server_url)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_stage, stage, str(corpus_dir), str(bench_dir / "work" / stage), server_url, str(bench_dir / "logs" / f"{stage}.log")).result()
+            after = server_stats(server_url)
+            if after["predictions"] + after["throttled"] > before["predictions"] + before["throttled"]:
+                result["server"] = {key: after[key] - before[key] for key in ("files", "predictions", "throttled", "failed", "bytes_in", "bytes_out")}
+            results["stages"][stage] = result
+    finally:
+        server.terminate()
+
+    print_results(results)
+    results_path = bench_dir / f"results_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    results_path.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"\n💾 Результаты: {results_path} (логи шагов: {bench_dir / 'logs'})")
+
+    regressions = []
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists():
+        regressions = compare(results, json.loads(baseline_path.read_text()))
+        if regressions:
+            print(f"   ⚠️  Регрессии: {', '.join(regressions)}")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"📌 Эталон сохранен: {baseline_path}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
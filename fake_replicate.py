@@ -0,0 +1,234 @@
+import io
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+FAKE_HOST = "127.0.0.1"
+FAKE_PORT = 8765               # 0 = любой свободный порт
+FAKE_LATENCY = 0.5             # Сколько "думает" модель на одно фото (сек)
+FAKE_JITTER = 0.3              # Разброс задержки (доля от FAKE_LATENCY)
+FAKE_429_RATE = 0.05           # Доля запросов, получающих 429 просто так
+FAKE_MAX_CONCURRENT = 16       # Больше одновременных запросов — всегда 429 (как настоящий лимит аккаунта)
+FAKE_ERROR_RATE = 0.02         # Доля предсказаний, которые заканчиваются ошибкой модели
+FAKE_SCALE = 2                 # Во сколько раз "апскейлит" сервер (4 — как Crisp, но медленнее и тяжелее)
+FAKE_SEED = 0                  # Одинаковый seed — одинаковая последовательность 429 и ошибок
+
+# ==========================================
+
+MODEL_PATH = re.compile(r"^/v1/models/([^/]+)/([^/]+)/predictions$")
+
+
+class FakeReplicate:
+    """
+    Локальная замена Replicate API для бенчмарков (без кредитов и сети):
+    1. POST /v1/files — загрузка фото (как files API), ссылка ведет обратно на этот сервер.
+    2. POST /v1/models/{owner}/{name}/predictions — "апскейл": пауза FAKE_LATENCY, потом ресайз.
+    3. 429 — случайно (FAKE_429_RATE) и при превышении FAKE_MAX_CONCURRENT; ошибки модели — FAKE_ERROR_RATE.
+    4. GET /stats — счетчики запросов, 429, ошибок и байтов.
+    Результат отдается data: ссылкой (клиент replicate превращает в FileOutput только https: и data:),
+    поэтому байты апскейла все равно идут по HTTP — в ответе на предсказание.
+    """
+
+    def __init__(self, host=FAKE_HOST, port=FAKE_PORT, latency=FAKE_LATENCY, jitter=FAKE_JITTER, rate_429=FAKE_429_RATE,
+                 max_concurrent=FAKE_MAX_CONCURRENT, error_rate=FAKE_ERROR_RATE, scale=FAKE_SCALE, seed=FAKE_SEED):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.max_concurrent = max_concurrent
+        self.error_rate = error_rate
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}      # id → байты загруженного фото
+        self.outputs = {}    # входные байты → готовый data: URL (повторы не пересчитывают ресайз)
+        self.active = 0
+        self.stats = {"files": 0, "predictions": 0, "throttled": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0, "max_active": 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+
+            def log_message(self, format, *args):
+                pass  # Без лога на каждый запрос
+
+            def do_GET(self):
+                server.handle_get(self)
+
+            def do_POST(self):
+                server.handle_post(self)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Сервер в фоновом потоке; возвращает базовый URL для REPLICATE_BASE_URL"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def send_json(self, handler, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        self.count("bytes_out", len(body))
+
+    def read_body(self, handler):
+        body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        self.count("bytes_in", len(body))
+        return body
+
+    def handle_get(self, handler):
+        if handler.path == "/stats":
+            with self.lock:
+                stats = dict(self.stats)
+            self.send_json(handler, 200, stats)
+            return
+        file_id = handler.path.rsplit("/", 1)[-1]
+        if handler.path.startswith("/files/") and file_id in self.files:
+            data = self.files[file_id]
+            handler.send_response(200)
+            handler.send_header("Content-Length", str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+        self.send_json(handler, 404, {"title": "Not found", "detail": handler.path, "status": 404})
+
+    def handle_post(self, handler):
+        body = self.read_body(handler)
+        if handler.path == "/v1/files":
+            self.send_json(handler, 201, self.create_file(handler.headers.get("Content-Type", ""), body))
+            return
+
+        match = MODEL_PATH.match(handler.path)
+        if not match:
+            self.send_json(handler, 404, {"title": "Not found", "detail": handler.path, "status": 404})
+            return
+
+        with self.lock:
+            throttled = self.active >= self.max_concurrent or self.random.random() < self.rate_429
+            failed = self.random.random() < self.error_rate
+            delay = max(0.0, self.random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+            if not throttled:
+                self.active += 1
+                self.stats["max_active"] = max(self.stats["max_active"], self.active)
+        if throttled:
+            self.count("throttled")
+            self.send_json(handler, 429, {"title": "Request was throttled", "detail": "Request was throttled. Expected available in 1 second.", "status": 429}, {"Retry-After": "1"})
+            return
+
+        try:
+            model = f"{match.group(1)}/{match.group(2)}"
+            image = json.loads(body)["input"]["image"]
+            time.sleep(delay)
+            self.count("predictions")
+            if failed:
+                self.count("failed")
+                self.send_json(handler, 201, self.prediction(model, "failed", None, "Injected model failure"))
+            else:
+                self.send_json(handler, 201, self.prediction(model, "succeeded", self.upscale(self.image_bytes(image)), None))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def create_file(self, content_type, body):
+        """multipart от клиента replicate: поле content с самим файлом"""
+        message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        part = next(p for p in message.get_payload() if p.get_param("name", header="content-disposition") == "content")
+        data = part.get_payload(decode=True)
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = data
+            self.stats["files"] += 1
+        return {
+            "id": file_id, "name": part.get_filename() or "file", "content_type": part.get_content_type(),
+            "size": len(data), "etag": file_id, "checksums": {}, "metadata": {},
+            "created_at": "2024-01-01T00:00:00Z", "expires_at": None,
+            "urls": {"get": f"{self.url}/files/{file_id}"},
+        }
+
+    def image_bytes(self, image):
+        """Вход модели: ссылка на загруженный файл или data: URL"""
+        if image.startswith("data:"):
+            return base64.b64decode(image.split(",", 1)[1])
+        return self.files[image.rsplit("/", 1)[-1]]
+
+    def upscale(self, data):
+        """Ресайз вместо модели (быстро, без сжатия) → data: URL с PNG"""
+        key = hash(data)
+        if key not in self.outputs:
+            with Image.open(io.BytesIO(data)) as img:
+                img = img.convert("RGB")
+                img = img.resize((img.width * self.scale, img.height * self.scale), Image.Resampling.BILINEAR)
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG", compress_level=1)
+            self.outputs[key] = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+        return self.outputs[key]
+
+    def prediction(self, model, status, output, error):
+        prediction_id = uuid.uuid4().hex
+        return {
+            "id": prediction_id, "model": model, "version": "fake", "status": status,
+            "input": {}, "output": output, "logs": "", "error": error, "metrics": {},
+            "created_at": "2024-01-01T00:00:00Z", "started_at": "2024-01-01T00:00:00Z", "completed_at": "2024-01-01T00:00:01Z",
+            "urls": {"get": f"{self.url}/v1/predictions/{prediction_id}", "cancel": f"{self.url}/v1/predictions/{prediction_id}/cancel"},
+        }
+
+
+def serve(ready=None, **options):
+    """Запуск в отдельном процессе (ресайз не отнимает GIL у измеряемого клиента)"""
+    server = FakeReplicate(**options)
+    if ready is not None:
+        ready.put(server.url)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена Replicate API для бенчмарков")
+    parser.add_argument("--port", type=int, default=FAKE_PORT)
+    parser.add_argument("--latency", type=float, default=FAKE_LATENCY)
+    parser.add_argument("--rate-429", type=float, default=FAKE_429_RATE)
+    parser.add_argument("--max-concurrent", type=int, default=FAKE_MAX_CONCURRENT)
+    parser.add_argument("--error-rate", type=float, default=FAKE_ERROR_RATE)
+    parser.add_argument("--scale", type=int, default=FAKE_SCALE)
+    args = parser.parse_args()
+
+    server = FakeReplicate(port=args.port, latency=args.latency, rate_429=args.rate_429, max_concurrent=args.max_concurrent,
+                           error_rate=args.error_rate, scale=args.scale)
+    print(f"🧪 Фейковый Replicate: {server.url}")
+    print(f"   Для скриптов: REPLICATE_BASE_URL={server.url} REPLICATE_API_TOKEN=fake")
+    server.serve_forever()
@@ -0,0 +1,35 @@
+"""
+Фото для Wildberries: удаление вотермарок (LaMa) → апскейл (Replicate / локально) → ресайз и кроп в JPG.
+
+Из командной строки: python -m photo_pipeline {mask,inpaint,upscale,wb,full,watch,serve,learn} --help
+Из своего кода, без отдельных процессов:
+    import photo_pipeline
+    photo_pipeline.run(input_dir="input", streaming=False)
+    photo_pipeline.prepare_for_wb(["a.png", "b.png"], "ready_for_wb", 900, 1200, 95)
+Модули грузятся при первом обращении: сам import photo_pipeline не тянет ни replicate, ни torch, ни OpenCV.
+"""
+import importlib
+
+# Публичное имя → (модуль, имя в модуле)
+_EXPORTS = {
+    "run": ("pipeline", "run"),
+    "run_async": ("pipeline", "run_async"),
+    "run_inpaint": ("pipeline", "run_inpaint"),
+    "run_upscale": ("pipeline", "run_upscale"),
+    "watch": ("pipeline", "watch"),
+    "serve": ("pipeline", "serve"),
+    "configure": ("pipeline", "configure"),
+    "PipelineError": ("pipeline", "PipelineError"),
+    "prepare_for_wb": ("wb_prepare", "prepare_for_wb_parallel"),
+    "prepare_image": ("wb_prepare", "prepare_image"),
+    "parse_rendition": ("renditions", "parse_rendition"),
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attr = _EXPORTS[name]
+    return getattr(importlib.import_module(f".{module}", __name__), attr)
@@ -0,0 +1,91 @@
+import time
+import asyncio
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+START_CONCURRENT = 5           # С какого лимита начинаем
+MIN_CONCURRENT = 1             # Ниже не опускаемся
+MAX_CONCURRENT = 32            # Потолок (не больше размера пула соединений)
+DECREASE_FACTOR = 0.5          # Во сколько раз режем лимит на 429 / throttled
+LATENCY_TOLERANCE = 2.0        # Задержка выше лучшей в N раз = перегрузка, лимит не растет
+ERROR_THRESHOLD = 0.2          # Доля ошибок (скользящая), после которой лимит режем
+EWMA_ALPHA = 0.2               # Вес нового замера в скользящих средних
+
+# ==========================================
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-лимит одновременных запросов (как окно TCP):
+    1. Пока ответы быстрые и без ошибок — лимит растет примерно на 1 за "окно" запросов.
+    2. На 429 / throttled лимит режется в DECREASE_FACTOR раз (не чаще раза за окно).
+    3. При росте задержки лимит держим, при частых ошибках — тоже режем.
+    Используется вместо asyncio.Semaphore: acquire() перед запросом, release(...) после.
+    """
+
+    def __init__(self, start=START_CONCURRENT, min_limit=MIN_CONCURRENT, max_limit=MAX_CONCURRENT):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(start, min_limit), max_limit))
+        self.in_flight = 0
+        self.latency = None            # Скользящая средняя задержки (сек)
+        self.best_latency = None       # Лучшая скользящая средняя = "здоровая" задержка
+        self.error_rate = 0.0
+        self.throttled = 0             # Сколько раз ловили 429 за запуск
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    @property
+    def current(self):
+        """Текущий лимит (целое число слотов)"""
+        return int(self.limit)
+
+    def status(self):
+        """Короткая строка для прогресса"""
+        return f"лимит {self.current}, в работе {self.in_flight}"
+
+    async def acquire(self):
+        """Ждем свободный слот в пределах текущего лимита"""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+
+    async def release(self, latency=None, ok=True, throttled=False):
+        """Освобождаем слот и подстраиваем лимит по результату запроса"""
+        async with self.condition:
+            self.in_flight -= 1
+            self.update(latency, ok, throttled)
+            self.condition.notify_all()
+
+    def update(self, latency, ok, throttled):
+        now = time.monotonic()
+
+        if throttled:
+            self.throttled += 1
+            self.decrease(now)
+            return
+
+        self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            if self.error_rate > ERROR_THRESHOLD:
+                self.decrease(now)
+            return
+
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+            self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+            if self.latency > self.best_latency * LATENCY_TOLERANCE:
+                return  # Провайдер отвечает медленнее обычного — не разгоняемся
+
+        # Аддитивный рост: +1 слот за каждые ~limit успешных ответов
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def decrease(self, now):
+        """Мультипликативное снижение, не чаще раза за окно (иначе одна волна 429 обнулит лимит)"""
+        window = self.latency or 1.0
+        if now - self.last_decrease < window:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
@@ -0,0 +1,282 @@
+import os
+import argparse
+
+# Наверху — только stdlib: каждая команда сама импортирует то, что ей нужно.
+# replicate / httpx грузятся только для апскейла, torch — для LaMa, OpenCV — для автопоиска вотермарки,
+# поэтому `python -m photo_pipeline wb` стартует за десятки миллисекунд.
+
+
+def size(text):
+    """"900x1200" → (900, 1200)"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"размер в виде ШИРИНАxВЫСОТА, а не '{text}'")
+    return width, height
+
+
+def shard(text):
+    """"2/4" — проверяем сразу, в настройки идет как есть"""
+    from .work_leases import parse_shard  # Только stdlib
+
+    try:
+        parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def chosen(args, **flags):
+    """Заданные флаги → настройки pipeline (флаг: имя настройки); не заданные остаются как в блоке НАСТРОЕК"""
+    settings = {name: getattr(args, flag) for flag, name in flags.items() if getattr(args, flag) is not None}
+    if args.profile:
+        settings["profile_enabled"] = True
+    if args.no_metrics:
+        settings["metrics_enabled"] = False
+    return settings
+
+
+def run_pipeline(call, settings):
+    """Запуск шага pipeline: понятная ошибка вместо трейсбека, код выхода 1"""
+    from .pipeline import PipelineError
+
+    try:
+        call(**settings)
+    except PipelineError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+def cmd_mask(args):
+    from . import pipeline
+
+    settings = {}
+    if args.out:
+        settings["mask_path"] = args.out
+    if args.size:
+        settings["img_w"], settings["img_h"] = args.size
+    if args.box:
+        settings["mark_w"], settings["mark_h"] = args.box
+    pipeline.configure(**settings)
+    pipeline.generate_mask()
+    return 0
+
+
+def cmd_inpaint(args):
+    from . import pipeline
+
+    settings = chosen(args, input="input_dir", output="clean_dir", workers="inpaint_workers", device="inpaint_device", shard="shard")
+    if args.no_detect:
+        settings["auto_detect"] = False
+    return run_pipeline(pipeline.run_inpaint, settings)
+
+
+def cmd_upscale(args):
+    from . import pipeline
+
+    settings = chosen(args, input="clean_dir", output="final_dir", backend="upscale_backend", max_concurrent="max_concurrent", shard="shard")
+    return run_pipeline(pipeline.run_upscale, settings)
+
+
+def cmd_full(args):
+    from . import pipeline
+
+    settings = chosen(
+        args, input="input_dir", wb_dir="wb_dir", backend="upscale_backend", workers="inpaint_workers",
+        max_kb="wb_max_kb", min_ssim="wb_min_ssim", rendition="renditions", renditions_dir="renditions_dir",
+        shard="shard", lease="lease_path", lease_seconds="lease_seconds",
+    )
+    if args.steps:
+        settings["streaming"] = False
+    if args.no_master:
+        settings["keep_master"] = False
+    if args.no_detect:
+        settings["auto_detect"] = False
+    return run_pipeline(pipeline.run, settings)
+
+
+def cmd_watch(args):
+    from . import pipeline
+
+    settings = chosen(
+        args, input="input_dir", wb_dir="wb_dir", backend="upscale_backend",
+        settle="watch_settle_seconds", poll_interval="watch_poll_interval",
+        max_kb="wb_max_kb", min_ssim="wb_min_ssim", rendition="renditions", renditions_dir="renditions_dir",
+        shard="shard", lease="lease_path", lease_seconds="lease_seconds",
+    )
+    if args.poll:
+        settings["watch_backend"] = "poll"
+    if args.no_master:
+        settings["keep_master"] = False
+    if args.no_detect:
+        settings["auto_detect"] = False
+    return run_pipeline(pipeline.watch, settings)
+
+
+def cmd_serve(args):
+    from . import pipeline
+
+    settings = chosen(
+        args, host="service_host", port="service_port", jobs="service_max_jobs", queue="service_max_queue",
+        max_upload_mb="service_max_upload_mb", backend="upscale_backend", max_kb="wb_max_kb", min_ssim="wb_min_ssim",
+    )
+    if args.size:
+        settings["target_w"], settings["target_h"] = args.size
+    if args.no_detect:
+        settings["auto_detect"] = False
+    return run_pipeline(pipeline.serve, settings)
+
+
+def cmd_wb(args):
+    from . import wb_prepare
+    from . import jpeg_budget
+    from . import renditions
+    from . import pipeline_metrics
+
+    images = wb_prepare.collect_images(args.paths)
+    if not images:
+        print(f"⚠️  Нет фото в: {', '.join(args.paths)}")
+        return 1
+
+    target_w, target_h = args.size or (wb_prepare.TARGET_W, wb_prepare.TARGET_H)
+    quality = args.quality or wb_prepare.QUALITY
+    workers = wb_prepare.WB_WORKERS if args.workers is None else args.workers
+    budget = jpeg_budget.JpegBudget(args.max_kb or jpeg_budget.MAX_KB, args.min_ssim or jpeg_budget.MIN_SSIM)
+    try:
+        extra = tuple(renditions.parse_rendition(spec, args.renditions_dir) for spec in args.rendition or ())
+    except ValueError as e:
+        print(f"❌ --rendition {e}")
+        return 1
+    print(f"🚀 Подготовка для Wildberries ({target_w}x{target_h}): {len(images)} фото → {args.out}")
+    if extra:
+        sizes = ", ".join(f"{r.name} {r.width}x{r.height} {r.fmt}" for r in extra)
+        print(f"   🖼️  Еще размеры из того же декодирования: {sizes} → {args.renditions_dir}")
+    os.makedirs(args.out, exist_ok=True)
+    pipeline_metrics.start_run("wb", not args.no_metrics, args.profile)
+    try:
+        with pipeline_metrics.stage("wb"):
+            _, errors = wb_prepare.prepare_for_wb_parallel(images, args.out, target_w, target_h, quality, workers, budget=budget, extra=extra)
+    finally:
+        pipeline_metrics.finish()
+
+    print(f"\n🎉 Готово! Файлы лежат в папке: {args.out}")
+    return 1 if errors else 0
+
+
+def cmd_learn(args):
+    from . import watermark_detect
+
+    return 0 if watermark_detect.learn_from_folder(args.folder) else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m photo_pipeline",
+        description="Фото для Wildberries: удаление вотермарок → апскейл → ресайз. "
+                    "Без флагов — настройки из photo_pipeline/pipeline.py",
+    )
+    commands = parser.add_subparsers(dest="command", required=True, metavar="команда")
+
+    def command(name, handler, help):
+        sub = commands.add_parser(name, help=help, description=help)
+        sub.set_defaults(handler=handler)
+        return sub
+
+    def with_nodes(sub, lease=True):
+        sub.add_argument("--shard", type=shard, help="доля этой машины i/n, например 2/4 (фото делятся по имени)")
+        if lease:
+            sub.add_argument("--lease", help="общая очередь машин: папка файлов аренды или файл *.sqlite3 на общем диске")
+            sub.add_argument("--lease-seconds", type=float, help="аренда без продления протухает и фото забирают другие (300)")
+
+    def with_budget(sub):
+        sub.add_argument("--max-kb", type=float, help="бюджет JPG в KB: качество (не выше --quality / QUALITY) подбирается под размер")
+        sub.add_argument("--min-ssim", type=float, help="или порог на глаз: самое низкое качество со SSIM не ниже (0.98)")
+
+    def with_renditions(sub, folder=None):
+        sub.add_argument("--rendition", action="append", metavar="SPEC",
+                         help="еще размер из того же декодирования: имя:ШИРИНАxВЫСОТА[:crop|fit|pad][:jpg|webp|png][:качество][:150kb]")
+        sub.add_argument("--renditions-dir", default=folder, help="куда класть размеры: папка/имя/фото (renditions)")
+
+    def with_metrics(sub):
+        sub.add_argument("--profile", action="store_true", help="профиль CPU и памяти каждого шага (metrics/*.profile.txt)")
+        sub.add_argument("--no-metrics", action="store_true", help="не писать замеры в metrics/")
+        return sub
+
+    sub = command("mask", cmd_mask, "фиксированная маска вотермарки (правый нижний угол)")
+    sub.add_argument("--out", help="файл маски (по умолчанию MASK_PATH)")
+    sub.add_argument("--size", type=size, help="размер фото, например 832x1248")
+    sub.add_argument("--box", type=size, help="размер зоны удаления, например 100x100")
+
+    sub = with_metrics(command("inpaint", cmd_inpaint, "удаление вотермарок через LaMa: input → output"))
+    sub.add_argument("--input", help="исходные фото (INPUT_DIR)")
+    sub.add_argument("--output", help="куда класть очищенные (CLEAN_DIR)")
+    sub.add_argument("--workers", type=int, help="процессы со своей моделью (INPAINT_WORKERS)")
+    sub.add_argument("--device", help="auto / cpu / cuda / mps")
+    sub.add_argument("--no-detect", action="store_true", help="одна маска на все фото, без автопоиска")
+    with_nodes(sub, lease=False)
+
+    sub = with_metrics(command("upscale", cmd_upscale, "апскейл: output → final_upscaled"))
+    sub.add_argument("--input", help="что апскейлить (CLEAN_DIR)")
+    sub.add_argument("--output", help="куда класть (FINAL_DIR)")
+    sub.add_argument("--backend", help="replicate / local / auto")
+    sub.add_argument("--max-concurrent", type=int, help="потолок одновременных запросов к Replicate")
+    with_nodes(sub, lease=False)
+
+    sub = with_metrics(command("wb", cmd_wb, "ресайз и кроп под Wildberries в JPG"))
+    sub.add_argument("paths", nargs="*", default=["final_upscaled"], help="фото или папки (по умолчанию final_upscaled)")
+    sub.add_argument("--out", default="ready_for_wb", help="куда класть JPG")
+    sub.add_argument("--size", type=size, help="размер, по умолчанию 900x1200")
+    sub.add_argument("--quality", type=int, help="качество JPG, по умолчанию 95")
+    sub.add_argument("--workers", type=int, help="процессы (0 = все ядра)")
+    with_budget(sub)
+    with_renditions(sub, "renditions")
+
+    sub = with_metrics(command("full", cmd_full, "весь пайплайн: маска → inpaint → upscale → WB"))
+    sub.add_argument("--input", help="исходные фото (INPUT_DIR)")
+    sub.add_argument("--wb-dir", help="куда класть JPG для WB (WB_DIR)")
+    sub.add_argument("--backend", help="апскейл: replicate / local / auto")
+    sub.add_argument("--workers", type=int, help="процессы LaMa (INPAINT_WORKERS)")
+    sub.add_argument("--steps", action="store_true", help="шаг за шагом по всей папке вместо потока")
+    sub.add_argument("--no-master", action="store_true", help="не хранить 4K мастер (KEEP_MASTER = False)")
+    sub.add_argument("--no-detect", action="store_true", help="одна маска на все фото, без автопоиска")
+    with_budget(sub)
+    with_renditions(sub)
+    with_nodes(sub)
+
+    sub = with_metrics(command("watch", cmd_watch, "демон: новые фото в input сразу идут через весь пайплайн"))
+    sub.add_argument("--input", help="папка, за которой следим (INPUT_DIR)")
+    sub.add_argument("--wb-dir", help="куда класть JPG для WB (WB_DIR)")
+    sub.add_argument("--backend", help="апскейл: replicate / local / auto")
+    sub.add_argument("--settle", type=float, help="сек без записи, после которых файл считается дописанным (1.0)")
+    sub.add_argument("--poll", action="store_true", help="опрос папки вместо inotify (сетевые диски)")
+    sub.add_argument("--poll-interval", type=float, help="период опроса, сек (1.0)")
+    sub.add_argument("--no-master", action="store_true", help="не хранить 4K мастер (KEEP_MASTER = False)")
+    sub.add_argument("--no-detect", action="store_true", help="одна маска на все фото, без автопоиска")
+    with_budget(sub)
+    with_renditions(sub)
+    with_nodes(sub)
+
+    sub = with_metrics(command("serve", cmd_serve, "HTTP сервис: POST /process с фото → JPG для WB"))
+    sub.add_argument("--host", help="адрес (127.0.0.1; 0.0.0.0 — для других машин)")
+    sub.add_argument("--port", type=int, help="порт (8000)")
+    sub.add_argument("--jobs", type=int, help="фото в работе одновременно (4)")
+    sub.add_argument("--queue", type=int, help="сколько запросов может ждать, дальше 503 (16)")
+    sub.add_argument("--max-upload-mb", type=float, help="предел размера фото (40)")
+    sub.add_argument("--backend", help="апскейл: replicate / local / auto")
+    sub.add_argument("--size", type=size, help="размер JPG по умолчанию, например 900x1200")
+    sub.add_argument("--no-detect", action="store_true", help="одна маска на все фото, без автопоиска")
+    with_budget(sub)
+
+    sub = command("learn", cmd_learn, "шаблон вотермарки из фото с ней (для автопоиска)")
+    sub.add_argument("folder", nargs="?", default="input", help="папка с фото (по умолчанию input)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except KeyboardInterrupt:
+        print("\n⏹️  Прервано")
+        return 130
@@ -0,0 +1,229 @@
+import sys
+import math
+import time
+import signal
+import threading
+import contextlib
+import asyncio
+from pathlib import Path
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response
+from . import pipeline_metrics
+from .pipeline import PipelineError
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+HOST = "127.0.0.1"             # 0.0.0.0 — принимать запросы с других машин
+PORT = 8000
+MAX_JOBS = 4                   # Фото в работе одновременно
+MAX_QUEUE = 16                 # Сколько запросов может ждать слота; дальше — 503 с Retry-After
+MAX_UPLOAD_MB = 40             # Фото больше — 413
+EWMA_ALPHA = 0.2               # Вес нового фото в средней длительности (для Retry-After)
+
+# ==========================================
+
+
+class JobQueue:
+    """
+    Очередь запросов сервиса (общая для всех клиентов):
+    1. В работе не больше max_jobs фото, остальные ждут слота по порядку прихода.
+    2. Если ждут уже max_queue — новый запрос сразу получает 503 с Retry-After, тело даже не читается.
+    3. Retry-After — оценка по средней длительности фото: когда в очереди освободится место.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, max_queue=MAX_QUEUE):
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.slots = asyncio.Semaphore(max_jobs)
+        self.admitted = 0       # Принятые запросы: ждут слота или уже в работе
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+        self.job_seconds = None  # Скользящая средняя длительности фото
+
+    @property
+    def waiting(self):
+        return self.admitted - self.running
+
+    def full(self):
+        return self.admitted >= self.max_jobs + self.max_queue
+
+    def retry_after(self):
+        """Через сколько секунд стоит повторить (целое, не меньше 1)"""
+        per_job = self.job_seconds or 5.0  # До первого фото — грубая оценка
+        return max(1, math.ceil(per_job * (self.waiting + 1) / self.max_jobs))
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Место в очереди на все время запроса; очередь полна — HTTP 503 с Retry-After"""
+        if self.full():
+            self.rejected += 1
+            raise HTTPException(503, "Сервис занят, повторите позже", headers={"Retry-After": str(self.retry_after())})
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+
+    @contextlib.asynccontextmanager
+    async def job(self):
+        """Слот для одного фото: ждем своей очереди, длительность идет в оценку Retry-After"""
+        async with self.slots:
+            self.running += 1
+            started = time.perf_counter()
+            ok = False
+            try:
+                yield
+                ok = True
+            finally:
+                self.running -= 1
+                if ok:
+                    self.done += 1
+                    seconds = time.perf_counter() - started
+                    self.job_seconds = seconds if self.job_seconds is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.job_seconds
+                else:
+                    self.failed += 1
+
+    def status(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_jobs": self.max_jobs,
+            "max_queue": self.max_queue,
+            "accepting": not self.full(),
+            "retry_after": self.retry_after() if self.full() else 0,
+            "avg_seconds": round(self.job_seconds, 3) if self.job_seconds else None,
+            "done": self.done,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+async def read_upload(request, max_bytes):
+    """
+    Фото из запроса: тело целиком (Content-Type image/*, имя — ?name=) или поле file из multipart/form-data.
+    Размер проверяется по Content-Length до чтения и по факту во время чтения. Возвращает (байты, имя)
+    """
+    too_large = HTTPException(413, f"Фото больше {max_bytes // (1024 * 1024)} MB")
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise too_large
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(400, "Нужно поле file с фото")
+        data, name = await upload.read(), upload.filename
+    else:
+        chunks, size = [], 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large
+            chunks.append(chunk)
+        data, name = b"".join(chunks), request.query_params.get("name")
+
+    if len(data) > max_bytes:
+        raise too_large
+    if not data:
+        raise HTTPException(400, "Пустой запрос: пришлите фото в теле или в поле file")
+    return data, Path(name or "photo").name
+
+
+def create_app(processor, max_jobs=MAX_JOBS, max_queue=MAX_QUEUE, max_upload_mb=MAX_UPLOAD_MB):
+    """
+    Приложение FastAPI поверх pipeline.ImageProcessor (модели уже загружены: processor.load()):
+    POST /process — фото → JPG для WB; GET /health — что загружено; GET /queue — глубина очереди.
+    """
+    queue = JobQueue(max_jobs, max_queue)
+    max_bytes = int(max_upload_mb * 1024 * 1024)
+    started = time.time()
+    counter = {"requests": 0}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # Клиент Replicate создается в event loop сервера: пул соединений живет, пока живет сервис
+        await processor.open()
+        try:
+            yield
+        finally:
+            await processor.close()
+
+    app = FastAPI(title="photo_pipeline", lifespan=lifespan)
+
+    @app.post("/process")
+    async def process(
+        request: Request,
+        width: int = Query(None, ge=1, le=10000, description="ширина JPG (по умолчанию TARGET_W)"),
+        height: int = Query(None, ge=1, le=10000, description="высота JPG (по умолчанию TARGET_H)"),
+        quality: int = Query(None, ge=1, le=100, description="качество JPG (по умолчанию QUALITY)"),
+        upscale: bool = Query(True, description="false — без апскейла, только ресайз"),
+        max_kb: float = Query(None, gt=0, description="бюджет JPG в KB: качество подбирается под размер"),
+    ):
+        if (width is None) != (height is None):
+            raise HTTPException(400, "width и height задаются вместе")
+
+        with queue.admit():
+            data, name = await read_upload(request, max_bytes)
+            counter["requests"] += 1
+            key = f"{counter['requests']}_{name}"  # Своя строка в трассе у каждого запроса
+            arrived = time.perf_counter()
+            async with queue.job():
+                waited = time.perf_counter() - arrived
+                try:
+                    jpeg, route, watermark = await processor.process(
+                        data, key, (width, height) if width else None, quality, upscale, max_kb
+                    )
+                except ValueError as e:
+                    raise HTTPException(400, str(e))
+                except PipelineError as e:
+                    raise HTTPException(502, str(e))
+            seconds = time.perf_counter() - arrived
+
+        print(f"🌐 {name}: {route}, вотермарка {'удалена' if watermark else 'нет'}, {len(jpeg) / 1024:.0f} KB за {seconds:.2f} сек (очередь {waited:.2f} сек)")
+        return Response(jpeg, media_type="image/jpeg", headers={
+            "Content-Disposition": f"inline; filename*=UTF-8''{quote(Path(name).stem + '.jpg')}",
+            "X-Upscale-Route": route,
+            "X-Watermark": "removed" if watermark else "none",
+            "X-Process-Seconds": f"{seconds:.3f}",
+            "X-Queue-Seconds": f"{waited:.3f}",
+        })
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "uptime_s": round(time.time() - started), **processor.status(), "accepting": not queue.full()}
+
+    @app.get("/queue")
+    async def queue_status():
+        return queue.status()
+
+    return app
+
+
+def serve(processor, host=HOST, port=PORT, max_jobs=MAX_JOBS, max_queue=MAX_QUEUE, max_upload_mb=MAX_UPLOAD_MB,
+          metrics=pipeline_metrics.METRICS_ENABLED, profile=False, metrics_dir=pipeline_metrics.METRICS_DIR):
+    """
+    Запуск сервиса до Ctrl+C / SIGTERM (uvicorn доделывает запросы в работе).
+    Модели грузятся до того, как порт начнет принимать запросы; ошибка загрузки — PipelineError.
+    """
+    import uvicorn
+
+    processor.load()
+    app = create_app(processor, max_jobs, max_queue, max_upload_mb)
+    print(f"🌐 Сервис: http://{host}:{port}  POST /process (фото → JPG для WB), GET /health, GET /queue")
+    print(f"   В работе до {max_jobs} фото, в очереди до {max_queue}, дальше 503 с Retry-After")
+
+    pipeline_metrics.start_run("serve", metrics, profile)
+    # uvicorn после плавной остановки повторяет пойманный сигнал с прежним обработчиком:
+    # для SIGTERM это мгновенная смерть процесса, а нам еще писать замеры — превращаем его в обычный выход
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        with pipeline_metrics.stage("serve"):
+            uvicorn.run(app, host=host, port=port, log_level="warning")
+    finally:
+        pipeline_metrics.finish(metrics_dir)
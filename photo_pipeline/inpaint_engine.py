@@ -0,0 +1,377 @@
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from PIL import Image, ImageFilter
+from .upscale_cache import place_file
+from . import pipeline_metrics
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+INPAINT_DEVICE = "auto"        # auto / cpu / cuda / mps (auto: cuda → mps на Mac → cpu)
+INPAINT_THREADS = 0            # Потоки torch на CPU (0 = сколько решит torch; при шардинге — ядра / воркеры)
+INPAINT_WORKERS = 1            # Процессы со своей моделью (1 = все в текущем процессе)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")  # Те же форматы, что брал `iopaint run`
+
+# ROI режим: сеть видит только окно вокруг маски, а не весь кадр
+ROI_MODE = True                # False = весь кадр через LaMa, как раньше
+ROI_PADDING = 128              # Контекст вокруг маски (px), как hd_strategy_crop_margin в iopaint
+ROI_BATCH = 8                  # Сколько кропов одного размера гоняем через сеть за раз
+ROI_FEATHER = 8                # Ширина плавного перехода на шве при вклейке (px)
+PAD_MOD = 8                    # LaMa требует стороны, кратные 8
+
+# ==========================================
+
+_ENGINES = {}  # "Теплые" модели на весь процесс: (устройство, потоки, ROI) → движок
+
+
+def pick_device(device="auto"):
+    """Выбор устройства для torch: явно заданное или лучшее доступное"""
+    import torch
+
+    if device != "auto":
+        return device
+    if torch.cuda.is_available():
+        return "cuda"
+    if sys.platform == "darwin" and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def list_images(folder):
+    """Фото в папке, которые умеет обрабатывать LaMa (отсортированы по имени)"""
+    return sorted(p for p in Path(folder).glob("*.*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def prepare_mask(mask, size):
+    """Маска под размер фото: ресайз без сглаживания + порог 127, как в iopaint"""
+    mask = mask.convert("L")
+    if mask.size != size:
+        mask = mask.resize(size, Image.Resampling.NEAREST)
+    return mask.point(lambda v: 255 if v >= 127 else 0)
+
+
+def round_up(value, mod):
+    """Округление вверх до кратного mod"""
+    return (value + mod - 1) // mod * mod
+
+
+def roi_box(mask, padding=ROI_PADDING):
+    """
+    Окно для inpaint вокруг маски:
+    1. Берем рамку белой зоны и добавляем контекст padding со всех сторон.
+    2. Дотягиваем стороны до кратных 8 (если позволяет кадр), чтобы сеть не паддила сама.
+    Возвращает (x1, y1, x2, y2) или None, если маска пустая.
+    """
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    box = []
+    for lo, hi, limit in ((bbox[0], bbox[2], mask.width), (bbox[1], bbox[3], mask.height)):
+        lo = max(0, lo - padding)
+        hi = min(limit, hi + padding)
+        size = min(limit, round_up(hi - lo, PAD_MOD))
+        # Расширяем окно внутрь кадра, если уперлись в край
+        lo = max(0, min(lo, limit - size))
+        box.append((lo, lo + size))
+
+    (x1, x2), (y1, y2) = box
+    return (x1, y1, x2, y2)
+
+
+def feather_mask(mask, feather=ROI_FEATHER):
+    """Маска для вклейки: белая зона чуть шире исходной и с размытым краем"""
+    if feather <= 0:
+        return mask
+    return mask.filter(ImageFilter.MaxFilter(2 * feather + 1)).filter(ImageFilter.GaussianBlur(feather / 2))
+
+
+class LamaEngine:
+    """
+    LaMa прямо в процессе:
+    1. Модель грузится один раз и остается в памяти на весь батч.
+    2. Устройство выбирается само (на Linux без GPU — cpu).
+    3. На вход и выход — PIL картинки, без временных файлов.
+    4. В ROI режиме сеть получает только окна вокруг маски, сложенные в батчи.
+    """
+
+    def __init__(self, device=INPAINT_DEVICE, threads=INPAINT_THREADS, roi=ROI_MODE):
+        import torch
+        from iopaint.model.lama import LaMa
+        from iopaint.schema import InpaintRequest
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        started = time.perf_counter()
+        self.device = pick_device(device)
+        self.threads = torch.get_num_threads()
+        self.model = LaMa(torch.device(self.device))
+        self.config = InpaintRequest()
+        self.roi = roi
+        self.load_seconds = time.perf_counter() - started
+        self.clean_count = 0  # Фото, на которых детектор не нашел вотермарку (модель их не видела)
+
+    def inpaint(self, image, mask):
+        """Удаление зоны маски с одной картинки. Возвращает новую RGB картинку"""
+        if self.roi:
+            return self.inpaint_batch([image], [mask])[0]
+
+        import numpy as np
+
+        image = image.convert("RGB")
+        mask = prepare_mask(mask, image.size)
+
+        # LaMa возвращает BGR
+        result = self.model(np.array(image), np.array(mask), self.config)
+        return Image.fromarray(np.ascontiguousarray(result[:, :, ::-1]))
+
+    def inpaint_batch(self, images, masks):
+        """
+        ROI inpaint для пачки картинок:
+        1. Вырезаем окно вокруг маски из каждой картинки.
+        2. Кропы одного размера складываем в батчи и прогоняем через сеть разом.
+        3. Вклеиваем результат обратно с мягким швом.
+        """
+        results = [image.convert("RGB") for image in images]  # convert всегда отдает копию
+        jobs = {}  # (w, h) кропа → список (индекс, окно, кроп, маска)
+
+        for i, (image, mask) in enumerate(zip(results, masks)):
+            mask = prepare_mask(mask, image.size)
+            box = roi_box(mask)
+            if box is None:
+                continue  # Нечего удалять
+            crop_size = (box[2] - box[0], box[3] - box[1])
+            jobs.setdefault(crop_size, []).append((i, box, image.crop(box), mask.crop(box)))
+
+        for group in jobs.values():
+            for start in range(0, len(group), ROI_BATCH):
+                chunk = group[start:start + ROI_BATCH]
+                inpainted = self.forward_crops([job[2] for job in chunk], [job[3] for job in chunk])
+
+                for (i, box, crop, crop_mask), new_crop in zip(chunk, inpainted):
+                    # Снаружи маски оставляем оригинальные пиксели, на краю — плавный переход
+                    blended = Image.composite(new_crop, crop, feather_mask(crop_mask))
+                    results[i].paste(blended, box[:2])
+
+        return results
+
+    def forward_crops(self, crops, masks):
+        """Один прогон LaMa на стопке кропов одинакового размера"""
+        import numpy as np
+        import torch
+
+        width, height = crops[0].size
+        pad_w, pad_h = round_up(width, PAD_MOD) - width, round_up(height, PAD_MOD) - height
+
+        # [B, H, W, C] uint8 → [B, C, H, W] float 0..1, как norm_img в iopaint
+        batch = np.stack([np.array(crop) for crop in crops])
+        batch_mask = np.stack([np.array(mask) for mask in masks])[..., np.newaxis]
+        if pad_w or pad_h:
+            pad = ((0, 0), (0, pad_h), (0, pad_w), (0, 0))
+            batch = np.pad(batch, pad, mode="symmetric")
+            batch_mask = np.pad(batch_mask, pad, mode="symmetric")
+
+        image_t = torch.from_numpy(batch).permute(0, 3, 1, 2).float().div(255).to(self.model.device)
+        mask_t = torch.from_numpy((batch_mask > 0).astype(np.float32)).permute(0, 3, 1, 2).to(self.model.device)
+
+        with torch.inference_mode():
+            output = self.model.model(image_t, mask_t)
+
+        output = (output * 255).clamp(0, 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+        return [Image.fromarray(item[:height, :width]) for item in output]
+
+    def inpaint_files(self, img_paths, mask, output_dir, detector=None):
+        """
+        Чистит пачку файлов и сохраняет {stem}.png в output_dir (как делал `iopaint run`).
+        С detector маска ищется на каждом фото своя, а фото без вотермарки идут мимо модели.
+        """
+        images, icc_profiles = [], []
+        for img_path in img_paths:
+            with Image.open(img_path) as img, pipeline_metrics.span("decode", img_path):
+                icc_profiles.append(img.info.get("icc_profile"))
+                images.append(img.convert("RGB"))
+
+        masks = [mask] * len(images)
+        if detector is not None:
+            for i, img_path in enumerate(img_paths):
+                with pipeline_metrics.span("detect", img_path):
+                    masks[i] = detector.mask_for(images[i])
+        dirty = [i for i, image_mask in enumerate(masks) if image_mask is not None]
+        results = list(images)
+        # Пачка идет через сеть целиком — отрезок общий, на отдельной строке трассы (своей у каждого шарда)
+        with pipeline_metrics.span("lama", lane=f"LaMa (pid {os.getpid()})", images=len(dirty)):
+            if self.roi:
+                inpainted = self.inpaint_batch([images[i] for i in dirty], [masks[i] for i in dirty])
+            else:
+                inpainted = [self.inpaint(images[i], masks[i]) for i in dirty]
+        for i, result in zip(dirty, inpainted):
+            results[i] = result
+
+        save_paths = []
+        for i, (img_path, result, icc_profile) in enumerate(zip(img_paths, results, icc_profiles)):
+            save_path = Path(output_dir) / f"{Path(img_path).stem}.png"
+            with pipeline_metrics.span("save", img_path):
+                if masks[i] is None:
+                    self.clean_count += 1
+                    save_clean(img_path, result, save_path, icc_profile)
+                else:
+                    result.save(save_path, icc_profile=icc_profile)
+            save_paths.append(save_path)
+        pipeline_metrics.add("clean", len(images) - len(dirty))
+        return save_paths
+
+    def inpaint_file(self, img_path, mask, output_dir, detector=None):
+        """Чистит один файл и сохраняет {stem}.png в output_dir"""
+        return self.inpaint_files([img_path], mask, output_dir, detector)[0]
+
+
+def save_clean(img_path, image, save_path, icc_profile=None):
+    """Фото без вотермарки: PNG кладем ссылкой на исходник, остальное — быстрым PNG"""
+    if Path(img_path).suffix.lower() == ".png":
+        place_file(img_path, save_path)
+    else:
+        image.save(save_path, icc_profile=icc_profile, compress_level=1)
+
+
+def get_engine(device=INPAINT_DEVICE, threads=INPAINT_THREADS, roi=ROI_MODE):
+    """
+    Общий движок на процесс: первый вызов грузит модель, остальные с теми же настройками берут готовую.
+    Другое устройство, потоки или ROI — свой движок (не тихо чужой)
+    """
+    key = (device, threads, roi)
+    if key not in _ENGINES:
+        _ENGINES[key] = LamaEngine(device, threads, roi)
+    return _ENGINES[key]
+
+
+def load_mask(mask_path):
+    """Читает маску с диска целиком (файл сразу закрывается)"""
+    with Image.open(mask_path) as mask:
+        return mask.convert("L")
+
+
+def inpaint_shard(shard_index, img_paths, mask_path, output_dir, device, threads, roi, detector=None):
+    """
+    Воркер шардинга (запускается в отдельном процессе):
+    своя модель, свои потоки torch и своя часть фото. Возвращает статистику.
+    """
+    engine = LamaEngine(device, threads, roi)
+    mask = load_mask(mask_path)
+    batch_size = ROI_BATCH if roi else 1
+    done, errors = [], []
+
+    started = time.perf_counter()
+    with pipeline_metrics.capture() as events:
+        for start in range(0, len(img_paths), batch_size):
+            chunk = img_paths[start:start + batch_size]
+            try:
+                engine.inpaint_files(chunk, mask, output_dir, detector)
+                done.extend(chunk)
+            except Exception as e:
+                errors.append(f"{', '.join(Path(p).name for p in chunk)}: {e}")
+
+    return {
+        "events": events,
+        "shard": shard_index,
+        "pid": os.getpid(),
+        "threads": engine.threads,
+        "done": done,
+        "errors": errors,
+        "clean": engine.clean_count,
+        "load_seconds": engine.load_seconds,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def remove_watermarks_sharded(images, mask_path, output_dir, workers, device=INPAINT_DEVICE, threads=INPAINT_THREADS, roi=ROI_MODE, detector=None):
+    """
+    Шардинг по ядрам:
+    1. Делим фото на workers частей (через одно, чтобы части были ровными).
+    2. Каждая часть — отдельный процесс со своей LaMa и закрепленным числом потоков torch.
+    3. Все пишут {stem}.png в одну output_dir, так что склеивать результаты не нужно.
+    """
+    shards = [images[i::workers] for i in range(workers) if images[i::workers]]
+    if not threads:
+        threads = max(1, (os.cpu_count() or 1) // len(shards))
+    print(f"   🧩 Шардинг: процессов {len(shards)}, потоков torch на каждый {threads}")
+
+    # spawn: torch плохо переносит fork с уже поднятыми потоками
+    context = multiprocessing.get_context("spawn")
+    done = []
+    clean = 0
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as pool:
+        futures = [
+            pool.submit(inpaint_shard, i, shard, mask_path, output_dir, device, threads, roi, detector)
+            for i, shard in enumerate(shards)
+        ]
+        for future in as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"   ❌ Воркер упал: {e}")
+                continue
+
+            done.extend(stats["done"])
+            clean += stats["clean"]
+            pipeline_metrics.merge(stats["events"])
+            count = len(stats["done"])
+            speed = count / stats["seconds"] if stats["seconds"] else 0.0
+            print(f"   👷 Воркер {stats['shard']} (pid {stats['pid']}, потоков {stats['threads']}): "
+                  f"{count} фото за {stats['seconds']:.1f} сек → {speed:.2f} фото/сек "
+                  f"(загрузка модели {stats['load_seconds']:.1f} сек)")
+            for error in stats["errors"]:
+                print(f"      ❌ Ошибка с файлами {error}")
+
+    elapsed = time.perf_counter() - started
+    print(f"   📈 Итого: {len(done)} фото за {elapsed:.1f} сек → {len(done) / elapsed:.2f} фото/сек")
+    if detector is not None:
+        print(f"   🔎 Без вотермарки (мимо LaMa): {clean} фото")
+    return done
+
+
+def remove_watermarks(input_dir, mask_path, output_dir, device=INPAINT_DEVICE, threads=INPAINT_THREADS, roi=ROI_MODE, workers=INPAINT_WORKERS, images=None, detector=None):
+    """
+    Чистит фото одной "теплой" моделью (или шардами по процессам).
+    images — явный список фото (по умолчанию вся input_dir). Возвращает список готовых исходников.
+    detector — поиск вотермарки на каждом фото (маска своя у каждого); без него — общая маска mask_path.
+    """
+    images = list_images(input_dir) if images is None else list(images)
+    total = len(images)
+    if total == 0:
+        print(f"⚠️  В папке '{input_dir}' нет фото для удаления вотермарок.")
+        return []
+
+    if workers > 1:
+        return remove_watermarks_sharded(images, mask_path, output_dir, workers, device, threads, roi, detector)
+
+    engine = get_engine(device, threads, roi)
+    mode = f"ROI ±{ROI_PADDING} px, батч {ROI_BATCH}" if roi else "весь кадр"
+    print(f"   🧠 LaMa на {engine.device} (потоков torch: {engine.threads}, {mode}), загрузка {engine.load_seconds:.1f} сек")
+
+    mask = load_mask(mask_path)
+    batch_size = ROI_BATCH if roi else 1
+    done = []
+    clean_before = engine.clean_count
+    for start in range(0, total, batch_size):
+        chunk = images[start:start + batch_size]
+        names = ", ".join(p.name for p in chunk)
+        try:
+            started = time.perf_counter()
+            engine.inpaint_files(chunk, mask, output_dir, detector)
+            per_image_ms = (time.perf_counter() - started) * 1000 / len(chunk)
+            print(f"[{start + len(chunk)}/{total}] 🧹 {names} ✅ {per_image_ms:.0f} мс/фото")
+            done.extend(chunk)
+        except Exception as e:
+            print(f"[{start + len(chunk)}/{total}] ❌ Ошибка с файлами {names}: {e}")
+
+    if detector is not None:
+        print(f"   🔎 Без вотермарки (мимо LaMa): {engine.clean_count - clean_before} фото")
+    return done
@@ -0,0 +1,176 @@
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from .upscale_cache import file_digest
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+LEDGER_PATH = "pipeline_ledger.sqlite3"  # Журнал задач (лежит рядом с папками пайплайна)
+
+# ==========================================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    image TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    input_digest TEXT,
+    params TEXT,
+    output TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    run_id TEXT,
+    PRIMARY KEY (image, stage)
+);
+"""
+
+
+def fingerprint(**params):
+    """Отпечаток настроек шага: меняется QUALITY, маска или модель — меняется и отпечаток"""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class JobLedger:
+    """
+    Журнал задач в SQLite (переживает падение процесса):
+    1. Для каждого фото и шага хранит статус, хэш входа и отпечаток настроек.
+    2. Шаг считается сделанным, только если он завершился, вход и настройки те же, а результат на месте.
+    3. Хэши файлов кэшируются по (размер, mtime), так что повторный запуск не перечитывает всю папку.
+    """
+
+    def __init__(self, db_path=LEDGER_PATH):
+        self.db_path = Path(db_path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        # WAL + FULL: каждая отметка сразу на диске, читатели не блокируют запись
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "run_id" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN run_id TEXT")  # Журнал от версии без run_id
+        # Запуск, который пишет в журнал: "running" от другого запуска — брошенный шаг, от этого — шаг в работе
+        self.run_id = uuid.uuid4().hex
+
+    def close(self):
+        self.db.close()
+
+    def digest(self, path):
+        """sha256 файла; пересчитываем только если файл изменился"""
+        path = Path(path)
+        stat = path.stat()
+        key = str(path.resolve())
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (key, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        if row:
+            return row[0]
+
+        digest = file_digest(path)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+    def pending(self, img_path, stage, params, output):
+        """
+        Нужно ли делать шаг для фото.
+        Если прошлый запуск упал посреди шага — недописанный результат удаляем.
+        Шаг, который этот же запуск делает прямо сейчас (watch увидел файл еще раз), не трогаем.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, input_digest, params, run_id FROM jobs WHERE image = ? AND stage = ?",
+                (str(img_path), stage),
+            ).fetchone()
+
+        output = Path(output)
+        if row is None:
+            return True
+
+        status, input_digest, old_params, run_id = row
+        if status == "running" and run_id == self.run_id:
+            return False  # Уже в работе (см. busy): результат как раз пишется
+        if status == "running":
+            # Процесс умер посреди шага: файл результата мог остаться недописанным
+            if output.exists():
+                output.unlink()
+            return True
+
+        return not (
+            status == "done"
+            and old_params == params
+            and output.exists()
+            and output.stat().st_size > 0
+            and input_digest == self.digest(img_path)
+        )
+
+    def busy(self, img_path, stage):
+        """Шаг для фото прямо сейчас делает этот же запуск (watch увидел файл еще раз, пока он в работе)"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM jobs WHERE image = ? AND stage = ? AND status = 'running' AND run_id = ?",
+                (str(img_path), stage, self.run_id),
+            ).fetchone()
+        return row is not None
+
+    def start(self, img_path, stage, params):
+        """Отметка "шаг начат" (делается до записи результата)"""
+        self.set(img_path, stage, "running", self.digest(img_path), params)
+
+    def finish(self, img_path, stage, output):
+        """Отметка "шаг завершен", результат лежит в output"""
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = 'done', output = ?, error = NULL, updated_at = ? WHERE image = ? AND stage = ?",
+                (str(output), time.time(), str(img_path), stage),
+            )
+
+    def fail(self, img_path, stage, error):
+        """Отметка "шаг упал" — при следующем запуске он повторится"""
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE image = ? AND stage = ?",
+                (str(error), time.time(), str(img_path), stage),
+            )
+
+    def set(self, img_path, stage, status, input_digest, params):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO jobs (image, stage, status, input_digest, params, output, error, updated_at, run_id) "
+                "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?, ?)",
+                (str(img_path), stage, status, input_digest, params, time.time(), self.run_id),
+            )
+
+    def split(self, images, stage, params, output_for):
+        """Делит фото на (нужно сделать, уже сделано) для шага; output_for(path) → путь результата"""
+        todo, done = [], []
+        for img_path in images:
+            (todo if self.pending(img_path, stage, params, output_for(img_path)) else done).append(img_path)
+        return todo, done
+
+    def summary(self):
+        """Статистика по шагам: {stage: {status: count}}"""
+        with self.lock:
+            rows = self.db.execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status").fetchall()
+        result = {}
+        for stage, status, count in rows:
+            result.setdefault(stage, {})[status] = count
+        return result
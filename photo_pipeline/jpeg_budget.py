@@ -0,0 +1,156 @@
+import io
+from PIL import Image
+from . import pipeline_metrics
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+MAX_KB = None                  # Бюджет файла: самое высокое качество (не выше QUALITY), при котором JPG влезает (None = без бюджета)
+MIN_SSIM = None                # Порог на глаз: самое низкое качество, при котором SSIM с кадром не ниже (0.98 — разница не видна)
+MIN_QUALITY = 60               # Ниже не опускаемся, даже если бюджет так и не выполнен
+
+# ==========================================
+
+SSIM_STEP = 4                  # Окна SSIM 8x8 px с шагом 4: перекрываются и захватывают границы блоков JPG
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def encode_jpeg(img, quality, optimize=False):
+    """Один JPG в памяти; без optimize — в разы дешевле, но на несколько процентов больше"""
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality, optimize=optimize)
+    return buffer.getvalue()
+
+
+def luminance(img):
+    """Яркость кадра как float-массив (SSIM по яркости: на ней глаз и замечает артефакты JPG)"""
+    import numpy as np
+
+    return np.asarray(img.convert("L"), dtype=np.float32)
+
+
+def window_means(x, step=SSIM_STEP):
+    """
+    Среднее по окнам 2*step x 2*step с шагом step: суммы блоков step x step (reshape, без свертки)
+    и сумма четырех соседних блоков — окна перекрываются наполовину и захватывают границы блоков JPG
+    """
+    h, w = x.shape[0] // step * step, x.shape[1] // step * step
+    blocks = x[:h, :w].reshape(h // step, step, w // step, step).sum(axis=(1, 3))
+    windows = blocks[:-1, :-1] + blocks[1:, :-1] + blocks[:-1, 1:] + blocks[1:, 1:]
+    return windows / (4 * step * step)
+
+
+class SsimReference:
+    """Кадр до сжатия: его яркость и статистика окон считаются один раз на все попытки поиска"""
+
+    def __init__(self, img):
+        self.lum = luminance(img)
+        self.mean = window_means(self.lum)
+        self.var = window_means(self.lum * self.lum) - self.mean * self.mean
+
+    def ssim(self, data):
+        """SSIM яркости JPG (байты) относительно кадра; 1.0 — неотличимо"""
+        with Image.open(io.BytesIO(data)) as decoded:
+            candidate = luminance(decoded)
+        mean = window_means(candidate)
+        var = window_means(candidate * candidate) - mean * mean
+        cov = window_means(self.lum * candidate) - self.mean * mean
+        ssim_map = ((2 * self.mean * mean + SSIM_C1) * (2 * cov + SSIM_C2)) / (
+            (self.mean * self.mean + mean * mean + SSIM_C1) * (self.var + var + SSIM_C2)
+        )
+        return float(ssim_map.mean())
+
+
+def highest(low, high, ok):
+    """Самое высокое q из [low, high], для которого ok(q) (ok выполняется для всех q ниже порога); нет такого — low"""
+    if ok(high):
+        return high  # Дешевый случай: максимум и так подходит — одна попытка
+    while high - low > 1:
+        mid = (low + high) // 2
+        if ok(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def lowest(low, high, ok):
+    """Самое низкое q из [low, high], для которого ok(q) (ok выполняется для всех q выше порога); нет такого — high"""
+    if not ok(high):
+        return high
+    bad = low - 1
+    while high - bad > 1:
+        mid = (bad + high) // 2
+        if ok(mid):
+            high = mid
+        else:
+            bad = mid
+    return high
+
+
+class JpegBudget:
+    """
+    Подбор качества JPG под бюджет размера и / или порог SSIM:
+    1. Качество ищется бинарным поиском между MIN_QUALITY и QUALITY на буферах в памяти,
+       без optimize (он только чуть уменьшает файл и не меняет пиксели): ≤ 7 дешевых проходов.
+    2. Порог SSIM — самое низкое качество, которое на глаз не отличить; бюджет — самое высокое, которое влезает.
+       Заданы оба — берется меньшее качество (влезть в бюджет важнее).
+    3. optimize — только на последнем проходе, на диск файл пишется один раз.
+    Без бюджета и порога — как раньше: QUALITY с optimize, один проход.
+    Объект простой (только числа) — передается в процессы пула.
+    """
+
+    def __init__(self, max_kb=MAX_KB, min_ssim=MIN_SSIM, min_quality=MIN_QUALITY):
+        self.max_bytes = int(max_kb * 1024) if max_kb else None
+        self.min_ssim = min_ssim
+        self.min_quality = min_quality
+
+    @property
+    def active(self):
+        return bool(self.max_bytes or self.min_ssim)
+
+    def params(self):
+        """Для отпечатка шага в журнале: поменяли бюджет — JPG пересобираются (без бюджета отпечаток прежний)"""
+        if not self.active:
+            return {}
+        return {"max_bytes": self.max_bytes, "min_ssim": self.min_ssim, "min_quality": self.min_quality}
+
+    def choose(self, img, quality, img_path=None):
+        """Качество для кадра: (качество, JPG без optimize с этим качеством или None, если поиска не было)"""
+        if not self.active:
+            return quality, None
+
+        low = min(self.min_quality, quality)
+        drafts = {}  # качество → JPG без optimize (каждое качество кодируем не больше одного раза)
+
+        def draft(q):
+            if q not in drafts:
+                drafts[q] = encode_jpeg(img, q)
+            return drafts[q]
+
+        with pipeline_metrics.span("jpeg_search", img_path) as extra:
+            chosen = quality
+            if self.min_ssim:
+                reference = SsimReference(img)
+                chosen = lowest(low, quality, lambda q: reference.ssim(draft(q)) >= self.min_ssim)
+            if self.max_bytes:
+                chosen = highest(low, chosen, lambda q: len(draft(q)) <= self.max_bytes)
+            result = draft(chosen)
+            extra["quality"] = chosen
+            extra["tries"] = len(drafts)
+        pipeline_metrics.add("jpeg_tries", len(drafts))
+        return chosen, result
+
+    def encode(self, img, quality, img_path=None):
+        """Кадр → (байты JPG, выбранное качество); optimize — один раз, на выбранном качестве"""
+        chosen, draft = self.choose(img, quality, img_path)
+        with pipeline_metrics.span("jpeg_save", img_path, quality=chosen) as extra:
+            data = encode_jpeg(img, chosen, optimize=True)
+            if draft is not None and len(draft) < len(data):
+                data = draft  # optimize не помог (крошечный кадр): берем черновик
+            extra["bytes_out"] = len(data)
+        if self.max_bytes and len(data) > self.max_bytes:
+            pipeline_metrics.add("over_budget")
+        return data, chosen
@@ -0,0 +1,167 @@
+import io
+import asyncio
+import mimetypes
+from pathlib import Path
+from PIL import Image, features
+from . import pipeline_metrics
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+# Во что перекодировать фото перед загрузкой (без потерь): первый формат, который умеет Pillow
+# (PNG — только если нет WebP); исходник тоже участвует, если он меньше. () = отправлять как есть
+UPLOAD_FORMATS = ("webp", "png")
+
+# ==========================================
+
+CONTENT_TYPES = {"webp": "image/webp", "png": "image/png"}
+# Исходники с потерями уходят как есть: копия без потерь всегда больше самого JPG
+LOSSY_SOURCES = ("JPEG", "MPO")
+
+
+def encode_variant(img, fmt, icc_profile):
+    """Одно фото в одном формате без потерь, в памяти"""
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        # lossless: пиксели те же, что в PNG; method 4 — почти то же сжатие, что 6, но в разы быстрее
+        img.save(buffer, "WEBP", lossless=True, quality=100, method=4, icc_profile=icc_profile)
+    else:
+        # zlib по умолчанию: optimize дает -1–2% размера за вдвое большее время, а это путь каждого апскейла
+        img.save(buffer, "PNG", icc_profile=icc_profile)
+    return buffer.getvalue()
+
+
+def pick_format(formats):
+    """Первый из formats, который умеет эта сборка Pillow (WebP бывает собран без libwebp), или None"""
+    for fmt in formats:
+        if fmt != "webp" or features.check("webp"):
+            return fmt
+    return None
+
+
+def smallest_variant(img, stem, formats, icc_profile=None, best=None):
+    """Меньшее из best и копии img в первом доступном из formats: (байты, имя файла, content type)"""
+    fmt = pick_format(formats)
+    if fmt is None:
+        return best
+    data = encode_variant(img, fmt, icc_profile)
+    if best is None or len(data) < len(best[0]):
+        best = (data, f"{stem}.{fmt}", CONTENT_TYPES[fmt])
+    return best
+
+
+def encode_image(img, stem, formats=UPLOAD_FORMATS):
+    """Картинка из памяти (HTTP сервис) → байты для загрузки: (байты, имя файла, content type)"""
+    return smallest_variant(img, stem, formats or ("png",), img.info.get("icc_profile"))
+
+
+def encode_payload(img_path, formats=UPLOAD_FORMATS):
+    """
+    Готовит байты для загрузки: исходник или его копия без потерь (см. UPLOAD_FORMATS), что меньше.
+    JPEG не перекодируется — копия без потерь его не обгонит, а стоила бы секунду CPU на фото.
+    Возвращает (байты, имя файла, content type, размер исходника).
+    """
+    img_path = Path(img_path)
+    raw = img_path.read_bytes()
+    best = (raw, img_path.name, mimetypes.guess_type(img_path.name)[0] or "application/octet-stream")
+
+    if formats:
+        with Image.open(io.BytesIO(raw)) as img:
+            if img.format not in LOSSY_SOURCES:
+                img.load()
+                best = smallest_variant(img, img_path.stem, formats, img.info.get("icc_profile"), best)
+
+    return (*best, len(raw))
+
+
+class PayloadUploader:
+    """
+    Загрузка фото в Replicate один раз на фото:
+    1. Перекодируем без потерь, если так меньше (JPEG — как есть; один раз, даже если загрузка упала).
+    2. Загружаем через files API и запоминаем ссылку.
+    3. Все повторные попытки для этого фото берут готовую ссылку, без повторной передачи байтов.
+    4. Ссылка живет только до последней попытки (forget после успеха или финальной ошибки) и только для того
+       же файла: фото, замененное под тем же именем (watch, тайлы следующего запуска), загружается заново,
+       а словари не растут весь сеанс.
+    """
+
+    def __init__(self, client, formats=UPLOAD_FORMATS):
+        self.client = client
+        self.formats = formats
+        self.payloads = {}   # Закодировано, но еще не загружено: путь → (отметка файла, payload)
+        self.urls = {}       # Уже загружено: путь → (отметка файла, ссылка)
+        self.files = 0
+        self.original_bytes = 0
+        self.uploaded_bytes = 0
+        self.reused = 0      # Повторные попытки, которым не пришлось загружать фото заново
+
+    @staticmethod
+    def stamp(img_path):
+        """Отметка содержимого файла: другой размер или mtime — другое фото под тем же именем"""
+        stat = Path(img_path).stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def payload_for(self, img_path):
+        key, stamp = str(img_path), self.stamp(img_path)
+        cached = self.payloads.get(key)
+        if cached is None or cached[0] != stamp:
+            with pipeline_metrics.span("encode_payload", img_path) as extra:
+                cached = self.payloads[key] = (stamp, encode_payload(img_path, self.formats))
+                extra["bytes"] = len(cached[1][0])
+        return cached[1]
+
+    def uploaded(self, img_path, file):
+        """Запоминаем ссылку и считаем сэкономленные байты (один раз на фото)"""
+        stamp, (data, _, _, original_size) = self.payloads.pop(str(img_path))
+        pipeline_metrics.add("bytes_uploaded", len(data))
+        self.files += 1
+        self.original_bytes += original_size
+        self.uploaded_bytes += len(data)
+        url = file.urls["get"]
+        self.urls[str(img_path)] = (stamp, url)
+        return url
+
+    def cached_url(self, img_path):
+        """Ссылка с прошлой попытки для того же файла или None"""
+        cached = self.urls.get(str(img_path))
+        if cached is None or cached[0] != self.stamp(img_path):
+            return None
+        self.reused += 1
+        pipeline_metrics.add("upload_reused")
+        return cached[1]
+
+    def forget(self, img_path):
+        """Предсказание для фото прошло: ссылка больше не нужна (и через сутки все равно протухнет у Replicate)"""
+        self.urls.pop(str(img_path), None)
+        self.payloads.pop(str(img_path), None)
+
+    def url_for(self, img_path):
+        """Ссылка на загруженное фото (загружает при первом вызове)"""
+        url = self.cached_url(img_path)
+        if url:
+            return url
+        data, filename, content_type, _ = self.payload_for(img_path)
+        with pipeline_metrics.span("upload", img_path, bytes=len(data)):
+            file = self.client.files.create(io.BytesIO(data), filename=filename, content_type=content_type)
+        return self.uploaded(img_path, file)
+
+    async def aurl_for(self, img_path):
+        """То же для asyncio: кодирование в отдельном потоке, загрузка через общий async клиент"""
+        url = self.cached_url(img_path)
+        if url:
+            return url
+        data, filename, content_type, _ = await asyncio.to_thread(self.payload_for, img_path)
+        with pipeline_metrics.span("upload", img_path, bytes=len(data)):
+            file = await self.client.files.async_create(io.BytesIO(data), filename=filename, content_type=content_type)
+        return self.uploaded(img_path, file)
+
+    def report(self):
+        """Итог по загрузкам: сколько байт не пришлось передавать"""
+        if not self.files:
+            return
+        saved = self.original_bytes - self.uploaded_bytes
+        percent = saved / self.original_bytes * 100 if self.original_bytes else 0.0
+        mb = 1024 * 1024
+        print(f"   📤 Загружено {self.files} файлов: {self.original_bytes / mb:.1f} MB → {self.uploaded_bytes / mb:.1f} MB "
+              f"(сэкономлено {saved / mb:.1f} MB, {percent:.0f}%), повторов без загрузки: {self.reused}")
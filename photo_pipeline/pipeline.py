@@ -0,0 +1,1146 @@
+import io
+import os
+import asyncio
+import contextlib
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageDraw
+from . import upscale_cache
+from . import upscale_planner
+from . import upscalers
+from . import tiled_upscale
+from . import payload_upload
+from . import job_ledger
+from . import adaptive_limiter
+from . import inpaint_engine
+from . import wb_prepare
+from . import jpeg_budget
+from . import renditions
+from . import pipeline_metrics
+from . import work_leases
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ
+# ==========================================
+# Значения по умолчанию: меняются здесь, флагами CLI (python -m photo_pipeline full --help)
+# или из своего кода: pipeline.run(input_dir="...", streaming=False)
+
+# Папки
+INPUT_DIR = "input"            # Исходные фото
+CLEAN_DIR = "output"           # Фото без вотермарок
+FINAL_DIR = "final_upscaled"   # Финальные 4K фото
+MASK_PATH = "mask_auto.png"    # Имя файла маски (генерируется автоматически)
+
+# Настройки маски (под ваши фото 832x1248 с ромбиком в углу)
+IMG_W, IMG_H = 832, 1248
+MARK_W, MARK_H = 100, 100      # Размер квадрата удаления
+MARGIN_RIGHT = 0               # Отступ справа
+MARGIN_BOTTOM = 0              # Отступ снизу
+
+# Настройки удаления вотермарок (LaMa в памяти процесса)
+INPAINT_DEVICE = "auto"        # auto / cpu / cuda / mps (auto сам выберет, на Linux без GPU — cpu)
+INPAINT_THREADS = 0            # Потоки torch на CPU (0 = по умолчанию)
+ROI_MODE = True                # Гоняем через LaMa только окно вокруг маски, а не весь кадр
+INPAINT_WORKERS = 1            # Процессы со своей моделью для шага 1 (например 8 на 32 ядра)
+
+# Автопоиск вотермарки: своя маска под каждое фото, фото без знака идут мимо LaMa
+AUTO_DETECT = True             # False = одна фиксированная маска на все фото (как раньше)
+WATERMARK_DIR = "watermarks"   # Шаблоны (PNG с прозрачностью); создать из своих фото: python -m photo_pipeline learn
+DETECT_THRESHOLD = 0.55        # Порог совпадения с шаблоном (выше = строже)
+
+# Настройки Wildberries
+WB_DIR = "ready_for_wb"        # Куда кладем готовое для WB
+TARGET_W = 900                 # Ширина WB
+TARGET_H = 1200                # Высота WB
+QUALITY = 95                   # Качество JPG (с бюджетом — потолок подбора)
+WB_MAX_KB = None               # Бюджет JPG в KB: качество подбирается в памяти, самое высокое, при котором файл влезает
+WB_MIN_SSIM = None             # Или порог на глаз: самое низкое качество со SSIM не ниже (0.98 — разница не видна)
+WB_MIN_QUALITY = 60            # Ниже этого качества подбор не опускается
+WB_WORKERS = 0                 # Процессы для подготовки WB (0 = все ядра)
+WB_CHUNKSIZE = 4               # Сколько фото отдаем процессу за раз (режим "шаг за шагом")
+# Еще размеры из того же декодирования, что и JPG для WB: имя:ШИРИНАxВЫСОТА[:crop|fit|pad][:jpg|webp|png][:качество][:150kb]
+RENDITIONS = ()                # Например ("thumb:300x400:webp:80", "ozon:1200x1600:95", "site:1600x1600:pad")
+RENDITIONS_DIR = "renditions"  # Файлы: renditions/{имя}/{фото}.{формат}
+
+# Настройки Replicate (Recraft Crisp Upscale)
+MODEL_VERSION = "recraft-ai/recraft-crisp-upscale"
+# Апскейл только там, где он нужен под размер WB (832x1248 → 900x1200 — это всего x1.08)
+UPSCALE_MIN_FACTOR = 1.25      # Если фото надо увеличить не больше чем в 1.25 раза — без модели, только ресайз
+
+# Чем апскейлить: replicate / local (Real-ESRGAN на этом компьютере) / auto (до LOCAL_MAX_FACTOR локально)
+UPSCALE_BACKEND = "replicate"
+LOCAL_MAX_FACTOR = 2.0         # В режиме auto: фото, которым нужно не больше x2, апскейлим локально
+LOCAL_MODEL = "realesr-general-x4v3"  # Локальная модель (веса скачаются при первом запуске)
+LOCAL_THREADS = 0              # Потоки torch для локального апскейла (0 = по умолчанию)
+LOCAL_TILE = 256               # Размер тайла: меньше = меньше памяти
+
+# Большие фото режем на тайлы и апскейлим их параллельно (не упираемся в таймаут и лимиты Replicate)
+TILED_MIN_PIXELS = 4_000_000   # Больше 4 Мп — по тайлам (0 = никогда)
+TILE_SIZE = 1024               # Сторона тайла (px)
+TILE_OVERLAP = 64              # Перекрытие тайлов (px) для склейки без швов
+# Сколько запросов одновременно: лимит подстраивается сам (растет, пока все хорошо, и режется на 429)
+START_CONCURRENT = 5           # С чего начинаем
+MIN_CONCURRENT = 1             # Минимум
+MAX_CONCURRENT = 32            # Потолок (не больше HTTP_MAX_CONNECTIONS)
+HTTP_MAX_CONNECTIONS = 32      # Общий пул соединений к Replicate на весь запуск
+HTTP_KEEPALIVE_SECONDS = 60    # Сколько держим простаивающее соединение (без нового TLS рукопожатия)
+UPLOAD_FORMATS = ("webp", "png")  # Перед загрузкой PNG и др. без потерь перекодируем в первый доступный (JPEG — как есть; () = все как есть)
+
+# Общий кэш апскейлов (по содержимому файла + модели)
+CACHE_DIR = ".upscale_cache"   # Папка кэша
+CACHE_MAX_GB = 20              # Лимит размера кэша
+
+# Журнал задач: повторный запуск делает только то, что изменилось или не доделано
+LEDGER_PATH = "pipeline_ledger.sqlite3"
+
+# Потоковый режим: каждое фото само проходит inpaint → upscale → WB, не дожидаясь остальных
+STREAMING = True               # False = старый режим "шаг за шагом" по всей папке
+QUEUE_SIZE = 10                # Размер очередей между шагами (сколько фото может "ждать" следующего шага)
+# False: 4K из Replicate сразу ужимается под WB в памяти, на диск пишется только JPG
+# (только потоковый режим; фото по тайлам и из кэша идут как обычно, новые апскейлы в кэш не попадают)
+KEEP_MASTER = True
+
+# HTTP сервис (python -m photo_pipeline serve): POST фото → JPG для WB, без папок
+SERVICE_HOST = "127.0.0.1"     # 0.0.0.0 — принимать запросы с других машин (например, за балансировщиком)
+SERVICE_PORT = 8000
+SERVICE_MAX_JOBS = 4           # Фото в работе одновременно (LaMa все равно по одному, апскейл и ресайз — параллельно)
+SERVICE_MAX_QUEUE = 16         # Сколько запросов может ждать сверх этого; дальше — 503 с Retry-After
+SERVICE_MAX_UPLOAD_MB = 40     # Фото больше — 413
+
+# Наблюдение за папкой (python -m photo_pipeline watch): модели и пул соединений живут весь сеанс
+WATCH_BACKEND = "auto"         # auto (inotify на Linux, иначе опрос) / inotify / poll
+WATCH_SETTLE_SECONDS = 1.0     # Фото берем, когда файл столько секунд не менялся (защита от недописанных)
+WATCH_POLL_INTERVAL = 1.0      # Период опроса папки без inotify (сек)
+
+# Несколько машин над одной общей папкой (NFS / SMB): каждая запускает тот же full или watch
+SHARD = None                   # "i/n": машина берет только свою долю фото (по имени, без общего состояния); работает и в шагах
+LEASE_PATH = None              # Папка файлов аренды или файл *.sqlite3 на общем диске: фото раздаются по одному, по скорости машин
+LEASE_SECONDS = 300            # Аренда без продления протухает: фото упавшей машины заберут другие
+NODE_ID = None                 # Имя машины в аренде (None = hostname:pid)
+
+# Замеры: время каждого шага и каждого фото, байты, повторы, 429 (сводка + трасса для ui.perfetto.dev)
+METRICS_ENABLED = True
+METRICS_DIR = "metrics"
+# Профиль каждого шага (горячие функции, места выделения памяти) рядом с замерами; замедляет, только для разбора
+PROFILE_ENABLED = False
+
+# ==========================================
+
+
+class PipelineError(Exception):
+    """Запуск невозможен (нет токена, нет фото, нет iopaint): CLI печатает сообщение и выходит с кодом 1"""
+
+
+def configure(**settings):
+    """
+    Меняет настройки модуля на время процесса: configure(input_dir="in", streaming=False).
+    Имена — как в блоке НАСТРОЕК, в любом регистре; неизвестное имя — ошибка, а не тихий пропуск.
+    """
+    for name, value in settings.items():
+        key = name.upper()
+        if not key.isupper() or key not in globals() or callable(globals()[key]):
+            raise TypeError(f"Нет такой настройки: {name}")
+        globals()[key] = value
+
+
+def setup_environment(source_dir=None, need_token=True, allow_empty=False):
+    """
+    Проверка окружения и токенов; source_dir — откуда шаг берет фото (по умолчанию INPUT_DIR),
+    allow_empty — пустая папка не ошибка (режим наблюдения ждет фото)
+    """
+    source_dir = source_dir or INPUT_DIR
+    check_token(need_token)
+    my_shard()  # Ошибки в SHARD и RENDITIONS — до загрузки моделей
+    wb_extra()
+        
+    # Создаем папки, если их нет
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    os.makedirs(CLEAN_DIR, exist_ok=True)
+    os.makedirs(FINAL_DIR, exist_ok=True)
+    os.makedirs(WB_DIR, exist_ok=True)
+
+    # Проверяем наличие фото
+    files = list(Path(source_dir).glob("*"))
+    if not files and not allow_empty:
+        raise PipelineError(f"Папка '{source_dir}' пуста! Положите туда фотографии.")
+    
+    print(f"✅ Найдено {len(files)} файлов для обработки.")
+
+
+def check_token(required=True):
+    """Загружает .env и проверяет токен Replicate (для локального апскейла он не нужен)"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if required and UPSCALE_BACKEND != "local" and not os.getenv("REPLICATE_API_TOKEN"):
+        raise PipelineError("Токен не найден! Создайте файл .env и добавьте туда: REPLICATE_API_TOKEN=r8_ваш_токен")
+
+
+def generate_mask():
+    """Генерация идеальной маски под правый нижний угол"""
+    print("\n🎨 Генерируем маску...")
+    draw_mask().save(MASK_PATH)
+    print(f"✅ Маска сохранена: {MASK_PATH} (Удаление зоны: {MARK_W}x{MARK_H} px в углу)")
+
+
+def draw_mask():
+    """Маска в памяти: белый прямоугольник MARK_W x MARK_H в правом нижнем углу кадра IMG_W x IMG_H"""
+    mask = Image.new('L', (IMG_W, IMG_H), 0)  # Черный фон
+    draw = ImageDraw.Draw(mask)
+
+    # Координаты
+    x1 = IMG_W - MARK_W - MARGIN_RIGHT
+    y1 = IMG_H - MARK_H - MARGIN_BOTTOM
+    x2 = IMG_W - MARGIN_RIGHT
+    y2 = IMG_H - MARGIN_BOTTOM
+
+    # Рисуем белый квадрат
+    draw.rectangle([x1, y1, x2, y2], fill=255)
+    return mask
+
+
+def create_detector():
+    """Детектор вотермарок по шаблонам (None — одна фиксированная маска на все фото)"""
+    if not AUTO_DETECT:
+        return None
+    from . import watermark_detect  # OpenCV грузим, только когда нужен детектор
+
+    detector = watermark_detect.load_detector(WATERMARK_DIR, DETECT_THRESHOLD)
+    if detector is None:
+        print(f"   ⚠️  Шаблонов вотермарок в '{WATERMARK_DIR}' нет — маска одна на все фото (создать: python -m photo_pipeline learn)")
+    else:
+        print(f"   🔎 Автопоиск вотермарки: шаблонов {len(detector.profiles)}, порог {DETECT_THRESHOLD}")
+    return detector
+
+
+def inpaint_params(detector=None):
+    """Отпечаток настроек шага 1: геометрия маски (или шаблоны детектора) и режим LaMa"""
+    return job_ledger.fingerprint(
+        mask=(IMG_W, IMG_H, MARK_W, MARK_H, MARGIN_RIGHT, MARGIN_BOTTOM),
+        detect=detector.fingerprint() if detector else None,
+        model="lama", roi=ROI_MODE, roi_padding=inpaint_engine.ROI_PADDING,
+    )
+
+
+def upscale_params():
+    """Отпечаток настроек шага 2: модель апскейла и маршрут под размер WB"""
+    return job_ledger.fingerprint(
+        model=MODEL_VERSION, target=(TARGET_W, TARGET_H), min_factor=UPSCALE_MIN_FACTOR,
+        backend=UPSCALE_BACKEND, local=(LOCAL_MODEL, LOCAL_MAX_FACTOR), direct_wb=direct_to_wb(),
+        **(wb_budget().params() if direct_to_wb() else {}),
+        **({"renditions": (list(RENDITIONS), RENDITIONS_DIR)} if direct_to_wb() and RENDITIONS else {}),
+    )
+
+
+def direct_to_wb():
+    """Апскейл из Replicate сразу в JPG для WB, без 4K мастера на диске"""
+    return STREAMING and not KEEP_MASTER
+
+
+def local_upscaler():
+    """Локальная модель (грузится при первом фото, которому она нужна)"""
+    return upscalers.get_local_upscaler(LOCAL_MODEL, threads=LOCAL_THREADS, tile=LOCAL_TILE)
+
+
+def wb_budget():
+    """Подбор качества JPG для WB (WB_MAX_KB / WB_MIN_SSIM; без них — QUALITY как есть)"""
+    return jpeg_budget.JpegBudget(WB_MAX_KB, WB_MIN_SSIM, WB_MIN_QUALITY)
+
+
+def wb_extra():
+    """Дополнительные размеры (RENDITIONS); ошибка в описании — PipelineError"""
+    try:
+        return tuple(renditions.parse_rendition(spec, RENDITIONS_DIR) for spec in RENDITIONS)
+    except ValueError as e:
+        raise PipelineError(f"RENDITIONS: {e}") from e
+
+
+def wb_params():
+    """Отпечаток настроек шага 3: размер и качество JPG (и бюджет, и дополнительные размеры, если заданы)"""
+    extra = {"renditions": (list(RENDITIONS), RENDITIONS_DIR)} if RENDITIONS else {}
+    return job_ledger.fingerprint(size=(TARGET_W, TARGET_H), quality=QUALITY, **wb_budget().params(), **extra)
+
+
+def clean_path_for(img_path):
+    """Куда шаг 1 кладет очищенное фото"""
+    return Path(CLEAN_DIR) / f"{img_path.stem}.png"
+
+
+def wb_path_for(img_path):
+    """Куда шаг 3 кладет готовый JPG"""
+    return Path(WB_DIR) / f"{img_path.stem}.jpg"
+
+
+def my_shard():
+    """SHARD = "i/n" → (i-1, n); None — все фото"""
+    if not SHARD:
+        return None
+    try:
+        return work_leases.parse_shard(SHARD)
+    except ValueError as e:
+        raise PipelineError(f"SHARD: {e}") from e
+
+
+def my_images(images):
+    """Фото доли этой машины (SHARD); доля по имени исходника, поэтому одна и та же на всех шагах"""
+    shard = my_shard()
+    return [img_path for img_path in images if work_leases.in_shard(img_path, shard, FINAL_DIR)]
+
+
+async def my_incoming(incoming):
+    """То же для потока фото (режим наблюдения)"""
+    shard = my_shard()
+    async for img_path in incoming:
+        if work_leases.in_shard(img_path, shard, FINAL_DIR):
+            yield img_path
+
+
+def create_leases():
+    """Аренда фото у общей очереди нескольких машин (LEASE_PATH) или None"""
+    if not LEASE_PATH:
+        return None
+    leases = work_leases.open_leases(LEASE_PATH, NODE_ID, LEASE_SECONDS, FINAL_DIR)
+    print(f"🤝 Аренда фото: {leases.kind} ({LEASE_PATH}), машина {leases.node}, продление каждые {LEASE_SECONDS * work_leases.RENEW_FRACTION:.0f} сек")
+    return leases
+
+
+@contextlib.asynccontextmanager
+async def leased():
+    """Аренда на время конвейера (или None без LEASE_PATH): продление в фоне, на выходе недоделанные фото отпускаются"""
+    leases = create_leases()
+    if leases is None:
+        yield None
+        return
+    renewer = asyncio.create_task(leases.keep_alive())
+    try:
+        yield leases
+    finally:
+        renewer.cancel()
+        await asyncio.to_thread(leases.close)
+        print(f"🤝 Аренда: {leases.status()}")
+
+
+async def release(leases, img_path, done=True):
+    """Фото закончено на этой машине: снимаем аренду (done — готово, другие машины его не берут)"""
+    if leases is not None:
+        await asyncio.to_thread(leases.release, img_path, done)
+
+
+def step_1_remove_watermarks(ledger):
+    """Удаление вотермарок: LaMa загружается один раз и чистит все фото в памяти процесса"""
+    print("\n🧹 ШАГ 1: Удаляем вотермарки через LaMa (локально)...")
+    
+    # Берем только новые/измененные фото (или если поменялась маска / шаблоны)
+    detector = create_detector()
+    params = inpaint_params(detector)
+    images, skipped = ledger.split(my_images(inpaint_engine.list_images(INPUT_DIR)), "inpaint", params, clean_path_for)
+    if skipped:
+        print(f"   ⏭️  Без изменений, пропускаем: {len(skipped)} фото")
+    if not images:
+        print("✅ Все фото уже очищены.")
+        return
+
+    for img_path in images:
+        ledger.start(img_path, "inpaint", params)
+    
+    try:
+        done = inpaint_engine.remove_watermarks(INPUT_DIR, MASK_PATH, CLEAN_DIR, INPAINT_DEVICE, INPAINT_THREADS, ROI_MODE, INPAINT_WORKERS, images, detector)
+        for img_path in done:
+            ledger.finish(img_path, "inpaint", clean_path_for(img_path))
+        for img_path in set(images) - set(done):
+            ledger.fail(img_path, "inpaint", "ошибка LaMa")
+        print(f"✅ Вотермарки успешно удалены ({len(done)} фото).")
+    except ImportError as e:
+        raise PipelineError("iopaint не установлен! Выполните: pip install iopaint") from e
+    except Exception as e:
+        raise PipelineError(f"Ошибка LaMa: {e}") from e
+
+
+def create_async_client():
+    """
+    Один клиент Replicate на весь запуск:
+    1. Общий пул соединений с keep-alive — TLS рукопожатие одно на соединение, а не на фото.
+    2. Вызовы через async API httpx, без отдельного потока на каждый запрос.
+    Возвращает (клиент, транспорт); транспорт закрыть в конце: await transport.aclose()
+    """
+    import httpx
+    import replicate
+
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        )
+    )
+    client = replicate.Client(
+        api_token=os.getenv("REPLICATE_API_TOKEN"),
+        timeout=httpx.Timeout(300.0, connect=60.0),  # 5 мин на ответ, 60 сек на подключение
+        transport=transport,
+    )
+    return client, transport
+
+
+def create_remote(client, limiter, uploader):
+    """
+    Replicate как один из бэкендов апскейла: каждый запрос (фото или тайл) идет через адаптивный лимит,
+    фото загружается один раз и переиспользуется во всех повторных попытках
+    """
+    return upscalers.LimitedUpscaler(upscalers.ReplicateUpscaler(MODEL_VERSION, client, uploader), limiter)
+
+
+def create_planner():
+    """Планировщик маршрутов апскейла под размер WB"""
+    return upscale_planner.UpscalePlanner(TARGET_W, TARGET_H, UPSCALE_MIN_FACTOR, UPSCALE_BACKEND, LOCAL_MAX_FACTOR)
+
+
+def create_limiter():
+    """Адаптивный лимит одновременных запросов вместо фиксированного семафора"""
+    return adaptive_limiter.AdaptiveLimiter(START_CONCURRENT, MIN_CONCURRENT, MAX_CONCURRENT)
+
+
+# Ошибки Replicate, которые стоит повторить
+RETRYABLE_ERRORS = (
+    "timed out",
+    "timeout",
+    "peer closed connection",  # Обрыв соединения
+    "connection reset",
+    "incomplete message",
+)
+
+
+def classify_error(error_msg):
+    """(можно повторить, это 429 / throttled) по тексту ошибки"""
+    lowered = error_msg.lower()
+    return any(err in lowered for err in RETRYABLE_ERRORS), "429" in error_msg or "throttled" in lowered
+
+
+async def upscale_single_image(img_path, limiter, total, index, cache, remote, ledger, planner):
+    """Апскейл одной картинки (асинхронно): Replicate с увеличенным таймаутом и retry или локальная модель"""
+    output_filename = Path(FINAL_DIR) / f"upscaled_{img_path.name}"
+    params = upscale_params()
+    # Без мастера (KEEP_MASTER = False) результат шага — сразу JPG для WB
+    if direct_to_wb() and not output_filename.exists():
+        result_path = wb_path_for(output_filename)
+    else:
+        result_path = output_filename
+
+    # Журнал: этот файл уже апскейлен этой моделью и результат на месте (хэши считаем в потоке — файлы большие)
+    if not await asyncio.to_thread(ledger.pending, img_path, "upscale", params, result_path):
+        print(f"[{index}/{total}] ⏭️  Уже готово: {img_path.name}")
+        return True
+    await asyncio.to_thread(ledger.start, img_path, "upscale", params)
+
+    # Фото уже почти нужного размера — модель не нужна, ресайз сделает шаг WB
+    # (заголовок фото и ссылка / копия — файловые операции, в потоке)
+    route, scale = await asyncio.to_thread(planner.route_for, img_path)
+    if route == upscale_planner.ROUTE_RESAMPLE:
+        await asyncio.to_thread(upscale_planner.passthrough, img_path, output_filename)
+        planner.record(route)
+        await asyncio.to_thread(ledger.finish, img_path, "upscale", output_filename)
+        print(f"[{index}/{total}] 📐 Без апскейла (нужно x{scale:.2f}): {img_path.name}")
+        return True
+    
+    upscaler = await asyncio.to_thread(local_upscaler) if route == upscale_planner.ROUTE_LOCAL else remote
+    
+    # Пропускаем, если такой же файл уже апскейлили (по содержимому, а не по имени)
+    cache_key, cached = await asyncio.to_thread(cache.restore, img_path, output_filename, upscaler.model_id)
+    if cached:
+        planner.record(upscale_planner.ROUTE_CACHED)
+        await asyncio.to_thread(ledger.finish, img_path, "upscale", output_filename)
+        print(f"[{index}/{total}] ⏭️  Из кэша (без запроса): {img_path.name}")
+        return True
+
+    if route == upscale_planner.ROUTE_LOCAL:
+        # Локальная модель одна на процесс: фото идут через нее по очереди, лимит Replicate не нужен
+        print(f"[{index}/{total}] 🖥️  Локальный апскейл (нужно x{scale:.2f}): {img_path.name}...")
+        started = time.perf_counter()
+        try:
+            await upscaler.aupscale_file(img_path, output_filename)
+        except Exception as e:
+            print(f"      ❌ Ошибка локального апскейла: {e}")
+            await asyncio.to_thread(ledger.fail, img_path, "upscale", e)
+            return False
+        await asyncio.to_thread(cache.store, cache_key, output_filename)
+        await asyncio.to_thread(ledger.finish, img_path, "upscale", output_filename)
+        planner.record(route, time.perf_counter() - started)
+        print(f"      ✨ Успех! Сохранено в: {output_filename.name}")
+        return True
+
+    # Большое фото — режем на тайлы, они идут в Replicate параллельно (каждый со своим слотом лимита)
+    tiled = await asyncio.to_thread(tiled_upscale.needs_tiling, img_path, TILED_MIN_PIXELS)
+    
+    # Повторяем до 2 раз при timeout
+    max_retries = 2
+    image_started = time.perf_counter()
+    for attempt in range(max_retries):
+        if attempt == 0:
+            mode = ", по тайлам" if tiled else ""
+            print(f"[{index}/{total}] ⏳ Отправка в Replicate{mode}: {img_path.name}... ({limiter.status()})")
+        try:
+            # Слот лимита берется на каждый запрос, паузы между попытками лимит не занимают
+            if tiled:
+                # Готовые тайлы переживают повторную попытку, заново идут только упавшие
+                await tiled_upscale.atiled_upscale_file(remote, img_path, output_filename, TILE_SIZE, TILE_OVERLAP)
+            elif direct_to_wb():
+                # 4K не сохраняется мастером: из временного буфера сразу ресайз под WB, на диск (атомарно) пишется лишь JPG
+                with await remote.aupscale_spooled(img_path) as master:
+                    save_path = await asyncio.to_thread(
+                        wb_prepare.prepare_image, output_filename, WB_DIR, TARGET_W, TARGET_H, QUALITY, master, wb_budget(), wb_extra()
+                    )
+                await asyncio.to_thread(ledger.finish, img_path, "upscale", save_path)
+                planner.record(route, time.perf_counter() - image_started)
+                print(f"      ✨ Успех! Сразу для WB: {save_path.name} ({limiter.status()})")
+                return True
+            else:
+                # Асинхронный вызов через общий клиент, результат скачивается в output_filename
+                await remote.aupscale_file(img_path, output_filename)
+            await asyncio.to_thread(cache.store, cache_key, output_filename)
+            await asyncio.to_thread(ledger.finish, img_path, "upscale", output_filename)
+            planner.record(route, time.perf_counter() - image_started)
+            
+            print(f"      ✨ Успех! Сохранено в: {output_filename.name} ({limiter.status()})")
+            return True
+                    
+        except Exception as e:
+            error_msg = str(e)
+            # Проверяем, можно ли повторить запрос
+            is_retryable, throttled = classify_error(error_msg)
+        
+        if is_retryable and attempt < max_retries - 1:
+            print(f"      🔄 Обрыв соединения (попытка {attempt + 1}/{max_retries}), повтор через 5 сек...")
+            await pipeline_metrics.asleep(5, "retry_sleep", img_path)
+            continue
+        
+        # Если это rate limit (лимит уже урезан)
+        elif throttled:
+            print(f"      🛑 Rate limit ({limiter.status()}). Пауза 10 секунд...")
+            await pipeline_metrics.asleep(10, "throttle_sleep", img_path)
+            if attempt < max_retries - 1:
+                continue
+        
+        # Финальная ошибка: повторов не будет — загруженное фото (и тайлы) в памяти не держим
+        print(f"      ❌ Ошибка API: {error_msg}")
+        remote.forget(img_path)
+        if tiled:
+            await asyncio.to_thread(tiled_upscale.forget_tiles, remote, output_filename)
+        await asyncio.to_thread(ledger.fail, img_path, "upscale", error_msg)
+        return False
+    
+    return False
+
+
+async def step_2_upscale_async(ledger):
+    """Апскейлинг через Replicate API (асинхронная версия)"""
+    print(f"\n🚀 ШАГ 2: Улучшаем качество (Upscale), бэкенд: {UPSCALE_BACKEND} (async, Replicate {START_CONCURRENT}→{MAX_CONCURRENT} параллельно, адаптивно)...")
+    
+    images = my_images(list(Path(CLEAN_DIR).glob("*.jpg")) + list(Path(CLEAN_DIR).glob("*.png")))
+    total = len(images)
+    
+    if total == 0:
+        print("⚠️  Нет файлов для апскейла.")
+        return
+
+    # Адаптивный лимит количества одновременных запросов
+    limiter = create_limiter()
+    planner = create_planner()
+    cache = upscale_cache.UpscaleCache(CACHE_DIR, CACHE_MAX_GB)
+    client, transport = create_async_client()
+    uploader = payload_upload.PayloadUploader(client, UPLOAD_FORMATS)
+    remote = create_remote(client, limiter, uploader)
+    
+    # Запускаем все задачи параллельно
+    tasks = [
+        upscale_single_image(img_path, limiter, total, i+1, cache, remote, ledger, planner) 
+        for i, img_path in enumerate(images)
+    ]
+    
+    # Ждем завершения всех задач
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        await transport.aclose()
+    
+    success_count = sum(results)
+    print(f"\n✅ Апскейл завершен: {success_count}/{total} успешно (итоговый лимит {limiter.current}, 429: {limiter.throttled})")
+    planner.report()
+    uploader.report()
+
+
+def step_3_prepare_for_wb(ledger):
+    """Подготовка финальных фото для Wildberries (параллельно на всех ядрах)"""
+    print("\n📦 ШАГ 3: Подготовка для Wildberries...")
+    
+    # Берем фото из папки с апскейлом (системные файлы пропускаем)
+    images = my_images(p for p in Path(FINAL_DIR).glob("*.*") if not p.name.startswith('.'))
+
+    if not images:
+        print("⚠️  Нет файлов для подготовки к WB.")
+        return
+
+    # Пересобираем только новые апскейлы или все, если поменялись размер/качество
+    params = wb_params()
+    images, skipped = ledger.split(images, "wb", params, wb_path_for)
+    if skipped:
+        print(f"   ⏭️  Без изменений, пропускаем: {len(skipped)} фото")
+    if not images:
+        return
+
+    for img_path in images:
+        ledger.start(img_path, "wb", params)
+
+    done, errors = wb_prepare.prepare_for_wb_parallel(images, WB_DIR, TARGET_W, TARGET_H, QUALITY, WB_WORKERS, WB_CHUNKSIZE, wb_budget(), wb_extra())
+
+    for img_path, save_path in done:
+        ledger.finish(img_path, "wb", save_path)
+    by_name = {p.name: p for p in images}
+    for name, error in errors:
+        ledger.fail(by_name[name], "wb", error)
+
+
+# ==========================================
+# 🌊 ПОТОКОВЫЙ РЕЖИМ
+# ==========================================
+# Между шагами стоят ограниченные очереди: пока LaMa чистит следующее фото,
+# предыдущее уже летит в Replicate, а готовый апскейл сразу уходит на ресайз под WB.
+# Общее время ≈ время самого медленного шага, а не сумма всех трех.
+
+STOP = None  # Маркер "фото больше не будет" в очередях
+WATCH_TOTAL = "∞"  # "Всего фото" в прогрессе, когда их число заранее неизвестно (наблюдение, аренда)
+
+
+async def cancel_tasks(tasks):
+    """Останавливаем воркеров, которые еще работают (после ошибки в соседнем шаге), и ждем, пока они выйдут"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def inpaint_and_send(engine, img_path, mask, detector, params, clean_queue, ledger):
+    """Одно фото через LaMa и дальше в очередь апскейла (False — ошибка, она уже в журнале)"""
+    await asyncio.to_thread(ledger.start, img_path, "inpaint", params)
+    try:
+        clean_path = await asyncio.to_thread(engine.inpaint_file, img_path, mask, CLEAN_DIR, detector)
+    except Exception as e:
+        print(f"      ❌ Ошибка LaMa с файлом {img_path.name}: {e}")
+        await asyncio.to_thread(ledger.fail, img_path, "inpaint", e)
+        return False
+    await asyncio.to_thread(ledger.finish, img_path, "inpaint", clean_path)
+    await clean_queue.put(clean_path)  # Блокируется, если апскейл не успевает
+    return True
+
+
+async def stream_inpaint_stage(clean_queue, ledger):
+    """Шаг 1 (поток): "теплая" LaMa чистит фото по одному и сразу отдает их дальше"""
+    pipeline_metrics.set_stage("inpaint")
+    # Уже очищенные фото (по журналу) сразу отдаем апскейлу, модель для них не нужна
+    detector = create_detector()
+    params = inpaint_params(detector)
+    images, skipped = await asyncio.to_thread(
+        ledger.split, my_images(inpaint_engine.list_images(INPUT_DIR)), "inpaint", params, clean_path_for
+    )
+    if skipped:
+        print(f"   ⏭️  Уже очищены, сразу в апскейл: {len(skipped)} фото")
+    for img_path in skipped:
+        await clean_queue.put(clean_path_for(img_path))
+    if not images:
+        await clean_queue.put(STOP)
+        return len(skipped)
+
+    try:
+        # Загрузка модели и сам inpaint — тяжелые операции, уводим их из event loop
+        engine = await asyncio.to_thread(inpaint_engine.get_engine, INPAINT_DEVICE, INPAINT_THREADS, ROI_MODE)
+    except ImportError:
+        print("❌ Ошибка: iopaint не установлен! Выполните: pip install iopaint")
+        await clean_queue.put(STOP)
+        return len(skipped)
+
+    print(f"   🧠 LaMa на {engine.device} (потоков torch: {engine.threads}), загрузка {engine.load_seconds:.1f} сек")
+    mask = inpaint_engine.load_mask(MASK_PATH)
+    sent = len(skipped)
+
+    for img_path in images:
+        sent += await inpaint_and_send(engine, img_path, mask, detector, params, clean_queue, ledger)
+
+    if detector is not None:
+        print(f"   🔎 Без вотермарки (мимо LaMa): {engine.clean_count} фото")
+    await clean_queue.put(STOP)
+    return sent
+
+
+async def incoming_inpaint_stage(clean_queue, ledger, incoming, engine=None, leases=None):
+    """
+    Шаг 1 (по одному): фото приходят из потока — новые из watch_folder или взятые в аренду у общей очереди.
+    engine — уже загруженная LaMa (наблюдение); без нее модель грузится на первом фото, которому она нужна
+    """
+    pipeline_metrics.set_stage("inpaint")
+    detector = create_detector()
+    params = inpaint_params(detector)
+    mask = inpaint_engine.load_mask(MASK_PATH)
+    sent = 0
+    try:
+        async for img_path in incoming:
+            print(f"   📥 {'Взяли в работу' if leases else 'Новое фото'}: {img_path.name}")
+            if not await asyncio.to_thread(ledger.pending, img_path, "inpaint", params, clean_path_for(img_path)):
+                # Уже очищено (например, то же фото положили еще раз): апскейл и WB проверят журнал сами
+                await clean_queue.put(clean_path_for(img_path))
+                sent += 1
+                continue
+            if engine is None:
+                try:
+                    engine = await asyncio.to_thread(inpaint_engine.get_engine, INPAINT_DEVICE, INPAINT_THREADS, ROI_MODE)
+                except ImportError:
+                    print("❌ Ошибка: iopaint не установлен! Выполните: pip install iopaint")
+                    await release(leases, img_path, done=False)
+                    break
+                print(f"   🧠 LaMa на {engine.device} (потоков torch: {engine.threads}), загрузка {engine.load_seconds:.1f} сек")
+            if await inpaint_and_send(engine, img_path, mask, detector, params, clean_queue, ledger):
+                sent += 1
+            else:
+                await release(leases, img_path, done=False)
+    finally:
+        await clean_queue.put(STOP)
+    return sent
+
+
+async def stream_upscale_worker(clean_queue, wb_queue, limiter, cache, remote, total, counter, ledger, planner, leases=None):
+    """Шаг 2 (поток): забираем чистые фото и апскейлим по мере поступления"""
+    pipeline_metrics.set_stage("upscale")
+    while True:
+        img_path = await clean_queue.get()
+        if img_path is STOP:
+            # Возвращаем маркер, чтобы остановились и остальные воркеры
+            await clean_queue.put(STOP)
+            return
+
+        if await asyncio.to_thread(ledger.busy, img_path, "upscale"):
+            # Это фото уже апскейлится (watch увидел его еще раз): дальше его проведет первый заход
+            print(f"   ⏳ Уже в работе: {img_path.name}")
+            continue
+
+        counter["upscale"] += 1
+        ok = await upscale_single_image(img_path, limiter, total, counter["upscale"], cache, remote, ledger, planner)
+        master = Path(FINAL_DIR) / f"upscaled_{img_path.name}"
+        if ok and master.exists():
+            await wb_queue.put(master)
+        elif ok:
+            # Мастера нет — JPG для WB уже сделан на шаге апскейла
+            counter["wb"] += 1
+            await release(leases, img_path)
+        else:
+            await release(leases, img_path, done=False)
+
+
+async def stream_wb_worker(wb_queue, pool, total, counter, started, ledger, leases=None):
+    """Шаг 3 (поток): ресайз под WB в пуле процессов, чтобы не блокировать event loop"""
+    loop = asyncio.get_running_loop()
+    params = wb_params()
+    budget = wb_budget()
+    extra = wb_extra()
+    pipeline_metrics.set_stage("wb")
+    while True:
+        img_path = await wb_queue.get()
+        if img_path is STOP:
+            await wb_queue.put(STOP)
+            return
+
+        if await asyncio.to_thread(ledger.busy, img_path, "wb"):
+            print(f"   ⏳ Уже в работе: {wb_path_for(img_path).name}")
+            continue
+
+        # Журнал: JPG для этого апскейла с теми же настройками уже готов
+        if not await asyncio.to_thread(ledger.pending, img_path, "wb", params, wb_path_for(img_path)):
+            counter["wb"] += 1
+            print(f"[{counter['wb']}/{total}] 📦 WB: {wb_path_for(img_path).name} ⏭️  уже готово")
+            await release(leases, img_path)
+            continue
+        await asyncio.to_thread(ledger.start, img_path, "wb", params)
+
+        # prepare_task: ошибка и замеры из процесса пула приходят вместе с результатом
+        save_path, size, error, events = await loop.run_in_executor(
+            pool, wb_prepare.prepare_task, img_path, WB_DIR, TARGET_W, TARGET_H, QUALITY, budget, extra
+        )
+        pipeline_metrics.merge(events)
+        if error:
+            print(f"      ❌ Ошибка WB с файлом {img_path.name}: {error}")
+            await asyncio.to_thread(ledger.fail, img_path, "wb", error)
+            await release(leases, img_path, done=False)
+            continue
+
+        await asyncio.to_thread(ledger.finish, img_path, "wb", save_path)
+        await release(leases, img_path)
+        counter["wb"] += 1
+        size_mb = size / (1024 * 1024)
+        elapsed = time.time() - started
+        if counter["wb"] == 1 and total != WATCH_TOTAL:
+            print(f"      ⚡ Первое фото для WB готово через {elapsed:.1f} сек")
+        print(f"[{counter['wb']}/{total}] 📦 WB: {save_path.name} ✅ OK ({size_mb:.2f} MB)")
+
+
+async def run_streaming_pipeline(ledger, incoming=None, engine=None, leases=None):
+    """
+    Потоковый конвейер: inpaint → upscale → WB для каждого фото независимо.
+    incoming — поток фото вместо всей INPUT_DIR (наблюдение за папкой, аренда у общей очереди), пока он не кончится;
+    engine — уже загруженная LaMa; leases — аренда фото: продлевается, пока фото в работе, и снимается в конце
+    """
+    wb_workers_count = wb_prepare.worker_count(WB_WORKERS)
+    print(f"\n🌊 Потоковый режим: очереди по {QUEUE_SIZE}, апскейл {START_CONCURRENT}→{MAX_CONCURRENT} параллельно (адаптивно), WB {wb_workers_count} параллельно")
+
+    total = WATCH_TOTAL if incoming else len(my_images(inpaint_engine.list_images(INPUT_DIR)))
+    started = time.time()
+
+    clean_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    wb_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    limiter = create_limiter()
+    planner = create_planner()
+    cache = upscale_cache.UpscaleCache(CACHE_DIR, CACHE_MAX_GB)
+    client, transport = create_async_client()
+    uploader = payload_upload.PayloadUploader(client, UPLOAD_FORMATS)
+    remote = create_remote(client, limiter, uploader)
+    counter = {"upscale": 0, "wb": 0}
+
+    # Воркеров столько, сколько позволяет потолок; реально работают столько, сколько разрешит лимит
+    upscale_workers = [
+        asyncio.create_task(stream_upscale_worker(clean_queue, wb_queue, limiter, cache, remote, total, counter, ledger, planner, leases))
+        for _ in range(MAX_CONCURRENT)
+    ]
+    with ProcessPoolExecutor(max_workers=wb_workers_count) as pool:
+        wb_workers = [
+            asyncio.create_task(stream_wb_worker(wb_queue, pool, total, counter, started, ledger, leases))
+            for _ in range(wb_workers_count)
+        ]
+
+        try:
+            try:
+                # Отдельной задачей: метка шага inpaint остается внутри нее
+                if incoming:
+                    await asyncio.create_task(incoming_inpaint_stage(clean_queue, ledger, incoming, engine, leases))
+                else:
+                    await asyncio.create_task(stream_inpaint_stage(clean_queue, ledger))
+                await asyncio.gather(*upscale_workers)
+            finally:
+                # Упал inpaint или один из воркеров — остальные не висят на очереди и не пишут в закрытый клиент
+                await cancel_tasks(upscale_workers)
+                await transport.aclose()
+            await wb_queue.put(STOP)
+            await asyncio.gather(*wb_workers)
+        finally:
+            await cancel_tasks(wb_workers)
+
+    print(f"\n✅ Конвейер завершен: {counter['wb']}/{counter['upscale'] if incoming else total} готово для WB за {time.time() - started:.1f} сек (итоговый лимит апскейла {limiter.current}, 429: {limiter.throttled})")
+    planner.report()
+    uploader.report()
+
+
+async def main_async():
+    print("=== 🚀 ЗАПУСК АВТОМАТИЧЕСКОЙ ОБРАБОТКИ ФОТО (ASYNC) ===")
+    setup_environment()
+    if LEASE_PATH and not STREAMING:
+        raise PipelineError('Аренда фото (LEASE_PATH) работает только в потоковом режиме; шагами делите фото через SHARD = "i/n"')
+    # Замеры запуска: metrics/full_{время}.json и трасса для Perfetto (+ профили шагов)
+    pipeline_metrics.start_run("full", METRICS_ENABLED, PROFILE_ENABLED)
+    
+    # 1. Создаем маску
+    with pipeline_metrics.stage("mask"):
+        generate_mask()
+
+    # Журнал задач: после падения продолжаем с того же места
+    ledger = job_ledger.JobLedger(LEDGER_PATH)
+    try:
+        if STREAMING:
+            # 2-4. Чистим, апскейлим и готовим для WB потоком, фото за фото
+            with pipeline_metrics.stage("pipeline"):
+                async with leased() as leases:
+                    incoming = None
+                    if leases:
+                        # Каждая машина идет по списку со своего места и берет фото по одному, пока они есть
+                        images = work_leases.rotated(my_images(inpaint_engine.list_images(INPUT_DIR)), leases.node)
+                        incoming = work_leases.claimed(work_leases.listed(images), leases, wait=True)
+                    await run_streaming_pipeline(ledger, incoming, leases=leases)
+        else:
+            # 2. Чистим вотермарки
+            with pipeline_metrics.stage("inpaint"):
+                step_1_remove_watermarks(ledger)
+            
+            # 3. Апскейлим (ASYNC!)
+            with pipeline_metrics.stage("upscale"):
+                await step_2_upscale_async(ledger)
+
+            # 4. Готовим для WB
+            with pipeline_metrics.stage("wb"):
+                step_3_prepare_for_wb(ledger)
+    finally:
+        ledger.close()
+        pipeline_metrics.finish(METRICS_DIR)
+    
+    print("\n🎉 ГОТОВО! Все фото обработаны.")
+    print(f"📂 Результат здесь: {os.path.abspath(WB_DIR)}")
+
+
+async def watch_async():
+    """
+    Демон: один раз грузим LaMa (и локальный апскейл), маску и пул соединений к Replicate,
+    потом каждое новое фото в INPUT_DIR сразу идет через потоковый конвейер.
+    Ctrl+C / SIGTERM: новые фото больше не берем, доделываем те, что в работе (второй Ctrl+C — сразу).
+    """
+    from . import watch_folder  # inotify / опрос нужны только этому режиму
+
+    print("=== 👀 НАБЛЮДЕНИЕ ЗА ПАПКОЙ ===")
+    setup_environment(allow_empty=True)
+    pipeline_metrics.start_run("watch", METRICS_ENABLED, PROFILE_ENABLED)
+
+    with pipeline_metrics.stage("mask"):
+        generate_mask()
+
+    # Модели грузим до первого фото: новое фото не ждет загрузки
+    started = time.perf_counter()
+    try:
+        engine = await asyncio.to_thread(inpaint_engine.get_engine, INPAINT_DEVICE, INPAINT_THREADS, ROI_MODE)
+        if UPSCALE_BACKEND == "local":
+            await asyncio.to_thread(local_upscaler)
+    except ImportError as e:
+        pipeline_metrics.finish(METRICS_DIR)
+        raise PipelineError(f"Не установлен {e.name}! Выполните: pip install iopaint") from e
+    print(f"🧠 LaMa на {engine.device} (потоков torch: {engine.threads}), модели готовы за {time.perf_counter() - started:.1f} сек")
+
+    watcher = watch_folder.FolderWatcher(
+        INPUT_DIR, WATCH_BACKEND, WATCH_SETTLE_SECONDS, WATCH_POLL_INTERVAL, inpaint_engine.IMAGE_EXTENSIONS
+    )
+    loop = asyncio.get_running_loop()
+    signals = (signal.SIGINT, signal.SIGTERM)
+
+    def stop():
+        print("\n⏹️  Останавливаемся: новые фото не берем, доделываем начатые (Ctrl+C еще раз — прервать сразу)")
+        watcher.stop()
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C просто прерывает процесс
+
+    ledger = job_ledger.JobLedger(LEDGER_PATH)
+    try:
+        with pipeline_metrics.stage("pipeline"):
+            print(f"👀 Ждем фото в {os.path.abspath(INPUT_DIR)} → {os.path.abspath(WB_DIR)} (Ctrl+C — остановить)")
+            async with leased() as leases:
+                incoming = my_incoming(watcher.images())
+                if leases:
+                    incoming = work_leases.claimed(incoming, leases)
+                await run_streaming_pipeline(ledger, incoming, engine, leases)
+    finally:
+        for sig in signals:
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+        ledger.close()
+        pipeline_metrics.finish(METRICS_DIR)
+
+
+# ==========================================
+# 🌐 HTTP СЕРВИС
+# ==========================================
+# Одно фото за запрос, целиком в памяти: без папок, журнала и кэша на диске.
+# Очередь, лимит одновременных фото и 503 — в http_service.py, здесь — сама обработка.
+
+
+def decode_upload(data, name):
+    """Байты из запроса → картинка с прочитанными пикселями; не картинка / битый файл — ValueError"""
+    try:
+        with pipeline_metrics.span("decode", name, bytes_in=len(data)):
+            image = Image.open(io.BytesIO(data))
+            image.load()
+    except Image.UnidentifiedImageError as e:
+        raise ValueError("Не картинка: нужен PNG, JPEG или WebP") from e
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Фото битое: {e}") from e
+    pipeline_metrics.add("bytes_in", len(data))
+    return image
+
+
+class ImageProcessor:
+    """
+    Теплые ресурсы сервиса на весь процесс: LaMa, детектор и маска, клиент Replicate с пулом соединений
+    и адаптивный лимит. process() — одно фото: inpaint → апскейл (если нужен под размер) → JPG для WB.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.detector = None
+        self.mask = None
+        self.remote = None
+        self.transport = None
+        self.limiter = create_limiter()
+        self.planner = create_planner()  # Только для статистики маршрутов
+        self.lama = asyncio.Lock()       # Модель одна: фото через LaMa идут по очереди
+
+    def load(self):
+        """Все модели грузим до первого запроса (нет iopaint / токена — PipelineError)"""
+        check_token()
+        self.mask = draw_mask()
+        self.detector = create_detector()
+        started = time.perf_counter()
+        try:
+            self.engine = inpaint_engine.get_engine(INPAINT_DEVICE, INPAINT_THREADS, ROI_MODE)
+            if UPSCALE_BACKEND == "local":
+                local_upscaler()
+        except ImportError as e:
+            raise PipelineError(f"Не установлен {e.name}! Выполните: pip install iopaint") from e
+        print(f"🧠 LaMa на {self.engine.device} (потоков torch: {self.engine.threads}), модели готовы за {time.perf_counter() - started:.1f} сек")
+
+    async def open(self):
+        """Клиент Replicate с общим пулом соединений — в event loop сервера, на все время его работы"""
+        if UPSCALE_BACKEND != "local":
+            client, self.transport = create_async_client()
+            self.remote = create_remote(client, self.limiter, None)
+
+    async def close(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+
+    def status(self):
+        """Для /health: что загружено и как себя чувствует лимит Replicate"""
+        return {
+            "lama": self.engine.device if self.engine else None,
+            "detector": len(self.detector.profiles) if self.detector else 0,
+            "upscale_backend": UPSCALE_BACKEND,
+            "replicate_limit": self.limiter.current,
+            "replicate_in_flight": self.limiter.in_flight,
+            "throttled": self.limiter.throttled,
+            "routes": dict(self.planner.counts),
+        }
+
+    def remove_watermark(self, image, name):
+        """(картинка, была ли вотермарка); фото без вотермарки возвращается как есть, с прозрачностью"""
+        rgb = wb_prepare.flatten_to_rgb(image)  # Прозрачное — белым, как для WB (convert сделал бы черным)
+        mask = self.mask
+        if self.detector is not None:
+            with pipeline_metrics.span("detect", name):
+                mask = self.detector.mask_for(rgb)
+        if mask is None:
+            pipeline_metrics.add("clean")
+            return image, False
+        with pipeline_metrics.span("lama", name):
+            result = self.engine.inpaint(rgb, mask)
+        result.info["icc_profile"] = image.info.get("icc_profile")
+        return result, True
+
+    async def upscale_remote(self, image, name):
+        """Replicate из памяти: одна повторная попытка на обрыв / 429, дальше — PipelineError"""
+        with pipeline_metrics.span("encode_payload", name):
+            payload = await asyncio.to_thread(payload_upload.encode_image, image, Path(name).stem, UPLOAD_FORMATS)
+        max_retries = 2
+        for attempt in range(max_retries):
+            try:
+                data = await self.remote.aupscale_payload(payload, name)
+                break
+            except Exception as e:
+                is_retryable, throttled = classify_error(str(e))
+                if attempt < max_retries - 1 and (is_retryable or throttled):
+                    await pipeline_metrics.asleep(10 if throttled else 5, "throttle_sleep" if throttled else "retry_sleep", name)
+                    continue
+                raise PipelineError(f"Ошибка Replicate: {e}") from e
+        return await asyncio.to_thread(decode_upload, data, name)
+
+    async def process(self, data, name, target=None, quality=None, upscale=True, max_kb=None):
+        """
+        Фото (байты) → (байты JPG для WB, маршрут апскейла, была ли вотермарка).
+        max_kb — бюджет JPG этого запроса вместо WB_MAX_KB.
+        Битое фото — ValueError, ошибка Replicate — PipelineError.
+        """
+        target_w, target_h = target or (TARGET_W, TARGET_H)
+        started = time.perf_counter()
+        image = await asyncio.to_thread(decode_upload, data, name)
+
+        async with self.lama:
+            image, watermark = await asyncio.to_thread(self.remove_watermark, image, name)
+
+        planner = upscale_planner.UpscalePlanner(target_w, target_h, UPSCALE_MIN_FACTOR, UPSCALE_BACKEND, LOCAL_MAX_FACTOR)
+        route, _ = planner.route_for_size(*image.size)
+        if not upscale:
+            route = upscale_planner.ROUTE_RESAMPLE
+        if route == upscale_planner.ROUTE_LOCAL:
+            upscaler = await asyncio.to_thread(local_upscaler)
+            with pipeline_metrics.span("local_model", name):
+                image = await asyncio.to_thread(upscaler.upscale_image, image)
+        elif route == upscale_planner.ROUTE_REMOTE:
+            image = await self.upscale_remote(image, name)
+
+        budget = jpeg_budget.JpegBudget(max_kb, WB_MIN_SSIM, WB_MIN_QUALITY) if max_kb else wb_budget()
+        jpeg = await asyncio.to_thread(wb_prepare.encode_wb, image, target_w, target_h, quality or QUALITY, name, budget)
+        self.planner.record(route, time.perf_counter() - started)
+        return jpeg, route, watermark
+
+
+# ==========================================
+# 📚 ВЫЗОВ ИЗ СВОЕГО КОДА
+# ==========================================
+# Без отдельных процессов: from photo_pipeline import pipeline; pipeline.run(input_dir="...")
+# Настройки — через configure (глобальные на процесс: два разных запуска одновременно в одном процессе не делать)
+
+
+def run(**settings):
+    """Весь пайплайн: маска → inpaint → upscale → WB (потоком или шаг за шагом)"""
+    configure(**settings)
+    asyncio.run(main_async())
+
+
+async def run_async(**settings):
+    """То же внутри уже работающего event loop"""
+    configure(**settings)
+    await main_async()
+
+
+def watch(**settings):
+    """Демон: следим за INPUT_DIR и обрабатываем новые фото, пока не остановят (Ctrl+C / SIGTERM)"""
+    configure(**settings)
+    asyncio.run(watch_async())
+
+
+def serve(**settings):
+    """HTTP сервис: POST фото → JPG для WB, модели загружены один раз (до Ctrl+C / SIGTERM)"""
+    configure(**settings)
+    from . import http_service  # FastAPI и uvicorn нужны только этому режиму
+
+    http_service.serve(
+        ImageProcessor(), SERVICE_HOST, SERVICE_PORT, SERVICE_MAX_JOBS, SERVICE_MAX_QUEUE, SERVICE_MAX_UPLOAD_MB,
+        METRICS_ENABLED, PROFILE_ENABLED, METRICS_DIR,
+    )
+
+
+def run_step(name, step, source_dir, need_token):
+    """Один шаг (для CLI inpaint / upscale) со своим журналом и замерами; step(ledger) может быть async"""
+    setup_environment(source_dir, need_token)
+    pipeline_metrics.start_run(name, METRICS_ENABLED, PROFILE_ENABLED)
+    ledger = job_ledger.JobLedger(LEDGER_PATH)
+    try:
+        with pipeline_metrics.stage(name):
+            result = step(ledger)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+    finally:
+        ledger.close()
+        pipeline_metrics.finish(METRICS_DIR)
+
+
+def mask_and_inpaint(ledger):
+    # Маска — по текущим настройкам (фото без шаблона вотермарки чистятся по ней)
+    generate_mask()
+    step_1_remove_watermarks(ledger)
+
+
+def run_inpaint(**settings):
+    """Только удаление вотермарок: INPUT_DIR → CLEAN_DIR"""
+    configure(**settings)
+    run_step("inpaint", mask_and_inpaint, INPUT_DIR, need_token=False)
+
+
+def run_upscale(**settings):
+    """Только апскейл: CLEAN_DIR → FINAL_DIR"""
+    configure(**settings)
+    run_step("upscale", step_2_upscale_async, CLEAN_DIR, need_token=True)
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from . import stage_profiler
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+METRICS_ENABLED = True         # Писать замеры каждого запуска (False = никаких файлов и накладных расходов)
+METRICS_DIR = "metrics"        # Куда класть {скрипт}_{время}.json (сводка) и .trace.json (Chrome / Perfetto)
+MAX_EVENTS = 200_000           # Отрезков в памяти (демон и сервис живут долго: старые вытесняются, счетчики — нет)
+
+# ==========================================
+
+_RUN = None  # Замеры текущего запуска (None — замеры выключены)
+_STAGE = contextvars.ContextVar("stage", default="")  # Шаг, к которому относятся замеры (наследуется в задачи и потоки)
+
+
+def now_us():
+    """Время в микросекундах от эпохи: одинаковая шкала в главном процессе и в процессах пула"""
+    return time.time_ns() // 1000
+
+
+class RunMetrics:
+    """
+    Замеры одного запуска:
+    1. Отрезки (span): что, для какого фото, в каком шаге, сколько длилось (+ байты и прочее в args).
+    2. Счетчики: байты туда/обратно, повторы, 429 — по шагам.
+    3. С profile — CPU и память каждого шага (stage_profiler), по шагам.
+    Потокобезопасно: пишут и потоки, и задачи asyncio.
+    Хранится не больше max_events последних отрезков (dropped — сколько вытеснено).
+    """
+
+    def __init__(self, name, profile=False, max_events=MAX_EVENTS):
+        self.name = name
+        self.profile = profile
+        self.started = now_us()
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=max_events)
+        self.dropped = 0
+        self.counters = {}
+        self.profiles = {}  # шаг → [профиль этого процесса, профили процессов пула, ...]
+
+    def record(self, event):
+        with self.lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+
+    def add(self, stage, counter, value):
+        with self.lock:
+            key = f"{stage or 'run'}.{counter}"
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_profile(self, stage, profile):
+        with self.lock:
+            self.profiles.setdefault(stage or "run", []).append(profile)
+
+
+def start_run(name, enabled=METRICS_ENABLED, profile=stage_profiler.PROFILE_ENABLED):
+    """
+    Начало замеров запуска (в main скрипта).
+    profile — еще и профиль каждого шага (или PIPELINE_PROFILE=1 в окружении).
+    """
+    global _RUN
+    profile = profile or stage_profiler.requested()
+    stage_profiler.enable_children(profile)
+    _RUN = RunMetrics(name, profile) if enabled or profile else None
+    return _RUN
+
+
+@contextmanager
+def stage(name):
+    """Все замеры внутри относятся к шагу name; сам шаг тоже пишется отрезком (и профилируется, если включено)"""
+    token = _STAGE.set(name)
+    profiler = stage_profiler.start() if _RUN is not None and _RUN.profile else None
+    try:
+        with span(name, lane="шаги"):
+            yield
+    finally:
+        if profiler is not None:
+            _RUN.add_profile(name, profiler.stop())
+        _STAGE.reset(token)
+
+
+def set_stage(name):
+    """
+    Метка шага без отрезка — для задач asyncio потокового режима (шаги идут одновременно).
+    У каждой задачи своя копия контекста, так что метка живет до конца задачи и не влияет на остальные.
+    """
+    _STAGE.set(name)
+
+
+@contextmanager
+def span(name, image=None, lane=None, **args):
+    """
+    Отрезок времени: with span("decode", img_path): ...
+    image — фото (в трассе у каждого фото своя строка), args — любые числа (байты, попытка).
+    Внутри можно дописать args: with span(...) as extra: extra["bytes"] = n
+    """
+    if _RUN is None:
+        yield args
+        return
+    memory = stage_profiler.span_start() if _RUN.profile and lane != "шаги" else None
+    started = now_us()
+    try:
+        yield args
+    finally:
+        if memory is not None:
+            args.update(stage_profiler.span_end(memory))
+        _RUN.record({
+            "name": name, "stage": _STAGE.get(), "ts": started, "dur": now_us() - started,
+            "lane": lane or (Path(image).name if image else threading.current_thread().name),
+            "args": args,
+        })
+
+
+def add(counter, value=1):
+    """Счетчик текущего шага: add("bytes_out", n), add("retries")"""
+    if _RUN is not None:
+        _RUN.add(_STAGE.get(), counter, value)
+
+
+def sleep(seconds, name, image=None):
+    """Пауза (повтор, 429, защита от лимитов) — тоже отрезок: видно, сколько запуск просто ждал"""
+    add(name)
+    with span(name, image, seconds=seconds):
+        time.sleep(seconds)
+
+
+async def asleep(seconds, name, image=None):
+    """То же для asyncio"""
+    import asyncio
+
+    add(name)
+    with span(name, image, seconds=seconds):
+        await asyncio.sleep(seconds)
+
+
+@contextmanager
+def capture():
+    """
+    Замеры в процессе пула: собираются в список и возвращаются в главный процесс вместе с результатом
+    (with capture() as events: ...; return result, events), там их добавляет merge().
+    """
+    global _RUN
+    previous, _RUN = _RUN, RunMetrics("capture", stage_profiler.requested())
+    # Профиль процесса пула (в главном процессе шаг уже профилируется сам)
+    profiler = stage_profiler.start() if _RUN.profile else None
+    events = []
+    try:
+        yield events
+    finally:
+        events.extend(_RUN.events)
+        events.extend({"counter": key, "value": value} for key, value in _RUN.counters.items())
+        if profiler is not None:
+            events.append({"profile": profiler.stop()})
+        _RUN = previous
+
+
+def merge(events):
+    """Замеры из процесса пула → в текущий запуск (шаг берется текущий)"""
+    if _RUN is None or not events:
+        return
+    current = _STAGE.get()
+    for event in events:
+        if "counter" in event:
+            _RUN.add(current, event["counter"].split(".", 1)[1], event["value"])
+        elif "profile" in event:
+            _RUN.add_profile(current, event["profile"])
+        else:
+            _RUN.record({**event, "stage": event["stage"] or current})
+
+
+def percentile(values, q):
+    """Перцентиль с линейной интерполяцией (как numpy.percentile; без numpy — быстрее старт скриптов)"""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summary(run):
+    """Сводка: время по шагам, по видам отрезков (сумма / p50 / p95 / max) и счетчики"""
+    stages, spans = {}, {}
+    for event in run.events:
+        if event["lane"] == "шаги":
+            stages[event["name"]] = round(stages.get(event["name"], 0) + event["dur"] / 1e6, 3)
+            continue
+        spans.setdefault(f"{event['stage'] or 'run'}.{event['name']}", []).append(event["dur"] / 1000)
+
+    table = {}
+    for key, durations in sorted(spans.items(), key=lambda item: -sum(item[1])):
+        table[key] = {
+            "count": len(durations),
+            "total_s": round(sum(durations) / 1000, 3),
+            "p50_ms": round(percentile(durations, 50), 1),
+            "p95_ms": round(percentile(durations, 95), 1),
+            "max_ms": round(max(durations), 1),
+        }
+    return {
+        "run": run.name,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run.started / 1e6)),
+        "seconds": round((now_us() - run.started) / 1e6, 3),
+        "stages": stages,
+        "spans": table,
+        "counters": dict(sorted(run.counters.items())),
+        "dropped_spans": run.dropped,  # Таблица отрезков — только по последним MAX_EVENTS
+    }
+
+
+def chrome_trace(run):
+    """Трасса в формате Chrome Trace Event (открывается в ui.perfetto.dev и chrome://tracing)"""
+    lanes = {"шаги": 0}
+    for event in run.events:
+        lanes.setdefault(event["lane"], len(lanes))
+
+    pid = os.getpid()
+    trace = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": run.name}}]
+    trace += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}} for lane, tid in lanes.items()]
+    trace += [{"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": tid, "args": {"sort_index": tid}} for tid in lanes.values()]
+    for event in sorted(run.events, key=lambda e: e["ts"]):
+        trace.append({
+            "name": event["name"], "cat": event["stage"] or "run", "ph": "X",
+            "ts": event["ts"] - run.started, "dur": max(event["dur"], 1),
+            "pid": pid, "tid": lanes[event["lane"]], "args": event["args"],
+        })
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def finish(out_dir=METRICS_DIR):
+    """Пишет сводку и трассу запуска, печатает самые долгие отрезки. Возвращает путь к сводке"""
+    global _RUN
+    run, _RUN = _RUN, None
+    if run is None:
+        return None
+
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(run.started / 1e6))
+    summary_path = Path(out_dir) / f"{run.name}_{stamp}.json"
+    trace_path = Path(out_dir) / f"{run.name}_{stamp}.trace.json"
+    data = summary(run)
+    summary_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    trace_path.write_text(json.dumps(chrome_trace(run), ensure_ascii=False), encoding="utf-8")
+
+    print(f"\n📈 Замеры: {summary_path} (трасса: {trace_path} → ui.perfetto.dev)")
+    for key, row in list(data["spans"].items())[:5]:
+        print(f"   {key}: {row['total_s']} сек всего, {row['count']} раз, p50 {row['p50_ms']} / p95 {row['p95_ms']} мс")
+    if run.profiles:
+        write_profiles(run, Path(out_dir) / f"{run.name}_{stamp}")
+    return summary_path
+
+
+def write_profiles(run, prefix):
+    """Профиль каждого шага: {префикс}.{шаг}.profile.txt (таблицы) и .stacks.txt (для speedscope.app)"""
+    spans = {}
+    for event in run.events:
+        if "alloc_peak_kb" in event["args"]:
+            spans.setdefault(event["stage"] or "run", {}).setdefault(event["name"], []).append(event["args"])
+
+    print("🔬 Профили шагов:")
+    for stage_name, profiles in run.profiles.items():
+        profile = stage_profiler.merge(profiles)
+        report_path = Path(f"{prefix}.{stage_name}.profile.txt")
+        report_path.write_text(stage_profiler.report(stage_name, profile, spans.get(stage_name, {})), encoding="utf-8")
+        Path(f"{prefix}.{stage_name}.stacks.txt").write_text(stage_profiler.collapsed(profile), encoding="utf-8")
+        own, _ = stage_profiler.hot_functions(profile["stacks"])
+        hottest = ", ".join(name for name, _ in own.most_common(3))
+        print(f"   {report_path} (горячее всего: {hottest or 'нет выборок'})")
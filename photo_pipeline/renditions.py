@@ -0,0 +1,188 @@
+import io
+from collections import namedtuple
+from pathlib import Path
+from PIL import Image
+from . import pipeline_metrics
+from .jpeg_budget import JpegBudget
+from .wb_prepare import REDUCING_GAP, crop_box, draft_size, flatten_to_rgb, open_source, resize_and_crop
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+RENDITIONS_DIR = "renditions"  # Куда кладем размеры: renditions/{имя}/{фото}.{формат}
+DEFAULT_MODE = "crop"          # crop — кроп по центру точно в размер, fit — вписать целиком, pad — вписать и дополнить белым
+DEFAULT_FORMAT = "jpg"         # jpg / webp / png
+DEFAULT_QUALITY = 90
+PYRAMID_GAP = REDUCING_GAP     # LANCZOS идет с самого маленького уровня пирамиды, который еще во столько раз больше цели
+
+# ==========================================
+
+MODES = ("crop", "fit", "pad")
+FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+PAD_COLOR = (255, 255, 255)
+
+# Один размер: куда (folder), какой (width x height, mode), как сжимать (fmt, quality, budget — JpegBudget или None)
+Rendition = namedtuple("Rendition", "name width height mode fmt quality budget folder")
+
+
+def parse_rendition(text, root=RENDITIONS_DIR):
+    """
+    "thumb:300x400:fit:webp:80" → Rendition (файлы — в root/thumb/). После имени и размера в любом порядке:
+    crop / fit / pad, jpg / webp / png, качество 1–100, бюджет JPG "150kb". Ошибка — ValueError
+    """
+    parts = [part.strip() for part in text.split(":")]
+    if len(parts) < 2 or not parts[0] or parts[0].startswith(".") or "/" in parts[0] or "\\" in parts[0]:
+        raise ValueError(f"размер в виде имя:ШИРИНАxВЫСОТА[:опции], а не '{text}'")
+    name = parts[0]
+    try:
+        width, height = (int(value) for value in parts[1].lower().split("x"))
+    except ValueError:
+        raise ValueError(f"{name}: размер в виде ШИРИНАxВЫСОТА, а не '{parts[1]}'")
+    if width < 1 or height < 1:
+        raise ValueError(f"{name}: размер должен быть больше нуля")
+
+    mode, fmt, quality, budget = DEFAULT_MODE, DEFAULT_FORMAT, DEFAULT_QUALITY, None
+    for option in (part.lower() for part in parts[2:]):
+        if option in MODES:
+            mode = option
+        elif option in FORMATS:
+            fmt = "jpg" if option == "jpeg" else option
+        elif option.endswith("kb"):
+            try:
+                budget = JpegBudget(float(option[:-2]))
+            except ValueError:
+                raise ValueError(f"{name}: бюджет в виде 150kb, а не '{option}'")
+        elif option.isdigit() and 1 <= int(option) <= 100:
+            quality = int(option)
+        else:
+            raise ValueError(f"{name}: непонятная опция '{option}' (crop / fit / pad, jpg / webp / png, 1–100, 150kb)")
+    if budget and fmt != "jpg":
+        raise ValueError(f"{name}: бюджет в KB — только для jpg")
+    return Rendition(name, width, height, mode, fmt, quality, budget, str(Path(root) / name))
+
+
+def path_for(rendition, img_path):
+    """Файл рендишна для фото"""
+    return Path(rendition.folder) / f"{Path(img_path).stem}.{rendition.fmt}"
+
+
+class Pyramid:
+    """
+    Уровни одного кадра: 0 — декодированное фото, каждый следующий вдвое меньше (reduce(2): среднее 2x2, дешево).
+    Уровни строятся лениво и один раз на все рендишны — только до того, что нужен самому маленькому.
+    """
+
+    def __init__(self, img):
+        self.levels = [img]
+
+    def level(self, index):
+        while len(self.levels) <= index:
+            self.levels.append(self.levels[-1].reduce(2))
+        return self.levels[index]
+
+    def source_for(self, box, size):
+        """Самый маленький уровень, где область box еще в PYRAMID_GAP раз больше size: (картинка, box на этом уровне)"""
+        base = self.levels[0]
+        left, top, right, bottom = box
+        index = 0
+        while min((right - left) / size[0], (bottom - top) / size[1]) / 2 ** (index + 1) >= PYRAMID_GAP:
+            index += 1
+        level = self.level(index)
+        scale_x, scale_y = level.width / base.width, level.height / base.height
+        return level, (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+
+
+def render(pyramid, rendition):
+    """Кадр рендишна: один LANCZOS с ближайшего большего уровня пирамиды (кроп — сразу в том же проходе)"""
+    base = pyramid.levels[0]
+    width, height = rendition.width, rendition.height
+    if rendition.mode == "crop":
+        box, size = crop_box(base.width, base.height, width, height), (width, height)
+    else:
+        scale = min(width / base.width, height / base.height)
+        box = (0, 0, base.width, base.height)
+        size = (min(width, max(1, round(base.width * scale))), min(height, max(1, round(base.height * scale))))
+
+    level, box = pyramid.source_for(box, size)
+    frame = level.resize(size, Image.Resampling.LANCZOS, box=box)
+    if rendition.mode == "pad" and size != (width, height):
+        canvas = Image.new("RGB", (width, height), PAD_COLOR)
+        canvas.paste(frame, ((width - size[0]) // 2, (height - size[1]) // 2))
+        frame = canvas
+    return frame
+
+
+def encode(frame, rendition, img_path=None):
+    """Кадр → байты файла рендишна (JPG — через JpegBudget: бюджет, если задан, и optimize; PNG — без optimize)"""
+    if rendition.fmt == "jpg":
+        data, _ = (rendition.budget or JpegBudget()).encode(frame, rendition.quality, img_path)
+        return data
+    buffer = io.BytesIO()
+    with pipeline_metrics.span(f"{rendition.fmt}_save", img_path) as extra:
+        if rendition.fmt == "webp":
+            frame.save(buffer, "WEBP", quality=rendition.quality, method=4)
+        else:
+            frame.save(buffer, "PNG")  # zlib 6: optimize дает -10–20% размера, но в 5–15 раз дольше
+        extra["bytes_out"] = buffer.tell()
+    return buffer.getvalue()
+
+
+def write(frame, rendition, img_path):
+    """Кадр → файл рендишна: (путь, байт)"""
+    output = encode(frame, rendition, img_path)
+    save_path = path_for(rendition, img_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    save_path.write_bytes(output)
+    return save_path, len(output)
+
+
+def decode_rgb(img_path, data, draft, size_in):
+    """Одно декодирование (JPEG — сразу уменьшенным до draft) → RGB без прозрачности"""
+    with Image.open(open_source(img_path, data)[0]) as img:
+        with pipeline_metrics.span("decode", img_path, bytes_in=size_in):
+            if draft:
+                img.draft("RGB", draft)
+            img.load()
+        with pipeline_metrics.span("flatten", img_path):
+            return flatten_to_rgb(img)
+
+
+def render_file(img_path, renditions, data=None, wb=None):
+    """
+    Все рендишны одного фото из одного декодирования:
+    1. JPEG декодируется сразу уменьшенным под самый большой рендишн (draft), прозрачность заливается один раз.
+    2. Пирамида уровней x1/2, x1/4, ... — общая для всех рендишнов.
+    3. Каждый рендишн — один LANCZOS с ближайшего большего уровня и одна запись на диск.
+    wb — JPG для WB (Rendition): он идет тем же путем, что и без рендишнов (draft под WB, resize_and_crop),
+    и байт в байт не зависит от списка. Если рендишнам нужен JPEG крупнее, чем WB, у WB свое, уменьшенное
+    (дешевое) декодирование. data — байты или файловый объект с фото (файла img_path тогда нет, берется только имя).
+    Возвращает пути: WB (если есть), затем renditions по порядку.
+    """
+    img_path = Path(img_path)
+    source, size_in = open_source(img_path, data)
+    width, height = max(r.width for r in renditions), max(r.height for r in renditions)
+    with Image.open(source) as img:
+        wb_draft = draft_size(img, wb.width, wb.height) if wb else None
+        draft = draft_size(img, max(width, wb.width), max(height, wb.height)) if wb else draft_size(img, width, height)
+    rgb = decode_rgb(img_path, data, draft, size_in)
+    pyramid = Pyramid(rgb)
+
+    saved = []
+    if wb:
+        wb_rgb = rgb if wb_draft == draft else decode_rgb(img_path, data, wb_draft, size_in)
+        with pipeline_metrics.span("resize", img_path, width=wb.width, height=wb.height):
+            frame = resize_and_crop(wb_rgb, wb.width, wb.height)
+        del wb_rgb
+        saved.append(write(frame, wb, img_path))
+
+    for rendition in renditions:
+        with pipeline_metrics.span("resize", img_path, width=rendition.width, height=rendition.height):
+            frame = render(pyramid, rendition)
+        saved.append(write(frame, rendition, img_path))
+
+    pipeline_metrics.add("bytes_in", size_in)
+    pipeline_metrics.add("bytes_out", sum(size for _, size in saved))
+    pipeline_metrics.add("renditions", len(saved))
+    pipeline_metrics.add("pyramid_levels", len(pyramid.levels) - 1)
+    return [save_path for save_path, _ in saved]
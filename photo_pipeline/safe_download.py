@@ -0,0 +1,133 @@
+import os
+import asyncio
+import tempfile
+from pathlib import Path
+from PIL import Image
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+DOWNLOAD_FSYNC = True          # Сбрасывать файл на диск перед переименованием (переживает kill -9 и сбой питания)
+SPOOL_MAX_BYTES = 1024 * 1024  # Результат для ресайза на лету: до стольких байт — в памяти, больше — во временном файле
+
+# ==========================================
+
+
+def partial_path(output_path):
+    """Временное имя рядом с результатом (скрытое, в ту же папку — чтобы rename был атомарным)"""
+    output_path = Path(output_path)
+    return output_path.with_name(f".{output_path.name}.part")
+
+
+def check_image(path):
+    """
+    Дешевая проверка целостности (без декодирования пикселей):
+    заголовок читается PIL, а для PNG / JPEG / WebP еще проверяется конец файла —
+    оборванная загрузка его не содержит.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        head = f.read(12)
+        f.seek(max(0, size - 16))
+        tail = f.read()
+
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        complete = b"IEND" in tail
+    elif head.startswith(b"\xff\xd8"):
+        complete = tail.rstrip(b"\x00").endswith(b"\xff\xd9")
+    elif head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        complete = int.from_bytes(head[4:8], "little") + 8 == size
+    else:
+        complete = True
+
+    if not complete:
+        raise ValueError(f"Файл оборван: {path.name} ({size} байт)")
+    with Image.open(path):
+        pass  # PIL разбирает заголовок при открытии и падает, если он битый
+
+
+def fsync_dir(folder):
+    """fsync папки, чтобы сам rename тоже оказался на диске (на Windows не нужен и не работает)"""
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit(tmp_path, output_path, fsync=DOWNLOAD_FSYNC):
+    """Проверка + атомарная подмена: под итоговым именем либо старый файл, либо новый целиком"""
+    try:
+        check_image(tmp_path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, output_path)
+    if fsync:
+        fsync_dir(Path(output_path).parent)
+
+
+def save_stream(chunks, output_path, fsync=DOWNLOAD_FSYNC):
+    """
+    Скачивание по кускам во временный файл, затем fsync и rename.
+    В памяти только текущий кусок, а не весь 4K результат.
+    """
+    tmp_path = partial_path(output_path)
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    commit(tmp_path, output_path, fsync)
+    return output_path
+
+
+async def asave_stream(chunks, output_path, fsync=DOWNLOAD_FSYNC):
+    """То же для async итератора кусков; fsync и проверка идут в отдельном потоке"""
+    tmp_path = partial_path(output_path)
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            if fsync:
+                await asyncio.to_thread(os.fsync, f.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    await asyncio.to_thread(commit, tmp_path, output_path, fsync)
+    return output_path
+
+
+async def aspool_stream(chunks, max_size=SPOOL_MAX_BYTES):
+    """
+    Поток → SpooledTemporaryFile (для режима без 4K мастера: сразу в ресайз под WB).
+    В памяти — не больше max_size, остальное во временном файле без имени (удаляется при close),
+    так что одновременные скачивания не держат в памяти каждое свой 4K целиком. Возвращается с позиции 0.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size)
+    try:
+        async for chunk in chunks:
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+async def aread_stream(chunks):
+    """Весь поток в память (HTTP сервис: результат и так нужен в памяти)"""
+    data = bytearray()
+    async for chunk in chunks:
+        data += chunk
+    return data
@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from statistics import median
+from pathlib import Path
+from PIL import Image
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+PROFILE_ENABLED = False        # Профилировать каждый шаг (CPU + память); медленнее, только для разбора
+PROFILE_ENV = "PIPELINE_PROFILE"  # PIPELINE_PROFILE=1 python любой_скрипт.py — то же без правки настроек
+PROFILE_INTERVAL = 0.005       # Как часто снимаем стеки всех потоков (сек)
+PROFILE_TOP = 25               # Строк в таблицах горячих функций и мест выделения памяти
+ALLOC_FRAMES = 1               # Глубина стека tracemalloc (1 = только строка, где выделили)
+# Потоки, стоящие в этих файлах, ждут (очередь, select, сеть, пауза) — в CPU профиль не попадают
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py", "connection.py", "synchronize.py",
+              "ssl.py", "socket.py", "sync.py", "pipeline_metrics.py")
+
+# ==========================================
+
+_ACTIVE = None  # Профиль, идущий в этом процессе (вложенный шаг не запускает второй); fork копирует его в пул — сверяем pid
+_OPEN = {}      # Открытые сейчас отрезки процесса: id → состояние (пик tracemalloc — один на процесс)
+_OPEN_PID = None
+_OPEN_LOCK = threading.Lock()
+
+
+def requested():
+    """Профилирование включено для этого процесса (через окружение — так его видят и процессы пулов)"""
+    return os.environ.get(PROFILE_ENV) == "1"
+
+
+def enable_children(enabled):
+    """Процессы пулов (spawn) наследуют окружение: так они узнают, что профилировать и их"""
+    if enabled:
+        os.environ[PROFILE_ENV] = "1"
+    else:
+        os.environ.pop(PROFILE_ENV, None)
+
+
+class StackSampler:
+    """
+    Выборочный CPU профиль: фоновый поток раз в PROFILE_INTERVAL снимает стеки всех потоков.
+    Видит и потоки asyncio.to_thread / пулов потоков (cProfile видит только свой поток),
+    а время в C коде (Pillow, numpy, torch) приписывается вызвавшей его Python функции.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()  # (корень, ..., лист) → число выборок
+        self.samples = 0
+        self.seconds = 0.0
+        self.labels = {}  # code → "функция (файл:строка)"
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def label(self, code):
+        if code not in self.labels:
+            self.labels[code] = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        return self.labels[code]
+
+    def run(self):
+        me = threading.get_ident()
+        started = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or Path(frame.f_code.co_filename).name in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+        self.seconds = time.perf_counter() - started
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class StageProfiler:
+    """
+    Профиль одного шага:
+    1. CPU — выборки стеков (StackSampler).
+    2. Память — снимки tracemalloc в начале и в конце: какие строки кода выделили и не отпустили.
+    Результат — простой словарь (уходит из процесса пула вместе с замерами).
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.sampler = StackSampler()
+        self.own_tracing = False
+        self.snapshot = None
+
+    def start(self):
+        global _ACTIVE
+        _ACTIVE = self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOC_FRAMES)
+            self.own_tracing = True
+        self.snapshot = tracemalloc.take_snapshot()
+        self.sampler.start()
+
+    def stop(self):
+        global _ACTIVE
+        self.sampler.stop()
+        # Сами замеры и профиль в отчет не попадают
+        ignore = [tracemalloc.Filter(False, pattern) for pattern in
+                  (tracemalloc.__file__, __file__, "*pipeline_metrics.py", "<frozen importlib._bootstrap*>")]
+        end = tracemalloc.take_snapshot().filter_traces(ignore)
+        diffs = end.compare_to(self.snapshot.filter_traces(ignore), "lineno")
+        if self.own_tracing:
+            tracemalloc.stop()
+        _ACTIVE = None
+
+        alloc = {}
+        for diff in sorted(diffs, key=lambda d: -d.size_diff)[:PROFILE_TOP]:
+            if diff.size_diff <= 0:
+                break
+            frame = diff.traceback[0]
+            alloc[f"{Path(frame.filename).name}:{frame.lineno}"] = [diff.size_diff, diff.count_diff]
+        return {
+            "stacks": {";".join(stack): count for stack, count in self.sampler.stacks.items()},
+            "samples": self.sampler.samples,
+            "seconds": self.sampler.seconds,
+            "alloc": alloc,
+        }
+
+
+def start():
+    """Профиль шага, если в процессе еще нет другого (иначе None)"""
+    if _ACTIVE is not None and _ACTIVE.pid == os.getpid():
+        return None
+    profiler = StageProfiler()
+    profiler.start()
+    return profiler
+
+
+def span_start():
+    """
+    Память в начале отрезка: запоминаем память tracemalloc и счетчик картинок Pillow.
+    Пик tracemalloc и счетчик Pillow общие на процесс: пик сбрасываем, только если других открытых отрезков нет,
+    а отрезки, которые шли одновременно с другими (поток, вложенный отрезок), помечаем concurrent
+    """
+    global _OPEN_PID
+    with _OPEN_LOCK:
+        if _OPEN_PID != os.getpid():
+            _OPEN.clear()  # Процесс пула после fork: отрезки родителя здесь не идут
+            _OPEN_PID = os.getpid()
+        state = {"current": 0, "concurrent": bool(_OPEN)}
+        for other in _OPEN.values():
+            other["concurrent"] = True
+        if tracemalloc.is_tracing():
+            if not _OPEN:
+                tracemalloc.reset_peak()
+            state["current"] = tracemalloc.get_traced_memory()[0]
+        state["new_count"] = Image.core.get_stats()["new_count"]
+        _OPEN[id(state)] = state
+    return state
+
+
+def span_end(state):
+    """
+    Сколько памяти отрезок занимал на пике (Python + numpy) и сколько картинок Pillow создал.
+    Буферы Pillow выделяются мимо tracemalloc, поэтому лишние копии кадра (convert, split) видны по pil_images.
+    Шел вместе с другими (concurrent) — пика нет (его могли сбросить или поднять соседи), есть только прирост
+    памяти от начала до конца, и в нем — чужие выделения тоже.
+    """
+    with _OPEN_LOCK:
+        _OPEN.pop(id(state), None)
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (state["current"],) * 2
+    result = {
+        "alloc_peak_kb": None if state["concurrent"] else round((peak - state["current"]) / 1024),
+        "alloc_delta_kb": round((current - state["current"]) / 1024),
+        "pil_images": Image.core.get_stats()["new_count"] - state["new_count"],
+    }
+    if state["concurrent"]:
+        result["concurrent"] = True
+    return result
+
+
+def merge(profiles):
+    """Профили одного шага из разных процессов → один"""
+    stacks, alloc = Counter(), {}
+    samples = seconds = 0
+    for profile in profiles:
+        stacks.update(profile["stacks"])
+        samples += profile["samples"]
+        seconds += profile["seconds"]
+        for site, (size, count) in profile["alloc"].items():
+            total = alloc.setdefault(site, [0, 0])
+            total[0] += size
+            total[1] += count
+    return {"stacks": dict(stacks), "samples": samples, "seconds": seconds, "alloc": alloc}
+
+
+def hot_functions(stacks):
+    """(собственные выборки, выборки со вложенными) по функциям"""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return own, total
+
+
+def report(stage, profile, spans):
+    """Текстовый отчет шага: горячие функции, места выделения памяти, память по отрезкам"""
+    own, total = hot_functions(profile["stacks"])
+    busy = sum(own.values()) or 1
+    interval = profile["seconds"] / profile["samples"] if profile["samples"] else PROFILE_INTERVAL
+    lines = [f"Шаг: {stage}", f"Выборок: {busy} (раз в {interval * 1000:.1f} мс, потоки в ожидании не считаются)", ""]
+
+    for title, counter in (("Горячие функции (сама функция и C код, который она вызвала)", own),
+                           ("Горячие функции (вместе с вложенными вызовами)", total)):
+        lines += [title, f"{'%':>6} {'~сек':>8}  функция"]
+        for name, count in counter.most_common(PROFILE_TOP):
+            lines.append(f"{count / busy * 100:6.1f} {count * interval:8.2f}  {name}")
+        lines.append("")
+
+    lines += ["Выделено и не отпущено к концу шага (tracemalloc: Python и numpy)", f"{'КБ':>10} {'блоков':>8}  место"]
+    for site, (size, count) in sorted(profile["alloc"].items(), key=lambda item: -item[1][0])[:PROFILE_TOP]:
+        lines.append(f"{size / 1024:10.0f} {count:8d}  {site}")
+    lines.append("")
+
+    lines += ["Память по отрезкам (пик внутри отрезка; картинок Pillow — сколько создано за один раз)",
+              "Пик и Pillow — только по отрезкам, шедшим в одиночку; у шедших вместе с другими (вместе) — лишь прирост",
+              "памяти от начала до конца, в нем и чужие выделения",
+              f"{'раз':>5} {'пик p50 КБ':>11} {'пик max КБ':>11} {'Pillow':>8} {'вместе':>7} {'прирост p50 КБ':>15}  отрезок"]
+
+    def solo(rows):
+        return [r for r in rows if not r.get("concurrent")]
+
+    def worst(item):
+        return -max((r["alloc_peak_kb"] for r in solo(item[1])), default=-1)
+
+    for name, rows in sorted(spans.items(), key=worst):
+        alone, together = solo(rows), len(rows) - len(solo(rows))
+        delta = median(r["alloc_delta_kb"] for r in rows if r.get("concurrent")) if together else None
+        if alone:
+            peaks = [r["alloc_peak_kb"] for r in alone]
+            pil_images = sum(r["pil_images"] for r in alone) / len(alone)
+            row = f"{len(rows):5d} {median(peaks):11.0f} {max(peaks):11.0f} {pil_images:8.1f}"
+        else:
+            row = f"{len(rows):5d} {'—':>11} {'—':>11} {'—':>8}"
+        lines.append(f"{row} {together:7d} {'—' if delta is None else f'{delta:.0f}':>15}  {name}")
+    return "\n".join(lines) + "\n"
+
+
+def collapsed(profile):
+    """Стеки в формате "a;b;c число" — открываются в speedscope.app и flamegraph.pl"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(profile["stacks"].items()))
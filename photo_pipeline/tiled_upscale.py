@@ -0,0 +1,214 @@
+import os
+import asyncio
+import contextvars
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from .upscale_planner import image_size
+from .wb_prepare import flatten_to_rgb
+from . import pipeline_metrics
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+TILED_MIN_PIXELS = 4_000_000   # Фото больше 4 Мп режем на тайлы (меньше — целиком, как раньше)
+TILE_SIZE = 1024               # Сторона тайла на входе (px)
+TILE_OVERLAP = 64              # Перекрытие соседних тайлов (px), на нем идет плавная склейка
+TILE_WORKERS = 4               # Тайлов одного фото одновременно (синхронный режим)
+
+# ==========================================
+
+
+def needs_tiling(img_path, min_pixels=TILED_MIN_PIXELS):
+    """Большое ли фото (по заголовку, без декодирования)"""
+    if not min_pixels:
+        return False
+    width, height = image_size(img_path)
+    return width * height > min_pixels
+
+
+def axis_spans(length, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Отрезки [start, end) вдоль одной стороны: шаг tile - overlap, последний тайл может быть короче.
+    Перекрытие не больше четверти тайла, поэтому накладываются только соседние тайлы.
+    """
+    overlap = min(overlap, tile // 4)
+    stride = tile - overlap
+    return [(start, min(start + tile, length)) for start in range(0, max(length - overlap, 1), stride)]
+
+
+def axis_weights(spans):
+    """
+    Веса для склейки по одной оси: внутри тайла 1, на перекрытии — линейный переход.
+    Нормированы так, что в каждой точке сумма весов всех тайлов = 1.
+    """
+    length = spans[-1][1]
+    weights = []
+    for i, (start, end) in enumerate(spans):
+        weight = np.ones(end - start, dtype=np.float32)
+        if i > 0:
+            left = spans[i - 1][1] - start
+            weight[:left] = (np.arange(left, dtype=np.float32) + 0.5) / left
+        if i < len(spans) - 1:
+            right = end - spans[i + 1][0]
+            weight[len(weight) - right:] = np.minimum(weight[len(weight) - right:], (np.arange(right, 0, -1, dtype=np.float32) - 0.5) / right)
+        weights.append(weight)
+
+    total = np.zeros(length, dtype=np.float32)
+    for (start, end), weight in zip(spans, weights):
+        total[start:end] += weight
+    return [weight / total[start:end] for (start, end), weight in zip(spans, weights)]
+
+
+def scale_spans(spans, scale):
+    """Отрезки входа → отрезки на увеличенной картинке"""
+    return [(round(start * scale), round(end * scale)) for start, end in spans]
+
+
+def split_tiles(img_path, work_dir, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Режет фото на перекрывающиеся тайлы (PNG без потерь) в work_dir.
+    Возвращает (xs, ys, задачи [(вход тайла, выход тайла), ...] по строкам).
+    Уже нарезанные тайлы не перезаписываются — повторная попытка продолжает с места обрыва.
+    """
+    work_dir = Path(work_dir)
+    # Тайлы от другой версии фото или другой сетки не годятся — начинаем заново
+    stat = Path(img_path).stat()
+    source = f"{stat.st_size}:{stat.st_mtime_ns}:{tile}:{overlap}"
+    marker = work_dir / "source"
+    if work_dir.exists() and (not marker.exists() or marker.read_text() != source):
+        shutil.rmtree(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    marker.write_text(source)
+
+    with Image.open(img_path) as img:
+        img = flatten_to_rgb(img)  # Прозрачное — белым, как для WB (convert сделал бы черным)
+        xs, ys = axis_spans(img.width, tile, overlap), axis_spans(img.height, tile, overlap)
+        jobs = []
+        for row, (y1, y2) in enumerate(ys):
+            for col, (x1, x2) in enumerate(xs):
+                tile_in = work_dir / f"tile_{row}_{col}.png"
+                tile_out = work_dir / f"tile_{row}_{col}_up.png"
+                if not tile_in.exists():
+                    img.crop((x1, y1, x2, y2)).save(tile_in)
+                jobs.append((tile_in, tile_out))
+    return xs, ys, jobs
+
+
+def stitch(xs, ys, jobs, output_path, icc_profile=None):
+    """
+    Склейка увеличенных тайлов с плавным переходом на перекрытиях.
+    В памяти только итоговая картинка и одна полоса тайлов (float), а не все тайлы сразу.
+    """
+    with Image.open(jobs[0][1]) as first:
+        scale = first.width / (xs[0][1] - xs[0][0])
+    out_xs, out_ys = scale_spans(xs, scale), scale_spans(ys, scale)
+    weights_x, weights_y = axis_weights(out_xs), axis_weights(out_ys)
+    width, height = out_xs[-1][1], out_ys[-1][1]
+
+    result = np.empty((height, width, 3), dtype=np.uint8)
+    carry = None  # Нижнее перекрытие прошлой полосы, к нему добавится верх следующей
+
+    for row, (y1, y2) in enumerate(out_ys):
+        band = np.zeros((y2 - y1, width, 3), dtype=np.float32)
+        for col, (x1, x2) in enumerate(out_xs):
+            with Image.open(jobs[row * len(xs) + col][1]) as tile_img:
+                tile_img = tile_img.convert("RGB")
+                if tile_img.size != (x2 - x1, y2 - y1):
+                    # Модель могла округлить размер иначе — подгоняем на пиксель-два
+                    tile_img = tile_img.resize((x2 - x1, y2 - y1), Image.Resampling.LANCZOS)
+                band[:, x1:x2] += np.asarray(tile_img, dtype=np.float32) * weights_x[col][None, :, None]
+        band *= weights_y[row][:, None, None]
+
+        if carry is not None:
+            band[:len(carry)] += carry
+        # Строки до начала следующей полосы больше не изменятся — переносим в результат
+        done_to = out_ys[row + 1][0] if row + 1 < len(out_ys) else y2
+        result[y1:done_to] = np.clip(band[:done_to - y1] + 0.5, 0, 255).astype(np.uint8)
+        carry = band[done_to - y1:]
+
+    options = {"quality": 95} if Path(output_path).suffix.lower() in (".jpg", ".jpeg") else {}
+    Image.fromarray(result).save(output_path, icc_profile=icc_profile, **options)
+
+
+def work_dir_for(output_path):
+    """Папка для тайлов рядом с результатом (скрытая, удаляется после склейки)"""
+    output_path = Path(output_path)
+    return output_path.with_name(f".{output_path.name}.tiles")
+
+
+def forget_tiles(upscaler, output_path):
+    """Фото упало окончательно: апскейлер отпускает все, что держал под его тайлы (ссылки, байты загрузки)"""
+    for tile_in in work_dir_for(output_path).glob("tile_*.png"):
+        if not tile_in.stem.endswith(("_up", ".part")):
+            upscaler.forget(tile_in)
+
+
+def icc_profile_of(img_path):
+    with Image.open(img_path) as img:
+        return img.info.get("icc_profile")
+
+
+def partial_path(tile_out):
+    """Временное имя тайла: в tile_out он попадает только целиком (обрыв не оставит битый тайл)"""
+    return tile_out.with_name(f"{tile_out.stem}.part{tile_out.suffix}")
+
+
+def upscale_tile(upscaler, tile_in, tile_out):
+    upscaler.upscale_file(tile_in, partial_path(tile_out))
+    os.replace(partial_path(tile_out), tile_out)
+
+
+async def aupscale_tile(upscaler, tile_in, tile_out):
+    await upscaler.aupscale_file(tile_in, partial_path(tile_out))
+    os.replace(partial_path(tile_out), tile_out)
+
+
+def tiled_upscale_file(upscaler, img_path, output_path, tile=TILE_SIZE, overlap=TILE_OVERLAP, workers=TILE_WORKERS):
+    """
+    Апскейл большого фото по тайлам (синхронно):
+    1. Режем на перекрывающиеся тайлы.
+    2. Тайлы идут в апскейлер параллельно (workers потоков).
+    3. Склеиваем с плавным переходом, швов не видно.
+    """
+    work_dir = work_dir_for(output_path)
+    with pipeline_metrics.span("split_tiles", img_path):
+        xs, ys, jobs = split_tiles(img_path, work_dir, tile, overlap)
+    todo = [(tile_in, tile_out) for tile_in, tile_out in jobs if not tile_out.exists()]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # list(): дожидаемся всех тайлов и пробрасываем первую ошибку
+        # (copy_context: замеры тайлов остаются в текущем шаге)
+        list(pool.map(lambda job: contextvars.copy_context().run(upscale_tile, upscaler, *job), todo))
+
+    with pipeline_metrics.span("stitch", img_path):
+        stitch(xs, ys, jobs, output_path, icc_profile_of(img_path))
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return len(jobs)
+
+
+async def atiled_upscale_file(upscaler, img_path, output_path, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    То же для asyncio: все тайлы отправляются сразу, сколько из них реально летит
+    одновременно — решает сам апскейлер (например, адаптивный лимит Replicate).
+    Резка и склейка идут в отдельном потоке, event loop не блокируется.
+    """
+    work_dir = work_dir_for(output_path)
+    with pipeline_metrics.span("split_tiles", img_path):
+        xs, ys, jobs = await asyncio.to_thread(split_tiles, img_path, work_dir, tile, overlap)
+    todo = [(tile_in, tile_out) for tile_in, tile_out in jobs if not tile_out.exists()]
+
+    # Ждем все тайлы, даже если какой-то упал: готовые пригодятся при повторной попытке
+    results = await asyncio.gather(*(aupscale_tile(upscaler, *job) for job in todo), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    icc_profile = await asyncio.to_thread(icc_profile_of, img_path)
+    with pipeline_metrics.span("stitch", img_path):
+        await asyncio.to_thread(stitch, xs, ys, jobs, output_path, icc_profile)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return len(jobs)
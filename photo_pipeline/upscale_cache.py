@@ -0,0 +1,113 @@
+import os
+import shutil
+import hashlib
+from pathlib import Path
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+CACHE_DIR = ".upscale_cache"   # Общий кэш апскейлов для всех скриптов
+CACHE_MAX_GB = 20              # Лимит размера, при превышении удаляем самые давно использованные
+
+# ==========================================
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 содержимого файла (читаем кусками, без загрузки целиком в память)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def place_file(src, dest):
+    """Кладет копию src по пути dest: жесткая ссылка (мгновенно), если нельзя — копия"""
+    dest = Path(dest)
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)  # Атомарно: либо старый файл, либо новый целиком
+
+
+class UpscaleCache:
+    """
+    Кэш апскейлов по содержимому:
+    1. Ключ = sha256(модель + байты входного файла), имя файла не важно.
+    2. Переименованное фото берется из кэша, измененное — уходит в апскейл заново.
+    3. Размер ограничен, вытесняем самые давно использованные записи (LRU по mtime).
+    """
+
+    def __init__(self, root=CACHE_DIR, max_gb=CACHE_MAX_GB):
+        self.root = Path(root)
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.total_bytes = sum(p.stat().st_size for p in self.entries())
+
+    def entries(self):
+        return [p for p in self.root.glob("??/*") if not p.name.startswith(".")]
+
+    def key_for(self, img_path, model):
+        """Ключ кэша: модель + содержимое файла"""
+        digest = hashlib.sha256(model.encode())
+        digest.update(b"\0")
+        digest.update(file_digest(img_path).encode())
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return self.root / key[:2] / key
+
+    def fetch(self, key, dest):
+        """Если результат есть в кэше — кладет его в dest и возвращает True"""
+        entry = self.path_for(key)
+        if not entry.exists():
+            return False
+        os.utime(entry)  # Отметка "недавно использован" для LRU
+        place_file(entry, dest)
+        return True
+
+    def store(self, key, src):
+        """Сохраняет готовый результат в кэш и при необходимости чистит старые записи"""
+        entry = self.path_for(key)
+        if entry.exists():
+            return
+        entry.parent.mkdir(exist_ok=True)
+        place_file(src, entry)
+        self.total_bytes += entry.stat().st_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Удаляет самые давно использованные записи, пока кэш не влезет в лимит"""
+        entries = sorted(self.entries(), key=lambda p: p.stat().st_mtime)
+        self.total_bytes = sum(p.stat().st_size for p in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.total_bytes -= entry.stat().st_size
+            entry.unlink()
+
+    def restore(self, img_path, output_path, model):
+        """
+        Проверка перед апскейлом. Возвращает (ключ, статус):
+        "hit" — результат взят из кэша и лежит в output_path, запрос не нужен;
+        None  — нужен запрос к API, после успеха вызвать store(ключ, output_path).
+        Файл в output_path, которого нет в кэше, не берем: по нему не узнать, какой моделью и из какого
+        исходника он сделан (готовые фото без изменений и так пропускает журнал задач)
+        """
+        key = self.key_for(img_path, model)
+        if self.fetch(key, output_path):
+            return key, "hit"
+
+        output_path = Path(output_path)
+        if output_path.exists():
+            # Старый результат больше не подходит. Убираем его (или ссылку на запись кэша), чтобы запись
+            # нового файла не перезаписала общую с кэшем копию
+            output_path.unlink()
+
+        return key, None
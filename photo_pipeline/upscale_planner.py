@@ -0,0 +1,88 @@
+from PIL import Image
+from .upscale_cache import place_file
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+UPSCALE_MIN_FACTOR = 1.25      # Увеличение до 1.25x спокойно делает LANCZOS на шаге WB, модель не нужна
+LOCAL_MAX_FACTOR = 2.0         # В режиме auto: до 2x — локальная модель, больше — Replicate
+
+# ==========================================
+
+ROUTE_RESAMPLE = "resample"    # Без модели: фото как есть, ресайз сделает шаг WB
+ROUTE_LOCAL = "local"          # Локальная 2x модель
+ROUTE_REMOTE = "remote"        # Replicate
+ROUTE_CACHED = "cached"        # Результат взят из кэша (для статистики)
+
+ROUTE_NAMES = {
+    ROUTE_RESAMPLE: "ресайз без модели",
+    ROUTE_LOCAL: "локальная модель",
+    ROUTE_REMOTE: "Replicate",
+    ROUTE_CACHED: "из кэша",
+}
+
+
+def image_size(img_path):
+    """Размер фото по заголовку (пиксели не декодируются)"""
+    with Image.open(img_path) as img:
+        return img.size
+
+
+def required_scale(width, height, target_w, target_h):
+    """Во сколько раз надо увеличить фото, чтобы центральный кроп покрыл цель (как в resize_and_crop)"""
+    return max(target_w / width, target_h / height)
+
+
+def passthrough(img_path, output_path):
+    """Маршрут "без модели": кладем исходник под именем апскейла (ссылка, без копирования)"""
+    place_file(img_path, output_path)
+
+
+class UpscalePlanner:
+    """
+    Выбор самого дешевого маршрута апскейла под целевой размер WB:
+    1. Фото почти нужного размера (≤ min_factor) — без модели, хватит LANCZOS на шаге WB.
+    2. backend="local" — все остальное апскейлим на месте;
+       backend="auto" — на месте только до local_max_factor.
+    3. Иначе — Replicate.
+    Считает, сколько фото ушло каждым маршрутом и сколько времени это заняло.
+    """
+
+    def __init__(self, target_w, target_h, min_factor=UPSCALE_MIN_FACTOR, backend="replicate", local_max_factor=LOCAL_MAX_FACTOR):
+        self.target_w = target_w
+        self.target_h = target_h
+        self.min_factor = min_factor
+        self.backend = backend
+        self.local_max_factor = local_max_factor
+        self.counts = dict.fromkeys(ROUTE_NAMES, 0)
+        self.seconds = dict.fromkeys(ROUTE_NAMES, 0.0)
+
+    def route_for(self, img_path):
+        """Возвращает (маршрут, во сколько раз нужно увеличить)"""
+        return self.route_for_size(*image_size(img_path))
+
+    def route_for_size(self, width, height):
+        """То же по размеру картинки, которая уже в памяти"""
+        scale = required_scale(width, height, self.target_w, self.target_h)
+        if scale <= self.min_factor:
+            return ROUTE_RESAMPLE, scale
+        if self.backend == "local" or (self.backend == "auto" and scale <= self.local_max_factor):
+            return ROUTE_LOCAL, scale
+        return ROUTE_REMOTE, scale
+
+    def record(self, route, seconds=0.0):
+        """Учет готового фото: каким маршрутом и за сколько секунд"""
+        self.counts[route] += 1
+        self.seconds[route] += seconds
+
+    def report(self):
+        """Итоговая строка: маршруты, время и сколько запросов к API не понадобилось"""
+        parts = []
+        for route, name in ROUTE_NAMES.items():
+            part = f"{name} {self.counts[route]}"
+            if self.seconds[route]:
+                part += f" ({self.seconds[route]:.1f} сек)"
+            parts.append(part)
+        saved = self.counts[ROUTE_RESAMPLE] + self.counts[ROUTE_LOCAL] + self.counts[ROUTE_CACHED]
+        print(f"   🧭 Маршруты апскейла: {', '.join(parts)}. Запросов к API сэкономлено: {saved}")
@@ -0,0 +1,280 @@
+import io
+import asyncio
+import threading
+import time
+from pathlib import Path
+from PIL import Image
+from .inpaint_engine import pick_device
+from .wb_prepare import flatten_to_rgb
+from . import safe_download
+from . import pipeline_metrics
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+UPSCALE_BACKEND = "replicate"  # replicate / local / auto (auto: до LOCAL_MAX_FACTOR локально, больше — Replicate)
+
+# Локальный апскейл на CPU (Real-ESRGAN из iopaint, веса скачиваются один раз)
+LOCAL_MODEL = "realesr-general-x4v3"  # realesr-general-x4v3 (быстрая) / RealESRGAN_x4plus (тяжелая, качественнее)
+LOCAL_DEVICE = "auto"          # auto / cpu / cuda / mps
+LOCAL_THREADS = 0              # Потоки torch (0 = сколько решит torch)
+LOCAL_SCALE = 2                # Итоговое увеличение (сеть x4, лишнее ужимаем LANCZOS)
+LOCAL_TILE = 256               # Сторона тайла (px входа): ограничивает память, 0 = весь кадр разом
+LOCAL_TILE_PAD = 16            # Контекст вокруг тайла (px), чтобы не было швов
+
+# ==========================================
+
+_LOCAL = None  # "Теплая" локальная модель на весь процесс
+_LOCAL_LOCK = threading.Lock()
+
+
+class Upscaler:
+    """
+    Общий интерфейс апскейлеров:
+    upscale_file(вход, выход) — синхронно, aupscale_file(вход, выход) — для asyncio.
+    model_id — строка для ключа кэша (разные модели не путаются).
+    """
+
+    name = "upscaler"
+    model_id = ""
+
+    def upscale_file(self, img_path, output_path):
+        raise NotImplementedError
+
+    async def aupscale_file(self, img_path, output_path):
+        """По умолчанию — синхронный вызов в отдельном потоке, чтобы не блокировать event loop"""
+        await asyncio.to_thread(self.upscale_file, img_path, output_path)
+
+    def forget(self, img_path):
+        """Повторов для фото больше не будет (успех или финальная ошибка): отпускаем все, что держали под него"""
+
+
+class ReplicateUpscaler(Upscaler):
+    """
+    Апскейл через Replicate: файл уходит в модель, результат скачивается в output_path.
+    С uploader фото загружается один раз (в компактном формате), повторы берут готовую ссылку.
+    """
+
+    name = "Replicate"
+
+    def __init__(self, model, client, uploader=None):
+        self.model_id = model
+        self.client = client
+        self.uploader = uploader
+
+    def predict(self, img_path):
+        """Запуск модели; результат — поток (FileOutput), читается кусками"""
+        if self.uploader:
+            image = self.uploader.url_for(img_path)
+            # predict = очередь у провайдера + работа модели (загрузка фото — отдельный отрезок)
+            with pipeline_metrics.span("predict", img_path):
+                output = self.client.run(self.model_id, input={"image": image})
+            self.uploader.forget(img_path)  # Повторов больше не будет — ссылку не держим
+            return output
+        with open(img_path, "rb") as file, pipeline_metrics.span("predict", img_path):
+            return self.client.run(self.model_id, input={"image": file})
+
+    async def apredict(self, img_path):
+        # Асинхронный вызов через общий клиент (соединения переиспользуются)
+        if self.uploader:
+            image = await self.uploader.aurl_for(img_path)
+            with pipeline_metrics.span("predict", img_path):
+                output = await self.client.async_run(self.model_id, input={"image": image})
+            self.uploader.forget(img_path)
+            return output
+        with open(img_path, "rb") as file, pipeline_metrics.span("predict", img_path):
+            return await self.client.async_run(self.model_id, input={"image": file})
+
+    def forget(self, img_path):
+        """Закодированное фото и ссылка на него не нужны (после успеха это делает сам predict)"""
+        if self.uploader:
+            self.uploader.forget(img_path)
+
+    def upscale_file(self, img_path, output_path):
+        output = self.predict(img_path)
+        # Скачиваем кусками во временный файл, под итоговым именем — только целый результат
+        with pipeline_metrics.span("download", img_path) as extra:
+            safe_download.save_stream(output, output_path)
+            extra["bytes"] = Path(output_path).stat().st_size
+        pipeline_metrics.add("bytes_downloaded", extra["bytes"])
+
+    async def aupscale_file(self, img_path, output_path):
+        output = await self.apredict(img_path)
+        with pipeline_metrics.span("download", img_path) as extra:
+            await safe_download.asave_stream(output, output_path)
+            extra["bytes"] = Path(output_path).stat().st_size
+        pipeline_metrics.add("bytes_downloaded", extra["bytes"])
+
+    async def aupscale_spooled(self, img_path):
+        """
+        Результат без файла под итоговым именем (для ресайза под WB на лету): safe_download.aspool_stream,
+        в памяти — только небольшой буфер. Файловый объект закрывает вызывающий
+        """
+        output = await self.apredict(img_path)
+        with pipeline_metrics.span("download", img_path) as extra:
+            spool = await safe_download.aspool_stream(output)
+            extra["bytes"] = spool.seek(0, io.SEEK_END)
+            spool.seek(0)
+        pipeline_metrics.add("bytes_downloaded", extra["bytes"])
+        return spool
+
+    async def aupscale_payload(self, payload, image=None):
+        """
+        Фото из памяти (HTTP сервис): payload = (байты, имя файла, content type) из payload_upload.encode_image.
+        Загружается через files API и идет в модель ссылкой; результат — байты. image — имя для замеров
+        """
+        data, filename, content_type = payload
+        with pipeline_metrics.span("upload", image, bytes=len(data)):
+            file = await self.client.files.async_create(io.BytesIO(data), filename=filename, content_type=content_type)
+        pipeline_metrics.add("bytes_uploaded", len(data))
+        with pipeline_metrics.span("predict", image):
+            output = await self.client.async_run(self.model_id, input={"image": file.urls["get"]})
+        with pipeline_metrics.span("download", image) as extra:
+            result = await safe_download.aread_stream(output)
+            extra["bytes"] = len(result)
+        pipeline_metrics.add("bytes_downloaded", len(result))
+        return result
+
+
+class LimitedUpscaler(Upscaler):
+    """
+    Обертка над асинхронным апскейлером: каждый вызов занимает слот адаптивного лимита,
+    а задержка и 429 уходят в лимит. Нужна, когда одно фото — это много запросов (тайлы).
+    """
+
+    def __init__(self, upscaler, limiter):
+        self.upscaler = upscaler
+        self.limiter = limiter
+        self.name = upscaler.name
+        self.model_id = upscaler.model_id
+
+    def upscale_file(self, img_path, output_path):
+        self.upscaler.upscale_file(img_path, output_path)
+
+    def forget(self, img_path):
+        self.upscaler.forget(img_path)
+
+    async def limited(self, call, img_path=None):
+        """Выполняет запрос в слоте лимита и сообщает лимиту задержку / ошибку / 429"""
+        with pipeline_metrics.span("limiter_wait", img_path):
+            await self.limiter.acquire()
+        started = time.perf_counter()
+        ok = throttled = False
+        try:
+            result = await call
+            ok = True
+            return result
+        except Exception as e:
+            error_msg = str(e).lower()
+            throttled = "429" in error_msg or "throttled" in error_msg
+            if throttled:
+                pipeline_metrics.add("throttled")
+            raise
+        finally:
+            await self.limiter.release(time.perf_counter() - started, ok, throttled)
+
+    async def aupscale_file(self, img_path, output_path):
+        await self.limited(self.upscaler.aupscale_file(img_path, output_path), img_path)
+
+    async def aupscale_spooled(self, img_path):
+        return await self.limited(self.upscaler.aupscale_spooled(img_path), img_path)
+
+    async def aupscale_payload(self, payload, image=None):
+        return await self.limited(self.upscaler.aupscale_payload(payload, image), image)
+
+
+def tile_grid(width, height, tile):
+    """Сетка тайлов (x1, y1, x2, y2) без перекрытий; tile=0 — один тайл на весь кадр"""
+    if not tile:
+        return [(0, 0, width, height)]
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in range(0, height, tile)
+        for x in range(0, width, tile)
+    ]
+
+
+class LocalUpscaler(Upscaler):
+    """
+    Real-ESRGAN прямо в процессе (модели и веса берем из iopaint):
+    1. Модель грузится один раз, число потоков torch задается явно.
+    2. Кадр идет через сеть тайлами с запасом контекста — память не зависит от размера фото.
+    3. Сеть всегда x4; если нужно меньше, результат ужимается LANCZOS до scale.
+    """
+
+    name = "локально"
+
+    def __init__(self, model=LOCAL_MODEL, device=LOCAL_DEVICE, threads=LOCAL_THREADS, scale=LOCAL_SCALE, tile=LOCAL_TILE, tile_pad=LOCAL_TILE_PAD):
+        import torch
+        from iopaint.plugins.realesrgan import RealESRGANUpscaler
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        started = time.perf_counter()
+        self.device = pick_device(device)
+        self.threads = torch.get_num_threads()
+        # Плагин iopaint сам скачивает и проверяет веса; нам нужна только сама сеть
+        plugin = RealESRGANUpscaler(model, torch.device(self.device), no_half=True)
+        self.net = plugin.model.model
+        self.net_scale = plugin.model.scale
+        self.scale = scale
+        self.tile = tile
+        self.tile_pad = tile_pad
+        self.model_id = f"local:{model}:x{scale}"
+        self.lock = threading.Lock()  # Одна сеть на процесс: вызовы из разных потоков идут по очереди
+        self.load_seconds = time.perf_counter() - started
+
+    def forward(self, array):
+        """Один прогон сети: uint8 [H, W, 3] → uint8 [H*4, W*4, 3]"""
+        import numpy as np
+        import torch
+
+        tensor = torch.from_numpy(np.ascontiguousarray(array)).permute(2, 0, 1).unsqueeze(0).float().div(255)
+        with torch.inference_mode():
+            output = self.net(tensor.to(self.device))
+        return (output[0] * 255).round().clamp(0, 255).to(torch.uint8).permute(1, 2, 0).cpu().numpy()
+
+    def upscale_image(self, image):
+        """Апскейл PIL картинки по тайлам. Возвращает новую RGB картинку (прозрачное — белым, как для WB)"""
+        import numpy as np
+
+        image = flatten_to_rgb(image)
+        array = np.asarray(image)
+        height, width = array.shape[:2]
+        s, pad = self.net_scale, self.tile_pad
+        result = np.empty((height * s, width * s, 3), dtype=np.uint8)
+
+        with self.lock:
+            for x1, y1, x2, y2 in tile_grid(width, height, self.tile):
+                # Тайл с запасом контекста, в результат кладем только его середину
+                px1, py1 = max(0, x1 - pad), max(0, y1 - pad)
+                px2, py2 = min(width, x2 + pad), min(height, y2 + pad)
+                output = self.forward(array[py1:py2, px1:px2])
+                ox, oy = (x1 - px1) * s, (y1 - py1) * s
+                result[y1 * s:y2 * s, x1 * s:x2 * s] = output[oy:oy + (y2 - y1) * s, ox:ox + (x2 - x1) * s]
+
+        upscaled = Image.fromarray(result)
+        if self.scale != s:
+            size = (round(width * self.scale), round(height * self.scale))
+            upscaled = upscaled.resize(size, Image.Resampling.LANCZOS)
+        return upscaled
+
+    def upscale_file(self, img_path, output_path):
+        with Image.open(img_path) as img, pipeline_metrics.span("local_model", img_path):
+            icc_profile = img.info.get("icc_profile")
+            upscaled = self.upscale_image(img)
+        options = {"quality": 95} if Path(output_path).suffix.lower() in (".jpg", ".jpeg") else {}
+        upscaled.save(output_path, icc_profile=icc_profile, **options)
+
+
+def get_local_upscaler(model=LOCAL_MODEL, device=LOCAL_DEVICE, threads=LOCAL_THREADS, scale=LOCAL_SCALE, tile=LOCAL_TILE):
+    """Общая локальная модель на процесс: первый вызов грузит веса, остальные берут готовую"""
+    global _LOCAL
+    with _LOCAL_LOCK:  # Асинхронный пайплайн может попросить модель из нескольких потоков сразу
+        if _LOCAL is None:
+            _LOCAL = LocalUpscaler(model, device, threads, scale, tile)
+            print(f"   🧠 Локальный апскейл {model} на {_LOCAL.device} (потоков torch: {_LOCAL.threads}), загрузка {_LOCAL.load_seconds:.1f} сек")
+    return _LOCAL
+
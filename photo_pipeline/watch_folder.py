@@ -0,0 +1,278 @@
+import os
+import sys
+import time
+import errno
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+from pathlib import Path
+from .safe_download import check_image
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+WATCH_BACKEND = "auto"         # auto (inotify на Linux, иначе опрос) / inotify / poll
+SETTLE_SECONDS = 1.0           # Файл считается дописанным, если столько секунд не менялся
+POLL_INTERVAL = 1.0            # Период опроса папки без inotify (сек)
+RESCAN_SECONDS = 60            # Опрос: полный пересмотр папки (перезапись файла на месте не меняет mtime папки)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# ==========================================
+
+# Флаги inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len; дальше имя длиной len (с нулями в конце)
+
+
+class Inotify:
+    """
+    inotify через ctypes (без сторонних пакетов): один дескриптор на папку,
+    события читаются пачкой, когда дескриптор готов к чтению (loop.add_reader).
+    """
+
+    def __init__(self, folder):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify есть только на Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # IN_NONBLOCK / IN_CLOEXEC совпадают с O_NONBLOCK / O_CLOEXEC
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1: " + os.strerror(ctypes.get_errno()))
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch {folder}: {os.strerror(error)}")
+
+    def read(self):
+        """Все накопившиеся события: список (флаги, имя файла)"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """
+    Новые фото в папке по мере появления (для долгоживущего конвейера):
+    1. inotify: просыпаемся по событию файловой системы, в простое — ноль работы.
+       Без inotify — опрос: scandir раз в POLL_INTERVAL, и то только если поменялся mtime папки.
+    2. Защита от недописанных файлов: фото отдается, когда SETTLE_SECONDS не было записей и
+       размер / mtime не поменялись; файл, переименованный в папку целиком (mv), — сразу.
+       Перед отдачей проверяется, что PNG / JPEG не оборван (safe_download.check_image).
+    3. Фото, уже лежавшие в папке при старте, идут первыми (готовые отсеет журнал задач).
+    Использование: async for img_path in watcher.images(): ...; watcher.stop() — закончить.
+    """
+
+    def __init__(self, folder, backend=WATCH_BACKEND, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, extensions=IMAGE_EXTENSIONS):
+        self.folder = Path(folder)
+        self.backend = backend
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.inotify = None
+        self.waiting = {}    # имя → (когда отдавать, (размер, mtime) на момент последнего изменения)
+        self.known = {}      # имя → (размер, mtime) при последнем опросе
+        self.sent = {}       # имя → (размер, mtime) уже отданной версии: повторное событие без изменений не дублирует фото
+        self.folder_mtime = None
+        self.next_poll = 0.0
+        self.next_rescan = 0.0
+        self.stopped = False
+        self.wakeup = asyncio.Event()
+
+    def wanted(self, name):
+        """Фото, а не служебный файл: скрытые и временные (.name.part, name~) пропускаем"""
+        return (
+            not name.startswith(".")
+            and not name.endswith("~")
+            and os.path.splitext(name)[1].lower() in self.extensions
+        )
+
+    def signature(self, name):
+        try:
+            stat = (self.folder / name).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def touch(self, name, settle=None, signature=None):
+        """Файл изменился: отдаем его не раньше чем через settle секунд тишины"""
+        if not self.wanted(name):
+            return
+        signature = signature or self.signature(name)
+        if signature is None:
+            self.waiting.pop(name, None)
+            return
+        delay = self.settle if settle is None else settle
+        self.waiting[name] = (time.monotonic() + delay, signature)
+        self.wakeup.set()
+
+    def start(self):
+        """Подписка на события (или опрос) и фото, которые уже лежат в папке"""
+        if self.backend in ("auto", "inotify"):
+            try:
+                self.inotify = Inotify(self.folder)
+                asyncio.get_running_loop().add_reader(self.inotify.fd, self.on_events)
+            except (OSError, AttributeError, NotImplementedError) as e:
+                if self.inotify is not None:
+                    self.inotify.close()
+                    self.inotify = None
+                if self.backend == "inotify":
+                    raise
+                print(f"   ⚠️  inotify недоступен ({e}) — опрашиваем папку раз в {self.poll_interval} сек")
+
+        # Уже лежащие фото — сразу (если какое-то еще пишется, его поймает следующее событие или опрос)
+        for name in sorted(os.listdir(self.folder)):
+            self.touch(name, settle=0)
+        self.known = {name: self.waiting[name][1] for name in self.waiting}
+        self.folder_mtime = self.folder.stat().st_mtime_ns
+        self.next_poll = self.next_rescan = time.monotonic()
+        print(f"   👀 Папка {self.folder}: {self.mode()}, фото берем после {self.settle} сек без записи")
+
+    def mode(self):
+        return "inotify" if self.inotify else f"опрос раз в {self.poll_interval} сек"
+
+    def on_events(self):
+        """Колбэк event loop: дескриптор inotify готов к чтению"""
+        for mask, name in self.inotify.read():
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                print(f"   ⚠️  Папку {self.folder} удалили или переместили — наблюдение остановлено")
+                self.stop()
+            elif mask & IN_Q_OVERFLOW:
+                # Очередь ядра переполнилась, часть событий потеряна: пересматриваем папку целиком
+                self.poll(full=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.waiting.pop(name, None)
+                self.sent.pop(name, None)
+            elif mask & IN_MOVED_TO:
+                self.touch(name, settle=0)  # Переименование атомарно: файл уже целиком на месте
+            else:
+                self.touch(name)
+
+    def poll(self, full=False):
+        """Опрос папки: scandir только если поменялся ее mtime (или раз в RESCAN_SECONDS), иначе stat ожидающих"""
+        now = time.monotonic()
+        try:
+            folder_mtime = self.folder.stat().st_mtime_ns
+        except FileNotFoundError:
+            print(f"   ⚠️  Папки {self.folder} больше нет — наблюдение остановлено")
+            self.stop()
+            return
+        full = full or folder_mtime != self.folder_mtime or now >= self.next_rescan
+        if full:
+            self.folder_mtime = folder_mtime
+            self.next_rescan = now + RESCAN_SECONDS
+            current = {}
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if self.wanted(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        else:
+            # Новых имен нет — смотрим только файлы, которые еще дописываются
+            current = dict(self.known)
+            for name in self.waiting:
+                current[name] = self.signature(name)
+
+        for name, signature in current.items():
+            if signature is None:
+                self.waiting.pop(name, None)
+            elif self.known.get(name) != signature:
+                self.touch(name, signature=signature)
+        for name in set(self.sent) - set(current):
+            del self.sent[name]
+        self.known = {name: signature for name, signature in current.items() if signature is not None}
+
+    def ready(self):
+        """Фото, которые не менялись SETTLE_SECONDS и читаются целиком"""
+        now = time.monotonic()
+        result = []
+        for name, (due, signature) in list(self.waiting.items()):
+            if due > now:
+                continue
+            current = self.signature(name)
+            if current is None:
+                del self.waiting[name]
+            elif current != signature:
+                self.waiting[name] = (now + self.settle, current)  # Еще пишется
+            elif self.sent.get(name) == signature:
+                del self.waiting[name]  # Та же версия, что уже отдали (например, chmod или второй close)
+            else:
+                try:
+                    check_image(self.folder / name)
+                except Exception as e:
+                    # Недописан или битый: ждем следующего изменения файла
+                    print(f"   ⏳ {name}: пока не читается ({e}), ждем")
+                    del self.waiting[name]
+                    continue
+                del self.waiting[name]
+                self.sent[name] = signature
+                result.append(self.folder / name)
+        return sorted(result)
+
+    def next_wakeup(self):
+        """Сколько можно спать до следующего дела"""
+        deadlines = [due for due, _ in self.waiting.values()]
+        if self.inotify is None:
+            deadlines.append(self.next_poll)
+        if not deadlines:
+            return None  # inotify и нечего ждать: спим до события
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    async def images(self):
+        """Асинхронный поток новых фото до stop()"""
+        self.start()
+        try:
+            while not self.stopped:
+                if self.inotify is None and time.monotonic() >= self.next_poll:
+                    self.poll()
+                    self.next_poll = time.monotonic() + self.poll_interval
+                for img_path in self.ready():
+                    yield img_path
+                    if self.stopped:
+                        return
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.next_wakeup())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.close()
+
+    def stop(self):
+        """Больше фото не отдаем (вызывать из event loop, например из обработчика сигнала)"""
+        self.stopped = True
+        self.wakeup.set()
+
+    def close(self):
+        if self.inotify is not None:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
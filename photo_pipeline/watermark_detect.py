@@ -0,0 +1,221 @@
+import sys
+import hashlib
+from pathlib import Path
+import numpy as np
+import cv2
+from PIL import Image
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+WATERMARK_DIR = "watermarks"   # Шаблоны вотермарок: PNG с прозрачностью (непрозрачное = знак)
+REFERENCE_W, REFERENCE_H = 832, 1248  # Под какой размер фото сняты шаблоны (на других размерах шаблон масштабируется)
+DETECT_THRESHOLD = 0.55        # Порог совпадения (0..1): ниже — считаем, что вотермарки нет
+SEARCH_FRACTION = 0.25         # Где искать: правый нижний угол, доля ширины и высоты фото
+SCALE_STEPS = (0.9, 1.0, 1.1)  # Запас по масштабу вокруг ожидаемого размера знака
+MASK_DILATE = 6                # Насколько маска шире самого знака (px на эталонном размере)
+ALPHA_MIN = 16                 # Пиксели шаблона прозрачнее этого в маску не попадают
+
+# Создание шаблона из готовых фото (python -m photo_pipeline learn [папка])
+LEARN_BOX = (100, 100)         # Зона знака в правом нижнем углу (px на эталонном размере), как старая маска
+LEARN_MIN_PHOTOS = 5           # Меньше фото — фон не усредняется, шаблон выйдет грязным
+
+# ==========================================
+
+
+def edges(gray):
+    """Карта перепадов яркости: знак узнается по контуру, а не по цвету фона под ним"""
+    gray = gray.astype(np.float32)
+    return cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3), cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3))
+
+
+class WatermarkProfile:
+    """Один известный знак: форма (альфа шаблона) и ее контур для поиска"""
+
+    def __init__(self, name, alpha):
+        self.name = name
+        self.alpha = alpha  # uint8 [H, W] на эталонном размере
+
+    def scaled(self, scale):
+        """(альфа, контур) шаблона под нужный масштаб"""
+        height, width = self.alpha.shape
+        size = (max(3, round(width * scale)), max(3, round(height * scale)))
+        alpha = cv2.resize(self.alpha, size, interpolation=cv2.INTER_AREA)
+        return alpha, edges(alpha)
+
+
+def load_profiles(folder=WATERMARK_DIR):
+    """Все шаблоны из папки (PNG с прозрачностью); без альфа-канала шаблон не годится"""
+    profiles = []
+    for path in sorted(Path(folder).glob("*.png")):
+        with Image.open(path) as img:
+            if "A" not in img.getbands():
+                print(f"   ⚠️  Шаблон {path.name} без прозрачности, пропускаем")
+                continue
+            alpha = np.asarray(img.getchannel("A"))
+        profiles.append(WatermarkProfile(path.stem, alpha.copy()))
+    return profiles
+
+
+class WatermarkDetector:
+    """
+    Поиск вотермарки на фото (OpenCV, несколько мс на фото):
+    1. Берем только угол фото, где живет знак, в оттенках серого.
+    2. Сравниваем карту перепадов с контуром каждого шаблона (matchTemplate) на паре масштабов.
+    3. Лучшее совпадение выше порога → маска точно по форме знака, под реальный размер фото.
+    Нет совпадения — вотермарки нет, фото можно не чистить.
+    """
+
+    def __init__(self, profiles, threshold=DETECT_THRESHOLD, search=SEARCH_FRACTION, scales=SCALE_STEPS, dilate=MASK_DILATE):
+        self.profiles = profiles
+        self.threshold = threshold
+        self.search = search
+        self.scales = scales
+        self.dilate = dilate
+        self._scaled = {}  # (шаблон, масштаб) → (альфа, контур): фото одного размера не пересчитывают шаблон
+
+    def fingerprint(self):
+        """Отпечаток шаблонов и настроек (для журнала задач)"""
+        digest = hashlib.sha256()
+        for profile in self.profiles:
+            digest.update(profile.name.encode())
+            digest.update(profile.alpha.tobytes())
+        return f"{digest.hexdigest()[:16]}:{self.threshold}:{self.search}:{self.scales}:{self.dilate}"
+
+    def template(self, profile_index, scale):
+        key = (profile_index, round(scale, 3))
+        if key not in self._scaled:
+            self._scaled[key] = self.profiles[profile_index].scaled(scale)
+        return self._scaled[key]
+
+    def detect(self, image):
+        """
+        Ищет знак на PIL картинке.
+        Возвращает (оценка, (x, y), альфа шаблона) лучшего совпадения выше порога или None.
+        """
+        width, height = image.size
+        left, top = round(width * (1 - self.search)), round(height * (1 - self.search))
+        gray = np.asarray(image.crop((left, top, width, height)).convert("L"))
+        base = min(width / REFERENCE_W, height / REFERENCE_H)
+        # Большие фото ищем в углу, уменьшенном до эталонного масштаба: время не растет с разрешением
+        shrink = max(base, 1.0)
+        if shrink > 1:
+            gray = cv2.resize(gray, (round(gray.shape[1] / shrink), round(gray.shape[0] / shrink)), interpolation=cv2.INTER_AREA)
+        region = edges(gray)
+
+        best = None
+        for i in range(len(self.profiles)):
+            for step in self.scales:
+                _, contour = self.template(i, base / shrink * step)
+                if contour.shape[0] > region.shape[0] or contour.shape[1] > region.shape[1]:
+                    continue
+                scores = cv2.matchTemplate(region, contour, cv2.TM_CCOEFF_NORMED)
+                # Однотонный угол дает деление на ноль — такие места просто не совпадение
+                scores = np.nan_to_num(scores, nan=0.0, posinf=0.0, neginf=0.0)
+                _, score, _, (x, y) = cv2.minMaxLoc(scores)
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, (left + round(x * shrink), top + round(y * shrink)), i, step)
+
+        if best is None:
+            return None
+        score, position, i, step = best
+        alpha, _ = self.template(i, base * step)  # Форма знака в полном размере фото — для маски
+        return score, position, alpha
+
+    def mask_for(self, image):
+        """Маска размера фото (L, белое = удалить) или None, если вотермарки нет"""
+        found = self.detect(image)
+        if found is None:
+            return None
+
+        _, (x, y), alpha = found
+        shape = (alpha >= ALPHA_MIN).astype(np.uint8) * 255
+        radius = max(1, round(self.dilate * min(image.width / REFERENCE_W, image.height / REFERENCE_H)))
+        # Расширяем форму с запасом по краям, затем обрезаем по границам кадра
+        shape = cv2.dilate(np.pad(shape, radius), cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1)))
+
+        mask = np.zeros((image.height, image.width), dtype=np.uint8)
+        x1, y1 = x - radius, y - radius
+        x2, y2 = x1 + shape.shape[1], y1 + shape.shape[0]
+        cx1, cy1 = max(0, x1), max(0, y1)
+        cx2, cy2 = min(image.width, x2), min(image.height, y2)
+        mask[cy1:cy2, cx1:cx2] = shape[cy1 - y1:cy2 - y1, cx1 - x1:cx2 - x1]
+        return Image.fromarray(mask, "L")
+
+
+def load_detector(folder=WATERMARK_DIR, threshold=DETECT_THRESHOLD):
+    """Детектор по шаблонам из папки; None, если шаблонов нет (тогда работает фиксированная маска)"""
+    profiles = load_profiles(folder)
+    if not profiles:
+        return None
+    return WatermarkDetector(profiles, threshold)
+
+
+def learn_profile(img_paths, box=LEARN_BOX):
+    """
+    Шаблон знака из нескольких фото с ним:
+    1. Вырезаем угол box (в масштабе каждого фото) и приводим к эталонному размеру.
+    2. Медиана по фото: разный фон усредняется, одинаковый знак остается.
+    3. Где медиана светлее (или темнее) своей размытой версии — там знак; берем самое крупное пятно.
+    """
+    box_w, box_h = box
+    crops = []
+    for img_path in img_paths:
+        with Image.open(img_path) as img:
+            scale = min(img.width / REFERENCE_W, img.height / REFERENCE_H)
+            w, h = round(box_w * scale), round(box_h * scale)
+            crop = img.crop((img.width - w, img.height - h, img.width, img.height)).convert("L")
+            crops.append(np.asarray(crop.resize((box_w, box_h), Image.Resampling.LANCZOS), dtype=np.float32))
+
+    median = np.median(np.stack(crops), axis=0)
+    detail = median - cv2.GaussianBlur(median, (0, 0), max(box_w, box_h) / 8)
+    if -detail.min() > detail.max():
+        detail = -detail  # Темный знак на светлом
+    binary = (detail >= detail.max() * 0.4).astype(np.uint8)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+
+    # Остатки фона — мелкие пятна; знак — самое крупное
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary)
+    alpha = np.zeros_like(binary)
+    if count > 1:
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        contours, _ = cv2.findContours((labels == largest).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(alpha, contours, -1, 255, cv2.FILLED)
+
+    rgba = Image.fromarray(np.dstack([median.astype(np.uint8)] * 3 + [alpha]), "RGBA")
+    # Обрезаем по самому знаку (с небольшим полем, чтобы контур не упирался в край шаблона)
+    bbox = rgba.getchannel("A").getbbox()
+    if bbox is None:
+        return rgba
+    margin = 4
+    return rgba.crop((max(0, bbox[0] - margin), max(0, bbox[1] - margin), min(box_w, bbox[2] + margin), min(box_h, bbox[3] + margin)))
+
+
+def learn_from_folder(folder="input"):
+    """Шаблон из фото с вотермаркой в папке → WATERMARK_DIR/learned.png и проверка, на скольких фото он находится"""
+    from .inpaint_engine import list_images
+
+    images = list_images(folder)
+    if len(images) < LEARN_MIN_PHOTOS:
+        print(f"⚠️  Нужно хотя бы {LEARN_MIN_PHOTOS} фото с вотермаркой в '{folder}' (сейчас {len(images)})")
+        return None
+
+    Path(WATERMARK_DIR).mkdir(exist_ok=True)
+    template_path = Path(WATERMARK_DIR) / "learned.png"
+    learn_profile(images).save(template_path)
+    print(f"✅ Шаблон сохранен: {template_path} (из {len(images)} фото)")
+
+    # Сразу проверяем, на скольких фото он находится
+    detector = load_detector()
+    found = 0
+    for img_path in images:
+        with Image.open(img_path) as img:
+            found += detector.detect(img) is not None
+    print(f"🔎 Вотермарка найдена на {found}/{len(images)} фото (порог {DETECT_THRESHOLD})")
+    return template_path
+
+
+if __name__ == "__main__":
+    if learn_from_folder(sys.argv[1] if len(sys.argv) > 1 else "input") is None:
+        sys.exit(1)
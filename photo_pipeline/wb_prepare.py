@@ -0,0 +1,220 @@
+import io
+import os
+import math
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from . import pipeline_metrics
+from .jpeg_budget import JpegBudget
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+TARGET_W, TARGET_H = 900, 1200  # Размер WB (для python -m photo_pipeline wb без --size)
+QUALITY = 95                   # Качество JPG
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")  # Что берем из папки
+WB_WORKERS = 0                 # Процессы для подготовки WB (0 = все ядра)
+WB_CHUNKSIZE = 4               # Сколько фото отдаем процессу за раз (меньше накладных расходов)
+
+# Быстрый путь для больших фото (4K после апскейла → 900x1200)
+DRAFT_MARGIN = 2.0             # JPEG декодируем уменьшенным, но не меньше чем в 2 раза больше итогового размера
+REDUCING_GAP = 3.0             # Сначала дешевый reduce() в целое число раз, LANCZOS — на последние ≤3x (None = только LANCZOS)
+
+# ==========================================
+
+
+def open_source(img_path, data=None):
+    """
+    (что отдать в Image.open, размер в байтах): файл img_path на диске или data из памяти —
+    байты (загрузка в HTTP сервис) либо файловый объект (скачанный результат, safe_download.aspool_stream)
+    """
+    if data is None:
+        return img_path, Path(img_path).stat().st_size
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data), len(data)
+    return data, data.seek(0, io.SEEK_END)  # Image.open сам вернется в начало
+
+
+def crop_box(width, height, target_width, target_height):
+    """Область по центру с пропорциями цели (Center Crop): (left, top, right, bottom) в пикселях фото"""
+    img_ratio = width / height
+    target_ratio = target_width / target_height
+
+    if img_ratio > target_ratio:
+        # Картинка шире, чем нужно (лишнее режем слева и справа)
+        crop_width = height * target_ratio
+        left = (width - crop_width) / 2
+        return (left, 0, left + crop_width, height)
+    # Картинка выше, чем нужно (лишнее режем сверху и снизу)
+    crop_height = width / target_ratio
+    top = (height - crop_height) / 2
+    return (0, top, width, top + crop_height)
+
+
+def resize_and_crop(img, target_width, target_height):
+    """
+    Умный ресайз:
+    1. Выбирает по центру область с пропорциями цели (Center Crop).
+    2. Масштабирует только эту область точно в целевой размер.
+    Для больших фото сначала идет дешевый reduce() в целое число раз, затем LANCZOS.
+    """
+    box = crop_box(img.width, img.height, target_width, target_height)
+    # Ресайз (LANCZOS - лучшее качество для уменьшения), отрезанные края не фильтруем вовсе
+    return img.resize((target_width, target_height), Image.Resampling.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+
+
+def draft_size(img, target_w, target_h):
+    """Размер, который просим у декодера JPEG под цель (с запасом DRAFT_MARGIN), или None — декодируем целиком"""
+    if img.format != "JPEG" or not DRAFT_MARGIN:
+        return None
+
+    scale = max(target_w / img.width, target_h / img.height) * DRAFT_MARGIN
+    if scale >= 0.5:
+        return None  # Фото и так почти нужного размера
+
+    return math.ceil(img.width * scale), math.ceil(img.height * scale)
+
+
+def draft_for_target(img, target_w, target_h):
+    """
+    JPEG: просим декодер сразу отдать картинку в 2/4/8 раз меньше (scaled decoding).
+    Оставляем запас DRAFT_MARGIN, чтобы финальный LANCZOS дал то же качество.
+    Вызывать до первого обращения к пикселям.
+    """
+    size = draft_size(img, target_w, target_h)
+    if size:
+        img.draft("RGB", size)
+
+
+def flatten_to_rgb(img):
+    """RGB без прозрачности: прозрачные области заливаем белым"""
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        # LA и палитра с прозрачностью — через RGBA: у них альфа не 3 канал
+        rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return img.convert("RGB")
+
+
+def render_wb(img, target_w, target_h, img_path=None):
+    """Картинка → кадр для WB: RGB без прозрачности, кроп по центру, ровно target_w x target_h"""
+    with pipeline_metrics.span("flatten", img_path):
+        rgb = flatten_to_rgb(img)
+    with pipeline_metrics.span("resize", img_path):
+        return resize_and_crop(rgb, target_w, target_h)
+
+
+def encode_wb(img, target_w, target_h, quality, img_path=None, budget=None):
+    """Картинка из памяти → байты JPG для WB, без файлов (HTTP сервис); budget — подбор качества (JpegBudget)"""
+    final_img = render_wb(img, target_w, target_h, img_path)
+    jpeg, _ = (budget or JpegBudget()).encode(final_img, quality, img_path)
+    pipeline_metrics.add("bytes_out", len(jpeg))
+    return jpeg
+
+
+def prepare_image(img_path, wb_dir, target_w, target_h, quality, data=None, budget=None, extra=()):
+    """
+    Ресайз + кроп + JPG одного фото. Возвращает путь к готовому файлу.
+    data — байты или файловый объект с картинкой (файла img_path на диске тогда нет, берется только имя).
+    budget — подбор качества под размер / порог SSIM (JpegBudget): ищется в памяти, на диск — один раз.
+    extra — еще размеры и форматы (renditions.Rendition) из того же декодирования.
+    """
+    if extra:
+        from .renditions import Rendition, render_file
+
+        wb = Rendition("wb", target_w, target_h, "crop", "jpg", quality, budget, str(wb_dir))
+        return render_file(img_path, extra, data, wb)[0]
+
+    img_path = Path(img_path)
+    source, size_in = open_source(img_path, data)
+    with Image.open(source) as img:
+        with pipeline_metrics.span("decode", img_path, bytes_in=size_in):
+            draft_for_target(img, target_w, target_h)
+            img.load()
+        final_img = render_wb(img, target_w, target_h, img_path)
+
+        jpeg, _ = (budget or JpegBudget()).encode(final_img, quality, img_path)
+
+    # Меняем расширение на .jpg
+    save_path = Path(wb_dir) / f"{img_path.stem}.jpg"
+    save_path.write_bytes(jpeg)
+    pipeline_metrics.add("bytes_in", size_in)
+    pipeline_metrics.add("bytes_out", len(jpeg))
+    return save_path
+
+
+def prepare_task(img_path, wb_dir, target_w, target_h, quality, budget=None, extra=()):
+    """
+    Задача для пула: ошибки не пробрасываем, а возвращаем вместе с результатом
+    (и с замерами из процесса пула — их добавит главный процесс)
+    """
+    with pipeline_metrics.capture() as events:
+        try:
+            save_path = prepare_image(img_path, wb_dir, target_w, target_h, quality, budget=budget, extra=extra)
+            result = save_path, save_path.stat().st_size, None
+        except Exception as e:
+            result = None, 0, str(e)
+    return (*result, events)
+
+
+def collect_images(paths):
+    """Файлы и папки → список фото (из папок — только IMAGE_EXTENSIONS, без системных файлов)"""
+    images = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            images.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS and not p.name.startswith(".")))
+        else:
+            images.append(path)
+    return images
+
+
+def worker_count(workers=WB_WORKERS):
+    """Сколько процессов реально запускать (0 = все ядра)"""
+    return workers or os.cpu_count() or 1
+
+
+def prepare_for_wb_parallel(images, wb_dir, target_w, target_h, quality, workers=WB_WORKERS, chunksize=WB_CHUNKSIZE, budget=None, extra=()):
+    """
+    Подготовка пачки фото для WB на всех ядрах:
+    1. Декод, LANCZOS и JPG(optimize; с budget — подбор качества) идут в пуле процессов;
+       extra — еще размеры из того же декодирования (renditions.py).
+    2. Результаты приходят в исходном порядке, прогресс печатает только главный процесс.
+    3. Ошибки собираются в список и выводятся одним блоком в конце.
+    Возвращает ([(исходник, готовый JPG), ...], [(имя файла, ошибка), ...]).
+    """
+    images = list(images)
+    total = len(images)
+    workers = min(worker_count(workers), total) or 1
+    task = partial(prepare_task, wb_dir=wb_dir, target_w=target_w, target_h=target_h, quality=quality, budget=budget, extra=extra)
+
+    done, errors = [], []
+
+    def report(i, img_path, result):
+        save_path, size, error, events = result
+        pipeline_metrics.merge(events)
+        if error:
+            errors.append((img_path.name, error))
+            print(f"[{i}/{total}] ❌ {img_path.name}")
+            return
+        done.append((img_path, save_path))
+        print(f"[{i}/{total}] {img_path.name} ✅ OK ({size / (1024 * 1024):.2f} MB)")
+
+    if workers == 1:
+        # Один процесс — не тратим время на запуск пула
+        for i, img_path in enumerate(images, 1):
+            report(i, img_path, task(img_path))
+    else:
+        print(f"   ⚙️  Процессов: {workers}, пачка: {chunksize}")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, (img_path, result) in enumerate(zip(images, pool.map(task, images, chunksize=chunksize)), 1):
+                report(i, img_path, result)
+
+    if errors:
+        print(f"\n⚠️  Ошибки ({len(errors)}):")
+        for name, error in errors:
+            print(f"   ❌ {name}: {error}")
+
+    return done, errors
@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+
+# ==========================================
+# ⚙️ НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ==========================================
+
+LEASE_SECONDS = 300            # Аренда без продления протухает, фото забирает другая машина (с запасом на кэш атрибутов NFS)
+RENEW_FRACTION = 0.25          # Продлеваем каждые LEASE_SECONDS * 0.25
+WAIT_POLL_SECONDS = 1          # В конце списка: как часто смотреть на фото, которые еще держат другие машины
+
+# ==========================================
+
+MASTER_DIR = "final_upscaled"  # Папка апскейлов (у пайплайна — FINAL_DIR)
+MASTER_PREFIX = "upscaled_"    # Апскейл лежит там как upscaled_{имя}: доля и аренда считаются по исходному имени
+
+
+def parse_shard(text):
+    """"1/4" → (0, 4): номера с единицы, как их удобно писать на машинах; ошибка — ValueError"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except (ValueError, AttributeError):
+        raise ValueError(f"доля в виде i/n, например 1/4, а не '{text}'")
+    if not 1 <= index <= count:
+        raise ValueError(f"доля {text}: нужно 1 ≤ i ≤ n")
+    return index - 1, count
+
+
+def source_stem(path, master_dir=MASTER_DIR):
+    """
+    Имя исходного фото для файла любого шага: input/a.jpg, output/a.png, final_upscaled/upscaled_a.png → a.
+    Приставку снимаем только у файлов из master_dir: исходник input/upscaled_a.jpg так и остается upscaled_a
+    """
+    path = Path(path)
+    stem = path.stem
+    if stem.startswith(MASTER_PREFIX) and path.parent.resolve() == Path(master_dir).resolve():
+        return stem[len(MASTER_PREFIX):]
+    return stem
+
+
+def in_shard(path, shard, master_dir=MASTER_DIR):
+    """Фото в доле (i, n)? crc32 имени — одинаково на всех машинах и во всех шагах (в отличие от hash())"""
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(source_stem(path, master_dir).encode("utf-8")) % count == index
+
+
+def node_id():
+    """Имя этой машины в аренде"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def rotated(images, node):
+    """
+    Свой порядок обхода на каждой машине: список сдвинут на crc32(имени машины).
+    Машины начинают с разных мест и реже спорят за одно и то же фото
+    """
+    images = list(images)
+    if not images:
+        return images
+    start = zlib.crc32(node.encode("utf-8")) % len(images)
+    return images[start:] + images[:start]
+
+
+def version(img_path):
+    """Версия фото: [размер, mtime] — поменялся файл, значит готовое надо переделать"""
+    stat = Path(img_path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Leases:
+    """
+    Общее для обоих способов аренды: какие фото держит эта машина (имя → версия при захвате)
+    и фоновое продление, пока конвейер работает.
+    """
+
+    kind = ""
+
+    def __init__(self, node=None, ttl=LEASE_SECONDS, master_dir=MASTER_DIR):
+        self.node = node or node_id()
+        self.ttl = ttl
+        self.master_dir = master_dir
+        self.held = {}
+        self.lock = threading.Lock()
+        self.claimed = 0
+        self.lost = 0
+
+    def claim(self, img_path):
+        """Берем фото в работу; False — оно уже готово, его держит другая машина или файла больше нет"""
+        name = source_stem(img_path, self.master_dir)
+        try:
+            current = version(img_path)
+        except FileNotFoundError:
+            return False
+        if self.is_done(name, current) or not self.acquire(name, current):
+            return False
+        with self.lock:
+            self.held[name] = current
+            self.claimed += 1
+        return True
+
+    def done(self, img_path):
+        """Фото этой версии уже готово (или удалено) — ждать его нечего"""
+        try:
+            return self.is_done(source_stem(img_path, self.master_dir), version(img_path))
+        except FileNotFoundError:
+            return True
+
+    def release(self, img_path, done=True):
+        """Фото закончено (путь любого шага): done — "готово" для всех машин, иначе аренда просто снимается"""
+        name = source_stem(img_path, self.master_dir)
+        with self.lock:
+            current = self.held.pop(name, None)
+        if current is not None:
+            self.finish(name, current if done else None)
+
+    def renew(self):
+        """Продление всех своих аренд; потерянные (их забрали, пока мы висели) перестаем держать"""
+        with self.lock:
+            held = list(self.held)
+        for name in self.extend(held):
+            print(f"   ⚠️  Аренду {name} забрала другая машина (продление опоздало)")
+            with self.lock:
+                self.held.pop(name, None)
+                self.lost += 1
+
+    async def keep_alive(self):
+        """Задача asyncio: продлевает аренды, пока ее не отменят"""
+        while True:
+            await asyncio.sleep(self.ttl * RENEW_FRACTION)
+            await asyncio.to_thread(self.renew)
+
+    def close(self):
+        """Выход: недоделанные фото отпускаем сразу, не дожидаясь ttl"""
+        with self.lock:
+            held, self.held = list(self.held), {}
+        for name in held:
+            self.finish(name, None)
+
+    def status(self):
+        return f"{self.kind}, машина {self.node}: взято {self.claimed}, потеряно {self.lost}"
+
+
+class FileLeases(Leases):
+    """
+    Аренда через файлы в общей папке (NFS / SMB), без сервера:
+    1. Захват — создание {имя}.lease с O_EXCL: из нескольких машин файл создаст только одна.
+    2. Пока фото в работе, аренда продлевается (mtime файла); не продленная дольше ttl — протухла.
+    3. Протухшую аренду (машина умерла) забирает тот, кто первым ее переименовал: rename атомарен.
+    4. Готовое фото — {имя}.done с версией фото: его не берет никто, пока файл не поменяется.
+    """
+
+    kind = "файлы аренды"
+
+    def __init__(self, folder, node=None, ttl=LEASE_SECONDS, master_dir=MASTER_DIR):
+        super().__init__(node, ttl, master_dir)
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.tag = self.node.replace(":", "_").replace("/", "_")
+
+    def lease_path(self, name):
+        return self.folder / f"{name}.lease"
+
+    def done_path(self, name):
+        return self.folder / f"{name}.done"
+
+    def expired(self, path):
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return True
+
+    def create(self, path):
+        """Новый файл аренды (O_EXCL); False — его уже кто-то создал"""
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"node": self.node, "since": time.time()}, f)
+        return True
+
+    def steal(self, path):
+        """Забираем протухшую аренду: переименовать ее удастся только одной машине"""
+        stale = path.with_name(f".{path.name}.{self.tag}.stale")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False  # Кто-то успел раньше
+        if not self.expired(stale):
+            # Между проверкой и rename аренду уже оформила другая машина — возвращаем ее на место
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        return self.create(path)
+
+    def is_done(self, name, current):
+        try:
+            return json.loads(self.done_path(name).read_text(encoding="utf-8")).get("version") == current
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def acquire(self, name, current):
+        path = self.lease_path(name)
+        if not (self.create(path) or (self.expired(path) and self.steal(path))):
+            return False
+        if self.is_done(name, current):
+            # Другая машина доделала фото между проверкой и захватом
+            path.unlink()
+            return False
+        return True
+
+    def extend(self, names):
+        lost = []
+        for name in names:
+            path = self.lease_path(name)
+            try:
+                if json.loads(path.read_text(encoding="utf-8")).get("node") == self.node:
+                    os.utime(path)
+                    continue
+            except (FileNotFoundError, ValueError):
+                pass
+            lost.append(name)
+        return lost
+
+    def finish(self, name, done_version):
+        if done_version is not None:
+            marker = self.done_path(name)
+            tmp = marker.with_name(f".{marker.name}.{self.tag}.tmp")
+            tmp.write_text(json.dumps({"node": self.node, "version": done_version}), encoding="utf-8")
+            os.replace(tmp, marker)
+        try:
+            self.lease_path(name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SqliteLeases(Leases):
+    """
+    Аренда через общую базу SQLite (одна таблица, без сервера):
+    захват, продление и отметка "готово" — короткие транзакции BEGIN IMMEDIATE.
+    Для общего диска с рабочими блокировками (локальный диск, SMB); на NFS надежнее FileLeases.
+    """
+
+    kind = "SQLite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS leases (
+        image    TEXT PRIMARY KEY,
+        node     TEXT NOT NULL,
+        status   TEXT NOT NULL,      -- running / done
+        version  TEXT NOT NULL,      -- [размер, mtime] фото при захвате
+        expires  REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path, node=None, ttl=LEASE_SECONDS, master_dir=MASTER_DIR):
+        super().__init__(node, ttl, master_dir)
+        self.db_path = Path(db_path)
+        # Без WAL: он требует общей памяти и не работает между машинами
+        self.db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db_lock = threading.Lock()
+        self.db.executescript(self.SCHEMA)
+
+    def transaction(self, call):
+        with self.db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = call()
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return result
+
+    def is_done(self, name, current):
+        with self.db_lock:
+            row = self.db.execute("SELECT version FROM leases WHERE image = ? AND status = 'done'", (name,)).fetchone()
+        return row is not None and row[0] == json.dumps(current)
+
+    def acquire(self, name, current):
+        now = time.time()
+        current = json.dumps(current)
+
+        def claim():
+            # Повторная проверка внутри транзакции: между is_done и BEGIN фото могли доделать
+            row = self.db.execute("SELECT status, version, expires FROM leases WHERE image = ?", (name,)).fetchone()
+            if row is not None:
+                status, old_version, expires = row
+                if status == "done" and old_version == current:
+                    return False
+                if status == "running" and expires > now:
+                    return False
+            self.db.execute(
+                "INSERT OR REPLACE INTO leases (image, node, status, version, expires) VALUES (?, ?, 'running', ?, ?)",
+                (name, self.node, current, now + self.ttl),
+            )
+            return True
+
+        return self.transaction(claim)
+
+    def extend(self, names):
+        def update():
+            lost = []
+            for name in names:
+                cursor = self.db.execute(
+                    "UPDATE leases SET expires = ? WHERE image = ? AND node = ? AND status = 'running'",
+                    (time.time() + self.ttl, name, self.node),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(name)
+            return lost
+
+        return self.transaction(update) if names else []
+
+    def finish(self, name, done_version):
+        def update():
+            if done_version is not None:
+                self.db.execute(
+                    "UPDATE leases SET status = 'done', version = ? WHERE image = ? AND node = ?",
+                    (json.dumps(done_version), name, self.node),
+                )
+            else:
+                self.db.execute("DELETE FROM leases WHERE image = ? AND node = ? AND status = 'running'", (name, self.node))
+
+        self.transaction(update)
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+def open_leases(path, node=None, ttl=LEASE_SECONDS, master_dir=MASTER_DIR):
+    """*.sqlite3 / *.sqlite / *.db — общая база, иначе папка с файлами аренды; master_dir — папка апскейлов"""
+    if Path(path).suffix.lower() in (".sqlite3", ".sqlite", ".db"):
+        return SqliteLeases(path, node, ttl, master_dir)
+    return FileLeases(path, node, ttl, master_dir)
+
+
+async def claimed(images, leases, wait=False):
+    """
+    Асинхронный поток фото, которые эта машина смогла взять в аренду.
+    Захват — только когда конвейер готов к следующему фото, поэтому работа делится между машинами
+    по их реальной скорости, а не поровну заранее.
+    wait — в конце не выходим, пока фото у других машин не готовы: аренду упавшей машины заберем,
+    когда она протухнет. Каждое фото эта машина берет не больше одного раза (битое не ходит по кругу)
+    """
+    busy = []
+    async for img_path in images:
+        if await asyncio.to_thread(leases.claim, img_path):
+            yield img_path
+        elif wait:
+            busy.append(img_path)
+
+    busy = [img_path for img_path in busy if not await asyncio.to_thread(leases.done, img_path)]
+    if busy:
+        print(f"   ⏳ {len(busy)} фото в работе у других машин: ждем, аренду упавшей заберем через {leases.ttl} сек")
+    while busy:
+        await asyncio.sleep(WAIT_POLL_SECONDS)
+        waiting = []
+        for img_path in busy:
+            if await asyncio.to_thread(leases.claim, img_path):
+                print(f"   🔁 {img_path.name}: аренда свободна (машина упала или не справилась) — берем")
+                yield img_path
+            elif not await asyncio.to_thread(leases.done, img_path):
+                waiting.append(img_path)
+        busy = waiting
+
+
+async def listed(images):
+    """Обычный список как асинхронный поток (для claimed)"""
+    for img_path in images:
+        yield img_path
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Тесты запускаются из корня репозитория: python -m pytest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def textured(width, height, seed=0):
+    """Воспроизводимая картинка с деталями (шум, растянутый бикубиком): JPG на ней сжимается как фото"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (max(height // 30, 2), max(width // 30, 2), 3), dtype=np.uint8)
+    return Image.fromarray(base).resize((width, height), Image.BICUBIC)
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """Фабрика фото на диске: photo("a.jpg", 800, 600)"""
+    def make(name, width=120, height=160, seed=0, **save_args):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        textured(width, height, seed).save(path, **save_args)
+        return path
+    return make
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from photo_pipeline import adaptive_limiter
+from photo_pipeline.adaptive_limiter import AdaptiveLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic лимита: clock.now += 5"""
+    class Clock:
+        now = 1000.0
+    monkeypatch.setattr(adaptive_limiter.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def test_start_is_clamped_to_bounds():
+    assert AdaptiveLimiter(start=100, max_limit=8).current == 8
+    assert AdaptiveLimiter(start=0, min_limit=2).current == 2
+
+
+def test_success_grows_about_one_slot_per_window():
+    limiter = AdaptiveLimiter(start=4)
+    for _ in range(4):
+        limiter.update(0.1, True, False)
+    assert 4.8 < limiter.limit < 5.0 + 1e-9
+
+
+def test_growth_stops_at_max():
+    limiter = AdaptiveLimiter(start=3, max_limit=4)
+    for _ in range(100):
+        limiter.update(0.1, True, False)
+    assert limiter.limit == 4
+
+
+def test_throttle_halves_at_most_once_per_window(clock):
+    limiter = AdaptiveLimiter(start=16)
+    limiter.update(None, False, True)
+    assert limiter.limit == 8
+    limiter.update(None, False, True)  # Та же волна 429
+    assert limiter.limit == 8
+    clock.now += 1.5
+    limiter.update(None, False, True)
+    assert limiter.limit == 4
+    assert limiter.throttled == 3
+
+
+def test_decrease_stops_at_min(clock):
+    limiter = AdaptiveLimiter(start=4, min_limit=3)
+    for _ in range(5):
+        clock.now += 10
+        limiter.update(None, False, True)
+    assert limiter.limit == 3
+
+
+def test_no_growth_while_latency_is_high():
+    limiter = AdaptiveLimiter(start=4)
+    limiter.update(0.1, True, False)
+    before = limiter.limit
+    for _ in range(10):
+        limiter.update(5.0, True, False)  # Средняя быстро уходит выше 2 x лучшей
+    assert limiter.limit == before
+
+
+def test_frequent_errors_decrease(clock):
+    limiter = AdaptiveLimiter(start=8)
+    limiter.update(None, False, False)  # Одна ошибка: доля 0.2 — еще не порог
+    assert limiter.limit == 8
+    limiter.update(None, False, False)
+    assert limiter.limit == 4
+
+
+def test_acquire_waits_for_a_free_slot():
+    async def scenario():
+        limiter = AdaptiveLimiter(start=2, max_limit=2)
+        await limiter.acquire()
+        await limiter.acquire()
+        third = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        await limiter.release(0.1)
+        await asyncio.wait_for(third, 1)
+        assert limiter.in_flight == 2
+
+    asyncio.run(scenario())
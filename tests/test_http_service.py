@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from photo_pipeline.http_service import JobQueue, create_app  # noqa: E402
+
+
+class FakeProcessor:
+    """Вместо моделей: каждое фото ждет, пока тест не отпустит release"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def status(self):
+        return {}
+
+    async def process(self, data, name, target=None, quality=None, upscale=True, max_kb=None):
+        self.started += 1
+        await self.release.wait()
+        return b"jpeg:" + data, "resample", False
+
+
+def test_full_queue_answers_503_with_retry_after():
+    async def scenario():
+        processor = FakeProcessor()
+        app = create_app(processor, max_jobs=1, max_queue=1)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as client:
+            def post(body):
+                return client.post("/process", content=body, headers={"content-type": "image/jpeg"})
+
+            first, second = asyncio.create_task(post(b"1")), asyncio.create_task(post(b"2"))
+            while processor.started < 1:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)  # Второй запрос встал в очередь за слотом
+
+            queue = (await client.get("/queue")).json()
+            assert (queue["running"], queue["waiting"], queue["accepting"]) == (1, 1, False)
+
+            rejected = await post(b"3")
+            assert rejected.status_code == 503
+            assert int(rejected.headers["retry-after"]) >= 1
+            assert processor.started == 1  # Отказ — без обработки
+
+            processor.release.set()
+            responses = await asyncio.gather(first, second)
+            assert [r.status_code for r in responses] == [200, 200]
+            assert sorted(r.content for r in responses) == [b"jpeg:1", b"jpeg:2"]
+
+            queue = (await client.get("/queue")).json()
+            assert (queue["done"], queue["rejected"], queue["accepting"]) == (2, 1, True)
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_grows_with_the_queue():
+    queue = JobQueue(max_jobs=2, max_queue=4)
+    queue.job_seconds = 10.0
+    assert queue.retry_after() == 5
+    queue.admitted = 6  # Двое в работе, четверо ждут
+    queue.running = 2
+    assert queue.full()
+    assert queue.retry_after() == 25
+
+
+def test_rejects_empty_and_half_given_size():
+    async def scenario():
+        app = create_app(FakeProcessor())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as client:
+            assert (await client.post("/process", content=b"")).status_code == 400
+            assert (await client.post("/process?width=10", content=b"x")).status_code == 400
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import sqlite3
+
+from photo_pipeline import job_ledger
+
+
+def test_fingerprint_ignores_argument_order():
+    assert job_ledger.fingerprint(a=1, b=(2, 3)) == job_ledger.fingerprint(b=(2, 3), a=1)
+    assert job_ledger.fingerprint(a=1) != job_ledger.fingerprint(a=2)
+
+
+def test_done_step_is_skipped_until_input_params_or_output_change(tmp_path, photo):
+    src, out = photo("a.png"), tmp_path / "out.png"
+    ledger = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    assert ledger.pending(src, "wb", "p1", out)
+
+    ledger.start(src, "wb", "p1")
+    out.write_bytes(b"result")
+    ledger.finish(src, "wb", out)
+    assert not ledger.pending(src, "wb", "p1", out)
+    assert ledger.pending(src, "wb", "p2", out)  # Другие настройки
+
+    out.unlink()
+    assert ledger.pending(src, "wb", "p1", out)  # Результат пропал
+    out.write_bytes(b"result")
+
+    photo("a.png", seed=1)  # Тот же файл, другое содержимое
+    assert ledger.pending(src, "wb", "p1", out)
+
+
+def test_failed_step_is_retried(tmp_path, photo):
+    src, out = photo("a.png"), tmp_path / "out.png"
+    ledger = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    ledger.start(src, "wb", "p")
+    ledger.fail(src, "wb", "boom")
+    out.write_bytes(b"stale")
+    assert ledger.pending(src, "wb", "p", out)
+    assert ledger.summary() == {"wb": {"failed": 1}}
+
+
+def test_running_step_of_crashed_run_removes_partial_output(tmp_path, photo):
+    src, out = photo("a.png"), tmp_path / "out.png"
+    crashed = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    crashed.start(src, "wb", "p")
+    out.write_bytes(b"partial")
+    crashed.close()
+
+    ledger = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    assert not ledger.busy(src, "wb")
+    assert ledger.pending(src, "wb", "p", out)
+    assert not out.exists()
+
+
+def test_running_step_of_this_run_is_left_alone(tmp_path, photo):
+    """watch увидел файл еще раз, пока первый заход пишет результат: результат не трогаем"""
+    src, out = photo("a.png"), tmp_path / "out.png"
+    ledger = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    ledger.start(src, "wb", "p")
+    out.write_bytes(b"being written")
+    assert ledger.busy(src, "wb")
+    assert not ledger.pending(src, "wb", "p", out)
+    assert out.read_bytes() == b"being written"
+
+
+def test_ledger_without_run_id_column_is_upgraded(tmp_path, photo):
+    src, out = photo("a.png"), tmp_path / "out.png"
+    db_path = tmp_path / "old.sqlite3"
+    db = sqlite3.connect(db_path)
+    db.executescript(
+        "CREATE TABLE jobs (image TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, input_digest TEXT, "
+        "params TEXT, output TEXT, error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (image, stage));"
+    )
+    db.execute("INSERT INTO jobs VALUES (?, 'wb', 'running', 'x', 'p', NULL, NULL, 0)", (str(src),))
+    db.commit()
+    db.close()
+    out.write_bytes(b"partial")
+
+    ledger = job_ledger.JobLedger(db_path)
+    assert ledger.pending(src, "wb", "p", out)
+    assert not out.exists()
+
+
+def test_digest_is_cached_by_size_and_mtime(tmp_path, photo, monkeypatch):
+    src = photo("a.png")
+    ledger = job_ledger.JobLedger(tmp_path / "ledger.sqlite3")
+    first = ledger.digest(src)
+    monkeypatch.setattr(job_ledger, "file_digest", lambda path: "recomputed")
+    assert ledger.digest(src) == first
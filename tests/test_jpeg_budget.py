@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import textured
+from photo_pipeline import jpeg_budget
+
+
+@pytest.mark.parametrize("threshold", [60, 61, 73, 94, 95])
+def test_highest_and_lowest_match_linear_search(threshold):
+    qualities = range(60, 96)
+    assert jpeg_budget.highest(60, 95, lambda q: q <= threshold) == max(q for q in qualities if q <= threshold)
+    assert jpeg_budget.lowest(60, 95, lambda q: q >= threshold) == min(q for q in qualities if q >= threshold)
+
+
+def test_bisection_without_a_passing_quality_returns_the_bound():
+    assert jpeg_budget.highest(60, 95, lambda q: False) == 60
+    assert jpeg_budget.lowest(60, 95, lambda q: False) == 95
+
+
+def test_inactive_budget_is_one_optimized_pass():
+    img = textured(300, 400)
+    budget = jpeg_budget.JpegBudget()
+    assert not budget.active and budget.params() == {}
+    data, quality = budget.encode(img, 95)
+    assert quality == 95
+    assert data == jpeg_budget.encode_jpeg(img, 95, optimize=True)
+
+
+def test_size_budget_picks_the_highest_quality_that_fits():
+    img = textured(300, 400)
+    max_kb = len(jpeg_budget.encode_jpeg(img, 80)) / 1024
+    budget = jpeg_budget.JpegBudget(max_kb=max_kb)
+    data, quality = budget.encode(img, 95)
+    assert len(data) <= budget.max_bytes
+    assert 80 <= quality < 95
+    assert len(jpeg_budget.encode_jpeg(img, quality + 1)) > budget.max_bytes
+
+
+def test_budget_below_min_quality_stops_at_min_quality():
+    img = textured(300, 400)
+    data, quality = jpeg_budget.JpegBudget(max_kb=0.5, min_quality=70).encode(img, 95)
+    assert quality == 70
+
+
+def test_ssim_threshold_picks_the_lowest_quality_that_passes():
+    img = textured(300, 400)
+    budget = jpeg_budget.JpegBudget(min_ssim=0.97)
+    data, quality = budget.encode(img, 95)
+    reference = jpeg_budget.SsimReference(img)
+    assert reference.ssim(data) >= 0.97
+    if quality > budget.min_quality:
+        assert reference.ssim(jpeg_budget.encode_jpeg(img, quality - 1)) < 0.97
+
+
+def test_ssim_of_lossless_copy_is_one():
+    img = textured(64, 64)
+    reference = jpeg_budget.SsimReference(img)
+    assert reference.ssim(jpeg_budget.encode_jpeg(img, 100)) > 0.99
+    assert reference.ssim(jpeg_budget.encode_jpeg(img, 100)) > reference.ssim(jpeg_budget.encode_jpeg(img, 20))
+
+
+def test_params_change_with_budget():
+    assert jpeg_budget.JpegBudget(max_kb=150).params() != jpeg_budget.JpegBudget(max_kb=100).params()
+    assert jpeg_budget.JpegBudget(min_ssim=0.98).params()["min_ssim"] == 0.98
@@ -0,0 +1,127 @@
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from photo_pipeline.payload_upload import PayloadUploader, encode_payload
+from photo_pipeline.upscalers import ReplicateUpscaler
+
+
+class FakeClient:
+    """Клиент Replicate без сети: files.create отдает ссылку, run — ошибку (fail > 0) или байты"""
+
+    def __init__(self, fail=0):
+        self.uploads = []
+        self.runs = []
+        self.fail = fail
+        self.files = SimpleNamespace(create=self.create)
+
+    def create(self, file, filename, content_type):
+        self.uploads.append(filename)
+        return SimpleNamespace(urls={"get": f"https://files.test/{len(self.uploads)}/{filename}"})
+
+    def run(self, model, input):
+        self.runs.append(input["image"])
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("prediction failed")
+        return io.BytesIO(b"result")
+
+
+def test_payload_is_lossless_and_not_bigger_than_source(photo):
+    src = photo("a.png", 200, 150)
+    data, filename, content_type, original = encode_payload(src)
+    assert len(data) <= original == src.stat().st_size
+    with Image.open(src) as before, Image.open(io.BytesIO(data)) as after:
+        assert list(after.convert("RGB").getdata()) == list(before.convert("RGB").getdata())
+    assert content_type.startswith("image/")
+
+
+def test_jpeg_is_sent_as_is(photo):
+    src = photo("a.jpg", 200, 150, quality=90)
+    data, filename, content_type, original = encode_payload(src)
+    assert data == src.read_bytes()
+    assert (filename, content_type) == ("a.jpg", "image/jpeg")
+
+
+def test_lossless_source_is_transcoded_once(photo, monkeypatch):
+    from photo_pipeline import payload_upload
+
+    calls = []
+    encode = payload_upload.encode_variant
+    monkeypatch.setattr(payload_upload, "encode_variant", lambda *args: calls.append(args[1]) or encode(*args))
+    encode_payload(photo("a.png", 200, 150))
+    assert calls == ["webp"]
+    monkeypatch.setattr(payload_upload.features, "check", lambda feature: False)  # Pillow без libwebp
+    assert payload_upload.pick_format(("webp", "png")) == "png"
+
+
+def test_retries_reuse_the_uploaded_url(photo):
+    src = photo("a.png")
+    client = FakeClient(fail=2)
+    upscaler = ReplicateUpscaler("model", client, PayloadUploader(client))
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            upscaler.predict(src)
+    upscaler.predict(src)
+    assert len(client.uploads) == 1
+    assert len(set(client.runs)) == 1 and len(client.runs) == 3
+    assert upscaler.uploader.reused == 2
+
+
+def test_url_is_forgotten_after_successful_predict(photo):
+    src = photo("a.png")
+    client = FakeClient()
+    uploader = PayloadUploader(client)
+    upscaler = ReplicateUpscaler("model", client, uploader)
+    upscaler.predict(src)
+    assert uploader.urls == {} and uploader.payloads == {}
+    upscaler.predict(src)  # Новый запуск для того же фото — новая загрузка
+    assert len(client.uploads) == 2
+
+
+def test_replaced_file_is_uploaded_again(photo):
+    src = photo("a.png", seed=1)
+    client = FakeClient(fail=1)
+    uploader = PayloadUploader(client)
+    with pytest.raises(RuntimeError):
+        ReplicateUpscaler("model", client, uploader).predict(src)
+
+    photo("a.png", 130, 170, seed=2)  # Другое фото под тем же именем
+    stat = src.stat()
+    os.utime(src, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert uploader.cached_url(src) is None
+    uploader.url_for(src)
+    assert len(client.uploads) == 2
+
+
+def test_final_failure_releases_payload_and_url(photo):
+    src = photo("a.png")
+    client = FakeClient(fail=1)
+    uploader = PayloadUploader(client)
+    upscaler = ReplicateUpscaler("model", client, uploader)
+    with pytest.raises(RuntimeError):
+        upscaler.predict(src)
+    assert str(src) in uploader.urls
+    upscaler.forget(src)  # Так делает пайплайн, когда повторов больше не будет
+    assert uploader.urls == {} and uploader.payloads == {}
+
+
+def test_failed_tiles_are_forgotten(tmp_path, photo):
+    from photo_pipeline import tiled_upscale
+
+    src = photo("big.png", 300, 200)
+    output = tmp_path / "upscaled_big.png"
+    _, _, jobs = tiled_upscale.split_tiles(src, tiled_upscale.work_dir_for(output), 128, 16)
+    client = FakeClient(fail=len(jobs))
+    uploader = PayloadUploader(client)
+    upscaler = ReplicateUpscaler("model", client, uploader)
+    for tile_in, _ in jobs:
+        with pytest.raises(RuntimeError):
+            upscaler.predict(tile_in)
+    jobs[0][0].with_name("tile_0_0_up.part.png").write_bytes(b"")  # Недокачанный результат — не вход тайла
+    assert len(uploader.urls) == len(jobs)
+    tiled_upscale.forget_tiles(upscaler, output)
+    assert uploader.urls == {} and uploader.payloads == {}
@@ -0,0 +1,80 @@
+import pytest
+from PIL import Image
+
+from conftest import textured
+from photo_pipeline import renditions, wb_prepare
+
+
+def test_parse_rendition_defaults(tmp_path):
+    rendition = renditions.parse_rendition("thumb:300x400", tmp_path)
+    assert rendition[:6] == ("thumb", 300, 400, renditions.DEFAULT_MODE, renditions.DEFAULT_FORMAT, renditions.DEFAULT_QUALITY)
+    assert rendition.budget is None
+    assert rendition.folder == str(tmp_path / "thumb")
+
+
+def test_parse_rendition_options_in_any_order():
+    rendition = renditions.parse_rendition("t:300X400:80:WEBP:fit")
+    assert (rendition.mode, rendition.fmt, rendition.quality) == ("fit", "webp", 80)
+    assert renditions.parse_rendition("j:10x10:jpeg").fmt == "jpg"
+    assert renditions.parse_rendition("b:10x10:150kb").budget.max_bytes == 150 * 1024
+
+
+@pytest.mark.parametrize("text", [
+    "bad", ":10x10", "x:10by10", "x:0x10", "x:10x10:foo", "x:10x10:101", "x:10x10:0",
+    "x:10x10:webp:50kb", "x:10x10:abckb", "../up:10x10", "a/b:10x10", ".hidden:10x10",
+])
+def test_parse_rendition_rejects_bad_specs(text):
+    with pytest.raises(ValueError):
+        renditions.parse_rendition(text)
+
+
+@pytest.mark.parametrize("mode, size, expected", [
+    ("crop", (300, 300), (300, 300)),
+    ("fit", (300, 300), (225, 300)),
+    ("pad", (300, 300), (300, 300)),
+    ("fit", (1000, 1000), (750, 1000)),  # fit вписывает целиком, даже если это увеличение
+])
+def test_render_sizes(mode, size, expected):
+    rendition = renditions.Rendition("r", *size, mode, "png", 90, None, "")
+    frame = renditions.render(renditions.Pyramid(textured(600, 800)), rendition)
+    assert frame.size == expected
+    if mode == "pad":
+        assert frame.getpixel((0, 0)) == renditions.PAD_COLOR
+
+
+def test_pyramid_picks_smallest_level_still_gap_times_larger():
+    pyramid = renditions.Pyramid(textured(3200, 3200))
+    level, box = pyramid.source_for((0, 0, 3200, 3200), (200, 200))
+    assert level.size == (800, 800)  # 800 / 200 = 4 ≥ PYRAMID_GAP, 400 / 200 = 2 уже меньше
+    assert box == (0, 0, 800, 800)
+    level, _ = pyramid.source_for((0, 0, 3200, 3200), (1600, 1600))
+    assert level.size == (3200, 3200)
+
+
+def test_render_file_writes_every_rendition(tmp_path, photo):
+    src = photo("a.png", 600, 800)
+    specs = ["t:150x200:webp", "p:400x200:pad:png", "c:100x100"]
+    extra = [renditions.parse_rendition(spec, tmp_path / "r") for spec in specs]
+    saved = renditions.render_file(src, extra)
+    assert [path.relative_to(tmp_path / "r").as_posix() for path in saved] == ["t/a.webp", "p/a.png", "c/a.jpg"]
+    assert [Image.open(path).size for path in saved] == [(150, 200), (400, 200), (100, 100)]
+
+
+@pytest.mark.parametrize("name, size, wb_size", [
+    ("big.jpg", (2700, 3600), (300, 400)),
+    ("big.jpg", (2700, 3600), (900, 1200)),
+    ("alpha.png", (1200, 1600), (300, 400)),
+])
+def test_wb_jpeg_does_not_depend_on_extra_renditions(tmp_path, photo, name, size, wb_size):
+    src = photo(name, *size)
+    if name.endswith(".png"):
+        Image.open(src).convert("RGBA").save(src)
+    wb_dir = tmp_path / "wb"
+    wb_dir.mkdir()
+    alone = wb_prepare.prepare_image(src, wb_dir, *wb_size, 95)
+    expected = alone.read_bytes()
+    for specs in (["big:1800x2400", "t:200x200:webp"], ["small:100x100"]):
+        extra = [renditions.parse_rendition(spec, tmp_path / "r") for spec in specs]
+        with_extra = wb_prepare.prepare_image(src, wb_dir, *wb_size, 95, extra=extra)
+        assert with_extra == alone
+        assert with_extra.read_bytes() == expected
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from photo_pipeline import safe_download
+
+
+async def chunked(data, size=1000):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@pytest.mark.parametrize("name, save_args", [("a.png", {}), ("a.jpg", {"quality": 90}), ("a.webp", {"quality": 80})])
+def test_check_image_accepts_whole_and_rejects_truncated(photo, name, save_args):
+    path = photo(name, **save_args)
+    safe_download.check_image(path)
+    path.write_bytes(path.read_bytes()[:-100])
+    with pytest.raises(ValueError, match="оборван"):
+        safe_download.check_image(path)
+
+
+def test_commit_keeps_the_old_file_when_download_is_truncated(tmp_path, photo):
+    output = photo("upscaled_a.png", seed=1)
+    before = output.read_bytes()
+    tmp = safe_download.partial_path(output)
+    tmp.write_bytes(photo("new.png", seed=2).read_bytes()[:-50])
+    with pytest.raises(ValueError):
+        safe_download.commit(tmp, output, fsync=False)
+    assert output.read_bytes() == before
+    assert not tmp.exists()
+
+
+def test_save_stream_replaces_atomically(tmp_path, photo):
+    data = photo("src.png").read_bytes()
+    output = tmp_path / "out.png"
+    safe_download.save_stream([data[:10], data[10:]], output)
+    assert output.read_bytes() == data
+    assert not safe_download.partial_path(output).exists()
+
+
+def test_asave_stream_cleans_up_after_broken_stream(tmp_path):
+    async def broken():
+        yield b"\x89PNG\r\n\x1a\n"
+        raise ConnectionError("peer closed connection")
+
+    output = tmp_path / "out.png"
+    with pytest.raises(ConnectionError):
+        asyncio.run(safe_download.asave_stream(broken(), output))
+    assert not output.exists() and not safe_download.partial_path(output).exists()
+
+
+@pytest.mark.parametrize("max_size, rolled", [(1 << 30, False), (4096, True)])
+def test_spool_stream_keeps_only_a_small_buffer_in_memory(photo, max_size, rolled):
+    data = photo("src.png", 300, 400).read_bytes()
+    assert len(data) > 4096
+    with asyncio.run(safe_download.aspool_stream(chunked(data), max_size)) as spool:
+        assert spool._rolled is rolled  # Больше max_size — уже во временном файле на диске
+        assert spool.tell() == 0
+        assert spool.read() == data
+
+
+def test_wb_from_spooled_download_matches_wb_from_bytes(tmp_path, photo):
+    from photo_pipeline import wb_prepare
+
+    data = photo("master.png", 1200, 1600).read_bytes()
+    (tmp_path / "from_bytes").mkdir()
+    (tmp_path / "from_spool").mkdir()
+    expected = wb_prepare.prepare_image(tmp_path / "upscaled_a.png", tmp_path / "from_bytes", 300, 400, 90, data)
+    with asyncio.run(safe_download.aspool_stream(chunked(data, 65536), 4096)) as spool:
+        result = wb_prepare.prepare_image(tmp_path / "upscaled_a.png", tmp_path / "from_spool", 300, 400, 90, spool)
+    assert result.read_bytes() == expected.read_bytes()
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from photo_pipeline import tiled_upscale
+
+
+@pytest.mark.parametrize("length", [1, 100, 1023, 1024, 1025, 2000, 3072, 4097])
+@pytest.mark.parametrize("tile, overlap", [(1024, 64), (512, 32), (256, 200)])
+def test_axis_spans_cover_the_side_and_only_neighbours_overlap(length, tile, overlap):
+    spans = tiled_upscale.axis_spans(length, tile, overlap)
+    assert spans[0][0] == 0 and spans[-1][1] == length
+    assert all(0 < end - start <= tile for start, end in spans)
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert start < next_start < end < next_end  # Перекрываются, без дыр
+    for first, third in zip(spans, spans[2:]):
+        assert first[1] <= third[0]  # Через одного — уже не перекрываются
+
+
+def test_small_side_is_one_tile():
+    assert tiled_upscale.axis_spans(700, 1024, 64) == [(0, 700)]
+
+
+@pytest.mark.parametrize("length", [700, 1500, 2048, 3001])
+def test_axis_weights_sum_to_one_everywhere(length):
+    spans = tiled_upscale.axis_spans(length, 512, 64)
+    total = np.zeros(length, dtype=np.float32)
+    for (start, end), weight in zip(spans, tiled_upscale.axis_weights(spans)):
+        assert weight.shape == (end - start,)
+        assert np.all(weight > 0)
+        total[start:end] += weight
+    np.testing.assert_allclose(total, 1.0, atol=1e-6)
+
+
+def test_needs_tiling_by_header(photo):
+    path = photo("a.png", 200, 100)
+    assert tiled_upscale.needs_tiling(path, 19_999)
+    assert not tiled_upscale.needs_tiling(path, 20_000)
+    assert not tiled_upscale.needs_tiling(path, 0)  # 0 — тайлы выключены
@@ -0,0 +1,80 @@
+import os
+import shutil
+import time
+
+from photo_pipeline import upscale_cache
+
+
+def test_key_depends_on_content_and_model_not_name(tmp_path, photo):
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache")
+    a = photo("a.png")
+    renamed = tmp_path / "renamed.png"
+    shutil.copy(a, renamed)
+    assert cache.key_for(a, "m1") == cache.key_for(renamed, "m1")
+    assert cache.key_for(a, "m1") != cache.key_for(a, "m2")
+    assert cache.key_for(a, "m1") != cache.key_for(photo("b.png", seed=1), "m1")
+
+
+def test_stored_result_is_restored_for_same_content(tmp_path, photo):
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache")
+    src, out = photo("a.png"), tmp_path / "upscaled_a.png"
+    key, status = cache.restore(src, out, "m")
+    assert status is None
+    out.write_bytes(b"upscaled")
+    cache.store(key, out)
+
+    other = tmp_path / "upscaled_copy.png"
+    shutil.copy(src, tmp_path / "copy.png")
+    assert cache.restore(tmp_path / "copy.png", other, "m") == (key, "hit")
+    assert other.read_bytes() == b"upscaled"
+
+
+def test_existing_output_is_not_adopted_for_another_model(tmp_path, photo):
+    """Результат старой модели (или не из кэша) не выдается за результат новой"""
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache")
+    src, out = photo("a.png"), tmp_path / "upscaled_a.png"
+    time.sleep(0.01)
+    out.write_bytes(b"made by the old model")
+    key, status = cache.restore(src, out, "new-model")
+    assert status is None
+    assert not out.exists()
+    assert not cache.path_for(key).exists()
+
+
+def test_changed_source_with_preserved_mtime_is_redone(tmp_path, photo):
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache")
+    src, out = photo("a.png"), tmp_path / "upscaled_a.png"
+    key, _ = cache.restore(src, out, "m")
+    out.write_bytes(b"old result")
+    cache.store(key, out)
+
+    stat = src.stat()
+    photo("a.png", seed=1)
+    os.utime(src, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # Как cp -p / rsync -a
+    new_key, status = cache.restore(src, out, "m")
+    assert new_key != key and status is None
+    assert not out.exists()
+    assert cache.path_for(key).read_bytes() == b"old result"  # Запись кэша не тронута
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache", max_gb=2500 / 1024 ** 3)
+    for i, name in enumerate("abc"):
+        src = tmp_path / name
+        src.write_bytes(bytes(1000))
+        cache.store(f"{i}{name}" * 8, src)
+        entry = cache.path_for(f"{i}{name}" * 8)
+        os.utime(entry, (i, i))  # a — самая старая
+    assert cache.total_bytes <= cache.max_bytes
+    assert not cache.path_for("0a" * 8).exists()
+    assert cache.path_for("2c" * 8).exists()
+
+
+def test_store_twice_counts_once(tmp_path):
+    cache = upscale_cache.UpscaleCache(tmp_path / "cache")
+    src = tmp_path / "x"
+    src.write_bytes(bytes(100))
+    cache.store("ab" * 8, src)
+    cache.store("ab" * 8, src)
+    assert cache.total_bytes == 100
+    assert upscale_cache.UpscaleCache(tmp_path / "cache").total_bytes == 100
@@ -0,0 +1,51 @@
+import pytest
+
+from photo_pipeline import upscale_planner
+from photo_pipeline.upscale_planner import ROUTE_LOCAL, ROUTE_REMOTE, ROUTE_RESAMPLE, UpscalePlanner
+
+
+@pytest.mark.parametrize("size, backend, route", [
+    ((900, 1200), "replicate", ROUTE_RESAMPLE),   # Уже нужного размера
+    ((2000, 3000), "replicate", ROUTE_RESAMPLE),  # Больше цели — только уменьшить
+    ((720, 960), "replicate", ROUTE_RESAMPLE),    # Ровно x1.25
+    ((700, 960), "replicate", ROUTE_REMOTE),
+    ((700, 960), "auto", ROUTE_LOCAL),
+    ((450, 600), "auto", ROUTE_LOCAL),            # Ровно x2
+    ((440, 600), "auto", ROUTE_REMOTE),
+    ((100, 100), "local", ROUTE_LOCAL),
+])
+def test_route_for_size(size, backend, route):
+    planner = UpscalePlanner(900, 1200, backend=backend)
+    assert planner.route_for_size(*size)[0] == route
+
+
+def test_scale_is_what_the_center_crop_needs():
+    # Широкое фото: кроп по высоте — увеличивать надо по высоте
+    assert upscale_planner.required_scale(1200, 600, 900, 1200) == 2.0
+    assert upscale_planner.required_scale(600, 1200, 900, 1200) == 1.5
+
+
+def test_route_for_reads_only_the_header(photo):
+    planner = UpscalePlanner(900, 1200)
+    assert planner.route_for(photo("small.png", 300, 400)) == (ROUTE_REMOTE, 3.0)
+    assert planner.route_for(photo("big.jpg", 900, 1200)) == (ROUTE_RESAMPLE, 1.0)
+
+
+def test_passthrough_places_the_source_under_the_output_name(tmp_path, photo):
+    src = photo("a.png")
+    output = tmp_path / "final" / "upscaled_a.png"
+    output.parent.mkdir()
+    upscale_planner.passthrough(src, output)
+    assert output.read_bytes() == src.read_bytes()
+    upscale_planner.passthrough(src, output)  # Повтор поверх готового — без ошибки
+
+
+def test_record_and_report(capsys):
+    planner = UpscalePlanner(900, 1200)
+    planner.record(ROUTE_RESAMPLE)
+    planner.record(ROUTE_REMOTE, 2.5)
+    planner.record(upscale_planner.ROUTE_CACHED)
+    planner.report()
+    out = capsys.readouterr().out
+    assert "Replicate 1 (2.5 сек)" in out
+    assert out.rstrip().endswith("сэкономлено: 2")
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+cv2 = pytest.importorskip("cv2")
+
+from conftest import textured  # noqa: E402
+from photo_pipeline.watermark_detect import REFERENCE_H, REFERENCE_W, WatermarkDetector, WatermarkProfile  # noqa: E402
+
+
+def logo_alpha():
+    """Знак с четким контуром: рамка и буква на прозрачном фоне"""
+    alpha = Image.new("L", (60, 40), 0)
+    draw = ImageDraw.Draw(alpha)
+    draw.rectangle((2, 2, 57, 37), outline=255, width=3)
+    draw.polygon([(12, 32), (22, 8), (32, 32), (26, 32), (22, 20), (18, 32)], fill=255)
+    draw.ellipse((38, 12, 52, 28), outline=255, width=3)
+    return np.asarray(alpha)
+
+
+def stamped(scale=1.0, at=(740, 1180)):
+    """Фото эталонного размера (или в scale раз больше) с белым знаком в правом нижнем углу"""
+    width, height = round(REFERENCE_W * scale), round(REFERENCE_H * scale)
+    image = textured(width, height, seed=3)
+    mark = Image.fromarray(logo_alpha()).resize((round(60 * scale), round(40 * scale)), Image.Resampling.LANCZOS)
+    position = (round(at[0] * scale), round(at[1] * scale))
+    image.paste(Image.new("RGB", mark.size, "white"), position, mark)
+    return image, position
+
+
+@pytest.fixture
+def detector():
+    return WatermarkDetector([WatermarkProfile("logo", logo_alpha())])
+
+
+@pytest.mark.parametrize("scale", [1.0, 2.0])
+def test_finds_the_mark_where_it_was_put(detector, scale):
+    image, (x, y) = stamped(scale)
+    score, (found_x, found_y), alpha = detector.detect(image)
+    assert score >= detector.threshold
+    tolerance = 3 * scale
+    assert abs(found_x - x) <= tolerance and abs(found_y - y) <= tolerance
+    assert alpha.shape == pytest.approx((40 * scale, 60 * scale), abs=scale)
+
+
+def test_clean_photo_has_no_mark(detector):
+    assert detector.detect(textured(REFERENCE_W, REFERENCE_H, seed=3)) is None
+    assert detector.mask_for(Image.new("RGB", (REFERENCE_W, REFERENCE_H), "gray")) is None  # Однотонный угол
+
+
+def test_mask_covers_the_mark_with_margin(detector):
+    image, (x, y) = stamped()
+    mask = np.asarray(detector.mask_for(image))
+    assert mask.shape == (image.height, image.width)
+    assert mask[y + 3, x + 3] == 255 and mask[y - 3, x + 3] == 255  # Рамка знака и запас над ней
+    assert mask[:y - 20].max() == 0 and mask[:, :x - 20].max() == 0
+
+
+def test_mark_at_the_edge_is_clipped_to_the_frame(detector):
+    image, _ = stamped(at=(REFERENCE_W - 60, REFERENCE_H - 40))
+    mask = detector.mask_for(image)
+    assert mask.size == image.size
+    assert np.asarray(mask)[-1, -1] == 255
@@ -0,0 +1,132 @@
+import os
+import time
+
+import pytest
+
+from photo_pipeline import work_leases
+
+
+@pytest.mark.parametrize("text, expected", [("1/1", (0, 1)), ("2/4", (1, 4)), ("4/4", (3, 4))])
+def test_parse_shard(text, expected):
+    assert work_leases.parse_shard(text) == expected
+
+
+@pytest.mark.parametrize("text", ["0/4", "5/4", "1", "a/b", "1/0", None])
+def test_parse_shard_rejects_bad_values(text):
+    with pytest.raises(ValueError):
+        work_leases.parse_shard(text)
+
+
+def test_source_stem_strips_prefix_only_in_master_dir(tmp_path):
+    masters = tmp_path / "final_upscaled"
+    assert work_leases.source_stem(masters / "upscaled_a.png", masters) == "a"
+    assert work_leases.source_stem(tmp_path / "input" / "a.jpg", masters) == "a"
+    # Исходник, который сам называется upscaled_*, — имя не меняется ни на одном шаге
+    assert work_leases.source_stem(tmp_path / "input" / "upscaled_b.jpg", masters) == "upscaled_b"
+    assert work_leases.source_stem(tmp_path / "output" / "upscaled_b.png", masters) == "upscaled_b"
+    assert work_leases.source_stem(masters / "upscaled_upscaled_b.png", masters) == "upscaled_b"
+
+
+def test_every_photo_lands_in_one_shard_on_every_step(tmp_path):
+    masters = tmp_path / "final_upscaled"
+    names = [f"p{i:03d}" for i in range(200)] + ["upscaled_x", "фото 1"]
+    for name in names:
+        steps = [tmp_path / "input" / f"{name}.jpg", tmp_path / "output" / f"{name}.png", masters / f"upscaled_{name}.png"]
+        owners = {index for index in range(3) for path in steps if work_leases.in_shard(path, (index, 3), masters)}
+        assert len(owners) == 1, name
+        assert all(work_leases.in_shard(path, None) for path in steps)
+
+
+def test_rotated_is_a_rotation():
+    images = list(range(10))
+    rotations = [images[k:] + images[:k] for k in range(len(images))]
+    for node in ("a", "b", "host:1"):
+        assert work_leases.rotated(images, node) in rotations
+        assert work_leases.rotated(images, node) == work_leases.rotated(images, node)
+    assert work_leases.rotated([], "a") == []
+
+
+@pytest.fixture(params=["files", "sqlite"])
+def open_node(request, tmp_path):
+    """Фабрика машин над одной общей арендой: open_node("a", ttl)"""
+    where = tmp_path / ("leases" if request.param == "files" else "leases.sqlite3")
+    opened = []
+
+    def make(node, ttl=60):
+        leases = work_leases.open_leases(where, node, ttl, tmp_path / "final_upscaled")
+        opened.append(leases)
+        return leases
+
+    yield make
+    for leases in opened:
+        leases.close()
+
+
+def test_photo_goes_to_one_node_and_done_is_shared(open_node, photo):
+    src = photo("input/a.jpg")
+    a, b = open_node("a"), open_node("b")
+    assert a.claim(src)
+    assert not b.claim(src)
+
+    a.release(src, done=True)
+    assert b.done(src)
+    assert not b.claim(src)
+
+    time.sleep(0.01)
+    photo("input/a.jpg", seed=1)  # Фото заменили — готовое больше не считается
+    assert not b.done(src)
+    assert b.claim(src)
+
+
+def test_released_unfinished_photo_can_be_taken_by_another_node(open_node, photo):
+    src = photo("input/a.jpg")
+    a, b = open_node("a"), open_node("b")
+    assert a.claim(src)
+    a.release(src, done=False)
+    assert not a.done(src)
+    assert b.claim(src)
+
+
+def test_lease_taken_by_input_path_is_released_by_master_path(open_node, photo, tmp_path):
+    src = photo("input/a.jpg")
+    a, b = open_node("a"), open_node("b")
+    assert a.claim(src)
+    a.release(tmp_path / "final_upscaled" / "upscaled_a.png", done=False)
+    assert a.held == {}
+    assert b.claim(src)
+
+
+def test_expired_lease_is_taken_over_and_old_owner_loses_it(open_node, photo):
+    src = photo("input/a.jpg")
+    a, b = open_node("a", ttl=0.2), open_node("b", ttl=0.2)
+    assert a.claim(src)
+    assert not b.claim(src)
+    time.sleep(0.3)
+    assert b.claim(src)
+    a.renew()
+    assert a.lost == 1 and a.held == {}
+
+
+def test_close_releases_held_photos(open_node, photo):
+    src = photo("input/a.jpg")
+    a, b = open_node("a"), open_node("b")
+    assert a.claim(src)
+    a.close()
+    assert b.claim(src)
+
+
+def test_missing_file_is_not_claimed(open_node, tmp_path):
+    a = open_node("a")
+    assert not a.claim(tmp_path / "input" / "gone.jpg")
+    assert a.done(tmp_path / "input" / "gone.jpg")
+
+
+def test_file_leases_ignore_foreign_files(tmp_path, photo):
+    """Чужой .lease без JSON не ломает продление: аренда просто считается потерянной"""
+    src = photo("input/a.jpg")
+    a = work_leases.FileLeases(tmp_path / "leases", "a", 60, tmp_path / "final_upscaled")
+    assert a.claim(src)
+    (tmp_path / "leases" / "a.lease").write_text("garbage")
+    a.renew()
+    assert a.lost == 1
+    assert not os.path.exists(tmp_path / "leases" / "a.done")